@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Pack the booth's UI images into a single pre-decoded bundle, and read them back out of it
+# Build (or rebuild) the bundle after changing any image with:
+#    python AssetBundle.py
+# At runtime the bundle is memory mapped, so an image costs a copy out of the page cache
+#    rather than a read and PNG/JPEG decode from the SD card.
+
+import os
+import glob
+import json
+import mmap
+
+import config
+
+# Entries start on page boundaries, so they can be mapped and read without touching their neighbours
+page_size = 4096
+
+
+# Every image file referenced in config.py, plus all of the accompaniment (badge) images
+def get_ui_image_files():
+    image_files = []
+    for name in sorted(dir(config)):
+        value = getattr(config, name)
+        if isinstance(value, str) and os.path.splitext(value)[1].lower() in ('.png', '.jpg'):
+            image_files.append(value)
+
+    accompany_dir = os.path.join(config.images_dir, 'accompany')
+    image_files += sorted(glob.glob(os.path.join(accompany_dir, '*.png')))
+    image_files += sorted(glob.glob(os.path.join(accompany_dir, '*.jpg')))
+
+    return [image_file for image_file in image_files if os.path.isfile(image_file)]
+
+
+# Decode each of image_files and write their raw pixels into bundle_file,
+#    with a JSON manifest of where each one is in manifest_file
+def build_bundle(image_files, bundle_file, manifest_file):
+    from PIL import Image
+
+    entries = {}
+    offset = 0
+
+    with open(bundle_file + '.tmp', 'wb') as out_file:
+        for image_file in image_files:
+            img = Image.open(image_file)
+            if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+                img = img.convert('RGBA')
+            else:
+                img = img.convert('RGB')
+
+            pixels = img.tobytes()
+
+            # Pad to the start of the next page
+            padding = (page_size - offset % page_size) % page_size
+            out_file.write(b'\0' * padding)
+            offset += padding
+
+            out_file.write(pixels)
+
+            entries[image_file] = {
+                'mode': img.mode,
+                'size': list(img.size),
+                'offset': offset,
+                'length': len(pixels),
+                'mtime': os.path.getmtime(image_file),
+            }
+            offset += len(pixels)
+
+            print "Bundled " + image_file + " (" + img.mode + " " + str(img.size[0]) + "x" + str(img.size[1]) + ")"
+
+    with open(manifest_file + '.tmp', 'w') as out_file:
+        json.dump({'version': 1, 'entries': entries}, out_file, indent=2, sort_keys=True)
+
+    # Swap the new files in only once they are complete
+    os.rename(bundle_file + '.tmp', bundle_file)
+    os.rename(manifest_file + '.tmp', manifest_file)
+
+
+class AssetBundle(object):
+    'Read-only, memory mapped access to the pre-decoded UI images in a bundle file'
+
+    def __init__(self, bundle_file, manifest_file):
+        with open(manifest_file) as in_file:
+            self.entries = json.load(in_file)['entries']
+
+        # Leave out any image that has changed since it was bundled. This is checked once, here,
+        #    so that looking an image up doesn't touch the SD card
+        for image_file, entry in list(self.entries.items()):
+            try:
+                if os.path.getmtime(image_file) != entry['mtime']:
+                    print "Bundled image " + image_file + " has changed: run 'python AssetBundle.py' to rebuild"
+                    del self.entries[image_file]
+            except OSError:
+                # The original has gone, but the bundled copy is still good
+                pass
+
+        self.bundle = open(bundle_file, 'rb')
+        self.bundle_map = mmap.mmap(self.bundle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self.bundle_map.close()
+        self.bundle.close()
+
+    def get_image_files(self):
+        return sorted(self.entries.keys())
+
+    # Return the manifest entry for image_file, or None if it isn't bundled (or had changed when the bundle was opened)
+    def get_entry(self, image_file):
+        return self.entries.get(image_file)
+
+    def get_pixels(self, entry):
+        return self.bundle_map[entry['offset']:entry['offset'] + entry['length']]
+
+    # Return image_file as a pygame Surface (not yet converted to the display format), or None
+    def get_surface(self, image_file):
+        import pygame
+
+        entry = self.get_entry(image_file)
+        if entry is None:
+            return None
+
+        return pygame.image.fromstring(self.get_pixels(entry), tuple(entry['size']), entry['mode'])
+
+    # Return image_file as a PIL Image, or None
+    def get_image(self, image_file):
+        from PIL import Image
+
+        entry = self.get_entry(image_file)
+        if entry is None:
+            return None
+
+        return Image.frombytes(entry['mode'], tuple(entry['size']), self.get_pixels(entry))
+
+
+# Open the bundle named in config, or return None if it hasn't been built
+def open_asset_bundle():
+    if not (os.path.isfile(config.asset_bundle_file) and os.path.isfile(config.asset_manifest_file)):
+        return None
+
+    try:
+        return AssetBundle(config.asset_bundle_file, config.asset_manifest_file)
+    except (EnvironmentError, ValueError, KeyError) as e:
+        print "Error opening asset bundle: ", e
+        return None
+
+
+if __name__ == '__main__':
+    build_bundle(get_ui_image_files(), config.asset_bundle_file, config.asset_manifest_file)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# Benchmarks for the photo processing pipeline, to catch a change (or a Pillow upgrade) that makes the booth slower
+# They run on any Linux box, on synthetic photos at each of the capture resolutions below. Each benchmark
+#    (at each resolution) runs in a child process of its own, so that its peak memory use can be measured.
+#        python Benchmark.py                           - run them all, and print the results
+#        python Benchmark.py --save-baseline FILE      - ... and keep the results, as JSON, to compare with later
+#        python Benchmark.py --baseline FILE           - ... and fail if any benchmark has got slower, or uses more
+#                                                         memory, than in FILE by more than the thresholds
+# Baselines are only comparable on the same machine.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+# From the review screen size, up to the full resolution of the v1 and v2 camera modules
+resolutions = [(880, 440), (1640, 820), (2592, 1944), (3280, 2464)]
+
+# Fail if a benchmark takes this much longer (or uses this much more memory) than its baseline
+default_max_slowdown = 0.25
+default_max_memory_growth = 0.25
+
+# Time each benchmark for at least this long (but no more than max_runs runs)
+min_time_secs = 1.0
+max_runs = 50
+
+# The formats that prepare_one_image makes of each photo
+benchmark_image_defs = [
+    ['large', 1760, 880, 72],
+    ['medium', 880, 440, 72],
+    ['thumb', 220, 110, 72],
+]
+
+
+# A photo-like test image: smooth areas, hard edges and sensor noise, which compresses about as well as a photo
+def make_capture(size):
+    from PIL import Image
+
+    return Image.merge('RGB', [
+        Image.effect_mandelbrot(size, (-2.0, -1.25, 1.0, 1.25), 64),
+        Image.linear_gradient('L').resize(size),
+        Image.effect_noise(size, 48),
+    ])
+
+
+# A badge to superimpose onto a photo: transparent, apart from a block in one corner
+def make_overlay(size):
+    from PIL import Image
+
+    overlay_img = Image.new('RGBA', size, (0, 0, 0, 0))
+    overlay_img.paste((255, 255, 255, 200), (0, 0, size[0] // 3, size[1] // 3))
+    return overlay_img
+
+
+def save_capture(work_dir, size, filename='photobooth-01.jpg'):
+    capture_file = os.path.join(work_dir, filename)
+    make_capture(size).save(capture_file, quality=85)
+    return capture_file
+
+
+# Return a FileHandler, with its local directories in the benchmark's work_dir (see run_benchmark())
+def make_file_handler():
+    from FileHandler import FileHandler
+
+    return FileHandler()
+
+
+# Each benchmark sets itself up in work_dir, for photos of 'size', and returns the function to time
+
+def setup_resize_image(work_dir, size):
+    from PhotoHandler import resize_image
+
+    capture_file = save_capture(work_dir, size)
+    return lambda: resize_image(capture_file, 880, 440)
+
+
+def setup_prepare_one_image(work_dir, size):
+    from PhotoHandler import prepare_one_image_file
+
+    filehandler = make_file_handler()
+    capture_file = save_capture(filehandler.get_local_file_dir(), size)
+    upload_dir = filehandler.get_upload_file_dir()
+
+    # (without the derivative cache, which would make every run after the first free)
+    return lambda: prepare_one_image_file(capture_file, benchmark_image_defs, False, upload_dir, filehandler)
+
+
+def setup_badge_composite(work_dir, size):
+    from Photo import composite_overlay
+
+    capture_img = make_capture(size)
+    overlay_img = make_overlay(size)
+    return lambda: composite_overlay(capture_img, overlay_img)
+
+
+def setup_finish_photo(work_dir, size):
+    import config
+    from Photo import finish_photo
+    from ImageWorkers import share_image
+
+    config.shared_memory_dir = work_dir
+    shared_photo = share_image(make_capture(size))
+    shared_overlay = share_image(make_overlay(size))
+    filepath = os.path.join(work_dir, 'twitterBooth-01.jpg')
+
+    return lambda: finish_photo(shared_photo, shared_overlay, filepath, config.photo_jpeg_quality)
+
+
+def setup_rms_difference(work_dir, size):
+    from PIL import Image
+    from BestShot import rms_difference
+
+    img_1 = make_capture(size)
+    img_2 = img_1.transform(size, Image.AFFINE, (1, 0, 4, 0, 1, 0))
+    return lambda: rms_difference(img_1, img_2)
+
+
+def setup_zip_images(work_dir, size):
+    filehandler = make_file_handler()
+    for photo_num in range(4):
+        save_capture(filehandler.get_upload_file_dir(), size, 'medium-photobooth-%02d.jpg' % (photo_num + 1))
+
+    zip_filepath = os.path.join(work_dir, 'photobooth_photos.zip')
+
+    # (zipping the photos, as zip_images does when the archive isn't in the derivative cache)
+    def zip_images():
+        with open(zip_filepath, 'wb') as out_file:
+            filehandler.write_zip(out_file, '.jpg')
+
+    return zip_images
+
+
+def setup_overlay_padding(work_dir, size):
+    from PrintOnScreen import make_overlay_buffer
+
+    overlay_img = make_overlay(size)
+    return lambda: make_overlay_buffer(overlay_img)
+
+
+benchmarks = [
+    ('resize_image', setup_resize_image),
+    ('prepare_one_image', setup_prepare_one_image),
+    ('badge_composite', setup_badge_composite),
+    ('finish_photo', setup_finish_photo),
+    ('rms_difference', setup_rms_difference),
+    ('zip_images', setup_zip_images),
+    ('overlay_padding', setup_overlay_padding),
+]
+
+
+# run_benchmark()
+# Runs in the child process: time the benchmark 'name' on photos of 'size', and return its results
+def run_benchmark(name, size):
+    setup_function = dict(benchmarks)[name]
+    work_dir = tempfile.mkdtemp(prefix='tweetBooth-benchmark-')
+
+    # Keep the booth's files in work_dir (none of its modules have been imported yet, in this process)
+    os.environ['TWEETBOOTH_HOME'] = work_dir
+
+    try:
+        run_function = setup_function(work_dir, size)
+
+        # Once to warm up (imports, caches), then only measure the memory used by the runs themselves
+        run_function()
+        reset_peak_memory()
+
+        run_secs = []
+        start_time = time.time()
+        while len(run_secs) < max_runs and (len(run_secs) < 3 or time.time() - start_time < min_time_secs):
+            run_start = time.time()
+            run_function()
+            run_secs.append(time.time() - run_start)
+
+        peak_memory_bytes = get_peak_memory_bytes()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    median_secs = sorted(run_secs)[len(run_secs) // 2]
+    return {
+        'runs': len(run_secs),
+        'median_secs': median_secs,
+        'runs_per_sec': 1.0 / median_secs if median_secs > 0 else None,
+        'megapixels_per_sec': size[0] * size[1] / 1e6 / median_secs if median_secs > 0 else None,
+        'peak_memory_mb': peak_memory_bytes / (1024.0 * 1024.0),
+    }
+
+
+# Reset the process's peak memory use (Linux 4.0 and later), so it only covers what happens next
+def reset_peak_memory():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def get_peak_memory_bytes():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Run the benchmark 'name' at 'size' in a child process, and return its results (None if it fails)
+def run_child(name, size):
+    result_fd, result_file = tempfile.mkstemp(prefix='tweetBooth-benchmark-', suffix='.json')
+    os.close(result_fd)
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            # (the booth's modules print as they work, which would drown out the results;
+            #    stderr is left alone, so that the traceback of a failure is shown)
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), '--child', name,
+                                   '%dx%d' % size, '--result-file', result_file], stdout=devnull)
+        with open(result_file) as in_file:
+            return json.load(in_file)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        print("Error running benchmark %s at %dx%d: %s" % (name, size[0], size[1], e))
+        return None
+    finally:
+        os.remove(result_file)
+
+
+# compare_with_baseline()
+# Return a description of each benchmark that has regressed past the thresholds, compared with baseline
+def compare_with_baseline(results, baseline, max_slowdown, max_memory_growth):
+    regressions = []
+
+    for key in sorted(results):
+        baseline_result = baseline.get(key)
+        if baseline_result is None:
+            continue
+
+        result = results[key]
+        slowdown = result['median_secs'] / baseline_result['median_secs'] - 1.0
+        memory_growth = result['peak_memory_mb'] / max(baseline_result['peak_memory_mb'], 1.0) - 1.0
+
+        if slowdown > max_slowdown:
+            regressions.append("%s: %.1f%% slower (%.2fms, was %.2fms)" % (
+                key, slowdown * 100, result['median_secs'] * 1000, baseline_result['median_secs'] * 1000))
+        if memory_growth > max_memory_growth:
+            regressions.append("%s: %.1f%% more memory (%.1fMB, was %.1fMB)" % (
+                key, memory_growth * 100, result['peak_memory_mb'], baseline_result['peak_memory_mb']))
+
+    return regressions
+
+
+def parse_size(size_text):
+    width, height = size_text.lower().split('x')
+    return int(width), int(height)
+
+
+def get_versions():
+    from PIL import Image
+
+    return {
+        'python': sys.version.split()[0],
+        'pillow': getattr(Image, '__version__', getattr(Image, 'PILLOW_VERSION', 'unknown')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the photo processing pipeline')
+    parser.add_argument('--only', action='append', choices=[name for name, setup_function in benchmarks],
+                        help='run just this benchmark (may be given more than once)')
+    parser.add_argument('--resolution', action='append', type=parse_size,
+                        help='photo size to run at, e.g. 1640x820 (may be given more than once)')
+    parser.add_argument('--baseline', help='JSON results to compare with, failing on any regression')
+    parser.add_argument('--save-baseline', help='file to save the results to, as JSON')
+    parser.add_argument('--max-slowdown', type=float, default=default_max_slowdown,
+                        help='fraction slower than the baseline that counts as a regression')
+    parser.add_argument('--max-memory-growth', type=float, default=default_max_memory_growth,
+                        help='fraction more peak memory than the baseline that counts as a regression')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('child_size', nargs='?', type=parse_size, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        with open(args.result_file, 'w') as out_file:
+            json.dump(run_benchmark(args.child, args.child_size), out_file)
+        return 0
+
+    names = args.only or [name for name, setup_function in benchmarks]
+    sizes = args.resolution or resolutions
+
+    print("%-18s %-10s %6s %12s %10s %10s %12s" % ('benchmark', 'size', 'runs', 'median (ms)',
+                                                   'runs/s', 'MP/s', 'peak memory'))
+    results = {}
+    failures = []
+    for name in names:
+        for size in sizes:
+            key = '%s@%dx%d' % (name, size[0], size[1])
+            result = run_child(name, size)
+            if result is None:
+                failures.append(key)
+                print("%-18s %-10s FAILED" % (name, '%dx%d' % size))
+                sys.stdout.flush()
+                continue
+
+            results[key] = result
+
+            print("%-18s %-10s %6d %12.2f %10.1f %10.1f %10.1fMB" % (
+                name, '%dx%d' % size, result['runs'], result['median_secs'] * 1000,
+                result['runs_per_sec'] or 0, result['megapixels_per_sec'] or 0, result['peak_memory_mb']))
+            sys.stdout.flush()
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as out_file:
+            json.dump({'versions': get_versions(), 'results': results}, out_file, indent=2, sort_keys=True)
+        print("Baseline saved to " + args.save_baseline)
+
+    if args.baseline is not None:
+        with open(args.baseline) as in_file:
+            baseline = json.load(in_file)
+
+        regressions = compare_with_baseline(results, baseline['results'], args.max_slowdown,
+                                            args.max_memory_growth)
+        if len(regressions) > 0:
+            print("Regressions against " + args.baseline + " " + json.dumps(baseline.get('versions')) + ":")
+            for regression in regressions:
+                print("    " + regression)
+        else:
+            print("No regressions against " + args.baseline)
+    else:
+        regressions = []
+
+    if len(failures) > 0:
+        print("Failed: " + ", ".join(failures))
+
+    if len(regressions) > 0 or len(failures) > 0:
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
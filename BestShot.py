@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Functions to pick the best photos out of a burst, so that only those are tweeted
+# Each photo is scored as it is finished (in an ImageWorkers process, so scoring is done in the gap
+#    between shots), on a small greyscale copy of it:
+#    - sharpness: the variance of its Laplacian (edges), which blur and camera shake reduce
+#    - clipping: the fraction of its pixels that are burnt out white or crushed to black
+# Then, once the burst is finished, the difference between neighbouring photos picks out the ones
+#    taken while people were moving, and stops near-duplicates being chosen together.
+# NumPy is used if it is installed (it is much quicker), otherwise PIL does the sums.
+
+import math
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import config
+
+# Pixel values at or beyond these count as clipped
+clip_low = 4
+clip_high = 251
+
+# How much each fault counts against a photo, relative to it being the sharpest of the burst (1.0)
+clipping_weight = 2.0
+motion_weight = 0.5
+
+
+class ShotScore(object):
+    'How good a photo is, and the small greyscale copy it was scored on (to compare it with the others)'
+
+    def __init__(self, filepath, sharpness, clipping, luma_img):
+        self.filepath = filepath
+        self.sharpness = sharpness
+        self.clipping = clipping
+
+        # Kept as raw bytes, so it is quick to pass back from the workers
+        self.luma_size = luma_img.size
+        self.luma_bytes = luma_img.tobytes()
+
+    def get_luma_image(self):
+        return Image.frombytes('L', self.luma_size, self.luma_bytes)
+
+
+# score_shot()
+# Score the PIL Image img, that has been saved as filepath. Returns a ShotScore
+def score_shot(img, filepath):
+    luma_img = get_luma_image(img, config.best_shot_luma_width)
+
+    if numpy is not None:
+        luma = numpy.asarray(luma_img, dtype=numpy.float32)
+
+        # The 4-neighbour Laplacian, on all but the edge pixels
+        laplacian = (4 * luma[1:-1, 1:-1] - luma[:-2, 1:-1] - luma[2:, 1:-1]
+                     - luma[1:-1, :-2] - luma[1:-1, 2:])
+        sharpness = float(laplacian.var())
+
+        clipping = float(numpy.count_nonzero((luma <= clip_low) | (luma >= clip_high))) / luma.size
+    else:
+        # (scaled down by 8 so that it fits in 8 bits either side of 128, then scaled back up)
+        laplacian = luma_img.filter(ImageFilter.Kernel((3, 3), [0, -1, 0, -1, 4, -1, 0, -1, 0], 8, 128))
+        laplacian = laplacian.crop((1, 1, luma_img.size[0] - 1, luma_img.size[1] - 1))
+        sharpness = ImageStat.Stat(laplacian).var[0] * 64
+
+        histogram = luma_img.histogram()
+        clipping = float(sum(histogram[:clip_low + 1]) + sum(histogram[clip_high:])) / sum(histogram)
+
+    return ShotScore(filepath, sharpness, clipping, luma_img)
+
+
+# Return a greyscale copy of img, about width pixels wide
+def get_luma_image(img, width):
+    reduce_factor = img.size[0] // width
+    if reduce_factor >= 2:
+        if hasattr(img, 'reduce'):
+            img = img.reduce(reduce_factor)
+        else:
+            img = img.resize((img.size[0] // reduce_factor, img.size[1] // reduce_factor), Image.BOX)
+
+    return img.convert('L')
+
+
+# rms_difference()
+# The root-mean-square difference between two images of the same size and mode
+# (summed over the bands of each pixel)
+def rms_difference(im1, im2):
+    if numpy is not None:
+        # (summed in 64 bits: a whole frame of large differences overflows 32)
+        diff = numpy.asarray(im1, dtype=numpy.int64) - numpy.asarray(im2, dtype=numpy.int64)
+        sum_of_squares = float((diff * diff).sum())
+    else:
+        # Thanks Charlie Clark: http://code.activestate.com/recipes/577630-comparing-two-images/
+        h = ImageChops.difference(im1, im2).histogram()
+        sum_of_squares = sum(value * ((idx % 256) ** 2) for idx, value in enumerate(h))
+
+    return math.sqrt(sum_of_squares / float(im1.size[0] * im1.size[1]))
+
+
+# choose_best_shots()
+# Given the ShotScores of a burst, in the order they were taken, return the indexes of the best
+#    num_shots of them, in the order they were taken
+def choose_best_shots(scores, num_shots):
+    if len(scores) <= num_shots:
+        return range(len(scores))
+
+    luma_imgs = [score.get_luma_image() for score in scores]
+
+    # How much each photo differs from the one before it
+    diffs = [0.0] + [rms_difference(luma_imgs[i - 1], luma_imgs[i]) for i in range(1, len(scores))]
+
+    max_sharpness = max(score.sharpness for score in scores) or 1.0
+    max_diff = max(diffs) or 1.0
+
+    ratings = []
+    for i, score in enumerate(scores):
+        # A photo that is very different from both its neighbours was probably taken mid-movement
+        neighbour_diffs = [diffs[i]] if i > 0 else []
+        if i < len(scores) - 1:
+            neighbour_diffs.append(diffs[i + 1])
+        motion = min(neighbour_diffs) / max_diff
+
+        ratings.append(score.sharpness / max_sharpness - clipping_weight * score.clipping - motion_weight * motion)
+
+    chosen = []
+    duplicates = []
+    for i in sorted(range(len(scores)), key=lambda i: ratings[i], reverse=True):
+        if len(chosen) == num_shots:
+            break
+
+        # Skip a photo that is nearly the same as one already chosen (but keep it, in case we run short)
+        if any(rms_difference(luma_imgs[i], luma_imgs[j]) < config.best_shot_duplicate_rms for j in chosen):
+            duplicates.append(i)
+        else:
+            chosen.append(i)
+
+    chosen += duplicates[:num_shots - len(chosen)]
+
+    return sorted(chosen)
@@ -2,14 +2,111 @@
 # Classes to handle button presses
 
 import time
-import RPi.GPIO as GPIO
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 import config
+from HardwareBackend import get_backend
+from LatencyMonitor import get_latency_monitor
 
 
 class ButtonHandler(object):
+    # Map each button character onto the GPIO pin it is wired to
+    button_pins = {
+        's': config.button_pin_select,
+        'l': config.button_pin_left,
+        'r': config.button_pin_right,
+        'exit': config.button_pin_exit,
+    }
+
     def __init__(self):
-        pass
+        self.gpio = get_backend().gpio
+        self.event_queue = queue.Queue()
+        self.last_edge_times = {}
+        self.edge_lock = threading.Lock()
+        self.detecting_events = False
+
+    # start_event_detection()
+    # Ask the GPIO library to watch every button for a falling edge (the buttons are pulled up,
+    #    so pressing one pulls its pin low), and queue each debounced press for next_event().
+    # The GPIO pins must already have been set up as inputs.
+    def start_event_detection(self):
+        if self.detecting_events:
+            return
+
+        for button, pin in self.button_pins.items():
+            self.gpio.add_event_detect(pin, self.gpio.FALLING, callback=self.button_edge_detected,
+                                       bouncetime=config.button_bounce_ms)
+
+        self.detecting_events = True
+
+    def stop_event_detection(self):
+        if not self.detecting_events:
+            return
+
+        for button, pin in self.button_pins.items():
+            self.gpio.remove_event_detect(pin)
+
+        self.detecting_events = False
+
+    # Called on the GPIO library's callback thread for every falling edge
+    def button_edge_detected(self, pin):
+        edge_time = time.time()
+
+        with self.edge_lock:
+            # RPi.GPIO's bouncetime is not always reliable, so debounce again here
+            last_edge_time = self.last_edge_times.get(pin, 0)
+            if (edge_time - last_edge_time) * 1000 < config.button_bounce_ms:
+                return
+            self.last_edge_times[pin] = edge_time
+
+        # Ignore the rising edge of a release that slipped through as a falling edge
+        if not self.button_is_down(pin):
+            return
+
+        for button, button_pin in self.button_pins.items():
+            if button_pin == pin:
+                self.event_queue.put((button, edge_time))
+                break
+
+    # Throw away any presses that have been queued but not consumed yet
+    def clear_events(self):
+        while True:
+            try:
+                self.event_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    # next_event()
+    # Block until one of 'buttons' (or the exit button) is pressed, and return its character.
+    # Presses of other buttons are discarded.
+    # Returns None if 'timeout' seconds pass without a matching press (None waits forever).
+    def next_event(self, buttons, timeout=None):
+        if timeout is not None:
+            end_time = time.time() + timeout
+
+        while True:
+            if timeout is None:
+                # Queue.get() without a timeout can't be interrupted by Ctrl-C on Python 2,
+                #    so wake up once in a while
+                wait_secs = 60
+            else:
+                wait_secs = end_time - time.time()
+                if wait_secs <= 0:
+                    return None
+
+            try:
+                button, edge_time = self.event_queue.get(True, wait_secs)
+            except queue.Empty:
+                continue
+
+            if button == 'exit' or button in buttons:
+                get_latency_monitor().button_consumed(button, edge_time)
+                return button
 
     # wait_for_buttons()
     # Argument 'buttons' can be one or more of these characters:
@@ -21,48 +118,29 @@ class ButtonHandler(object):
         # Turn on the button LEDs
         self.light_button_leds(buttons, True)
 
-        time.sleep(0.2)  # Debounce
+        # Only react to presses made from now on
+        self.clear_events()
 
-        # Keep track of how long we have been waiting for a button press
-        self.start_time = time.time()
+        # If we wait for a button press for longer than screen_saver_seconds secs
+        # then go into screen_saver mode.
+        button = self.next_event(buttons, config.screen_saver_seconds)
 
-        while True:
-            # Check the button states
-            if 's' in buttons and self.button_is_down(config.button_pin_select):
-                if turn_off_after:
-                    self.light_button_leds(buttons, False)
-                return 's'
-            elif 'l' in buttons and self.button_is_down(config.button_pin_left):
-                if turn_off_after:
-                    self.light_button_leds(buttons, False)
-                return 'l'
-            elif 'r' in buttons and self.button_is_down(config.button_pin_right):
-                if turn_off_after:
-                    self.light_button_leds(buttons, False)
-                return 'r'
-            elif self.button_is_down(config.button_pin_exit):
-                return 'exit'
-
-            # If we've been waiting for a button press for longer than screen_saver_seconds secs
-            # then go into screen_saver mode.
-            if time.time() - self.start_time > config.screen_saver_seconds:
-                return 'screensaver'
+        if button is None:
+            return 'screensaver'
+
+        if button != 'exit' and turn_off_after:
+            self.light_button_leds(buttons, False)
+
+        return button
 
     def button_is_down(self, button_pin):
-        is_up = GPIO.input(button_pin)
+        is_up = self.gpio.input(button_pin)
         return not is_up
 
     def light_button_leds(self, buttons, turn_on):
         if 's' in buttons:
-            GPIO.output(config.led_pin_select, turn_on)
+            self.gpio.output(config.led_pin_select, turn_on)
         if 'l' in buttons:
-            GPIO.output(config.led_pin_left, turn_on)
+            self.gpio.output(config.led_pin_left, turn_on)
         if 'r' in buttons:
-            GPIO.output(config.led_pin_right, turn_on)
-
-    def flash_button_leds(self, buttons, interval_secs, stop_event):
-        while not stop_event.is_set():
-            self.light_button_leds(buttons, False)
-            time.sleep(interval_secs)
-            self.light_button_leds(buttons, True)
-            time.sleep(interval_secs)
+            self.gpio.output(config.led_pin_right, turn_on)
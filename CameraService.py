@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Class to keep the camera open and warmed up between guests
+
+import time
+import threading
+
+import config
+
+
+class CameraService(object):
+    'Owns the camera: lends it to photobooth functions, and only powers it down after it has been idle'
+
+    camera = None
+    leased = False
+    settings_restored = False
+
+    def __init__(self, hardware):
+        self.hardware = hardware
+        self.lock = threading.RLock()
+        self.idle_timer = None
+
+        # Exposure and white balance that the camera had settled on the last time it was used
+        self.settled_settings = None
+        self.settled_time = None
+
+    # lease()
+    # Return the camera, opening it if it isn't already. The caller must release() it when done.
+    def lease(self):
+        with self.lock:
+            self.cancel_idle_timer()
+
+            if self.camera is None:
+                self.open_camera()
+            elif self.settings_restored and not self.settled_settings_are_fresh():
+                # The light may have changed since, so go back to letting the camera decide
+                self.use_automatic_settings()
+
+            self.leased = True
+            return self.camera
+
+    # release()
+    # Take back the camera. It stays open, with its sensor running, until it has been idle for
+    #    config.camera_idle_timeout_secs, so the next guest doesn't wait for it to start up and settle.
+    def release(self):
+        with self.lock:
+            if self.camera is None:
+                return
+
+            self.remember_settled_settings()
+
+            # Hide the preview rather than stopping the camera
+            for overlay in list(self.camera.overlays):
+                self.camera.remove_overlay(overlay)
+            if self.camera.preview is not None:
+                self.camera.preview.alpha = 0
+            self.camera.led = False
+
+            self.leased = False
+            self.start_idle_timer()
+
+    # warm_up()
+    # Open the camera in the background (if it isn't already), e.g. while a guest reads the instructions
+    def warm_up(self):
+        def open_if_closed():
+            with self.lock:
+                if self.camera is None:
+                    self.open_camera()
+                if not self.leased:
+                    self.start_idle_timer()
+
+        warm_thread = threading.Thread(target=open_if_closed)
+        warm_thread.daemon = True
+        warm_thread.start()
+
+    def power_down(self):
+        with self.lock:
+            if self.leased or self.camera is None:
+                return
+
+            print "Camera idle: powering down"
+            self.remember_settled_settings()
+            self.camera.close()
+            self.camera = None
+
+    def shutdown(self):
+        with self.lock:
+            self.cancel_idle_timer()
+            self.leased = False
+            self.power_down()
+
+    # Must be called with self.lock held
+    def open_camera(self):
+        self.camera = self.hardware.new_camera()
+
+        self.settings_restored = False
+
+        # If the camera settled recently, start from where it settled rather than waiting for it again
+        if self.settled_settings_are_fresh():
+            shutter_speed, awb_gains = self.settled_settings
+            try:
+                self.camera.shutter_speed = shutter_speed
+                self.camera.awb_mode = 'off'
+                self.camera.awb_gains = awb_gains
+                self.settings_restored = True
+            except (AttributeError, ValueError) as e:
+                print "Error restoring camera settings: ", e
+
+    def settled_settings_are_fresh(self):
+        return (self.settled_settings is not None and
+                time.time() - self.settled_time < config.camera_settings_max_age_secs)
+
+    # Must be called with self.lock held
+    def use_automatic_settings(self):
+        self.camera.shutter_speed = 0
+        self.camera.awb_mode = 'auto'
+        self.settings_restored = False
+
+    # Must be called with self.lock held
+    def remember_settled_settings(self):
+        # Settings we restored ourselves say nothing new about the light, so only remember automatic ones
+        if self.settings_restored:
+            return
+
+        try:
+            self.settled_settings = (self.camera.exposure_speed, self.camera.awb_gains)
+            self.settled_time = time.time()
+        except AttributeError:
+            pass
+
+    # Must be called with self.lock held
+    def start_idle_timer(self):
+        self.cancel_idle_timer()
+
+        self.idle_timer = threading.Timer(config.camera_idle_timeout_secs, self.power_down)
+        self.idle_timer.daemon = True
+        self.idle_timer.start()
+
+    # Must be called with self.lock held
+    def cancel_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# Class to show a set of photos tiled across the screen, as a contact sheet
+# The photos are decoded and shrunk in the ImageWorkers processes, in parallel, then put together
+#    off-screen, so the whole sheet appears at once (rather than painting a photo at a time).
+#    Finished sheets are kept, so showing the same photos again is a single blit.
+
+import os
+
+import pygame
+from PIL import Image
+
+from ImageWorkers import share_image
+from PrintOnScreen import SurfaceCache, convert_surface, update_display
+
+import config
+
+
+class ContactSheet(object):
+    'Tiles photos in two rows (fewer on top, given an odd number), each row centred, half a screen high'
+
+    # If imageworkers is None, the photos are shrunk in this process
+    def __init__(self, imageworkers=None):
+        self.imageworkers = imageworkers
+        self.sheets = SurfaceCache(config.contact_sheet_cache_max_bytes)
+
+        # Tile size and positions, by (number of photos, photo size, screen size)
+        self.layouts = {}
+
+    # Put a contact sheet of image_files on 'screen', in one update
+    def show(self, screen, image_files):
+        if len(image_files) < 1:
+            return
+
+        screen.blit(self.get_sheet(image_files, screen.get_size()), (0, 0))
+        update_display()
+
+    # Return a screen_size Surface with image_files tiled across it (shared, so must not be drawn on)
+    def get_sheet(self, image_files, screen_size):
+        key = (tuple((image_file, os.path.getmtime(image_file)) for image_file in image_files), tuple(screen_size))
+
+        sheet = self.sheets.get(key)
+        if sheet is None:
+            sheet = self.render(image_files, screen_size)
+            self.sheets.put(key, sheet)
+
+        return sheet
+
+    def render(self, image_files, screen_size):
+        # All the photos are the same shape, so the first one's size (from its header) goes for them all
+        photo_size = Image.open(image_files[0]).size
+
+        tile_size, tile_positions = self.get_layout(len(image_files), photo_size, screen_size)
+
+        sheet = pygame.Surface(screen_size)
+        sheet.fill(config.black_colour)
+
+        for image_file, tile_position, tile_img in zip(image_files, tile_positions,
+                                                       self.make_tiles(image_files, tile_size)):
+            if tile_img is None:
+                continue
+
+            tile = pygame.image.fromstring(tile_img.tobytes(), tile_img.size, 'RGB')
+            sheet.blit(tile, tile_position)
+
+        return convert_surface(sheet)
+
+    # Return a PIL Image of each of image_files, shrunk to tile_size (None for any that fail to load)
+    def make_tiles(self, image_files, tile_size):
+        if self.imageworkers is None:
+            return [make_tile(image_file, tile_size) for image_file in image_files]
+
+        tile_futures = [self.imageworkers.submit(share_tile, image_file, tile_size) for image_file in image_files]
+
+        tile_imgs = []
+        for shared_tile in self.imageworkers.wait(tile_futures):
+            if shared_tile is None:
+                tile_imgs.append(None)
+            else:
+                tile_imgs.append(shared_tile.get_image())
+                shared_tile.unlink()
+
+        return tile_imgs
+
+    # get_layout()
+    # Return the size of each tile, and the top left of each, for num_photos photos of photo_size
+    def get_layout(self, num_photos, photo_size, screen_size):
+        key = (num_photos, tuple(photo_size), tuple(screen_size))
+
+        layout = self.layouts.get(key)
+        if layout is None:
+            layout = self.make_layout(num_photos, photo_size, screen_size)
+            self.layouts[key] = layout
+
+        return layout
+
+    def make_layout(self, num_photos, photo_size, screen_size):
+        image_width, image_height = photo_size
+        screen_width, screen_height = screen_size
+
+        num_row_1 = num_photos // 2  # Note: given an odd number of images, fewer will appear on top row
+        num_row_2 = num_photos - num_row_1
+
+        # display_* is the size that we want to display the image at
+        display_height = screen_height // 2
+        display_width = int(float(display_height) / float(image_height) * float(image_width))
+
+        row_1_x = (screen_width - (num_row_1 * display_width)) // 2
+        row_2_x = (screen_width - (num_row_2 * display_width)) // 2
+
+        tile_positions = []
+        for image_num in range(num_photos):
+            if image_num < num_row_1:
+                tile_positions.append((row_1_x + display_width * image_num, 0))
+            else:
+                tile_positions.append((row_2_x + display_width * (image_num - num_row_1), display_height))
+
+        return (display_width, display_height), tile_positions
+
+
+# make_tile()
+# Decode the photo in image_file straight to tile_size, as a PIL Image (None if it fails to load)
+def make_tile(image_file, tile_size):
+    from PhotoHandler import decode_for_display
+
+    try:
+        return decode_for_display(image_file, tile_size)
+    except IOError as e:
+        print "ERROR: Image " + os.path.basename(image_file) + " failed to load: ", e
+        return None
+
+
+# Runs in an ImageWorkers process: make_tile(), with the tile handed back in shared memory
+def share_tile(image_file, tile_size):
+    tile_img = make_tile(image_file, tile_size)
+    if tile_img is None:
+        return None
+    return share_image(tile_img)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Class to keep files made from other files (resized photos, ZIP archives) on disk,
+#    by what they were made from and how, so the same work is never done twice on the Pi
+#    (e.g. when a tweet or upload is retried, or the same photos are prepared again).
+# Each file is stored under a key made from the content hash of its source(s), the operation, and
+#    its parameters. Files are written atomically, and the least recently used are removed once
+#    the cache is over its size limit.
+# The cache is only a directory, so a DerivativeCache can be handed to the ImageWorkers processes.
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+
+class DerivativeCache(object):
+    'A bounded, least-recently-used, on-disk cache of derived files'
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        # Tidy up any files that were still being written when the booth was last stopped
+        for filename in os.listdir(cache_dir):
+            if filename.startswith('.tmp-'):
+                try:
+                    os.remove(os.path.join(cache_dir, filename))
+                except OSError:
+                    pass
+
+    # get_key()
+    # The key for the result of applying 'operation' (a name) with 'params' (anything JSON can encode,
+    #    e.g. the sizes and quality) to the source whose content hash is source_hash
+    #    (or a list of them, for a file made from several sources)
+    def get_key(self, source_hash, operation, params):
+        key_json = json.dumps([source_hash, operation, params], sort_keys=True)
+        return hashlib.sha1(key_json.encode('utf-8')).hexdigest()
+
+    # Return the path of the cached file for key (marking it as recently used), or None
+    def get(self, key, extension):
+        filepath = self.get_filepath(key, extension)
+        try:
+            os.utime(filepath, None)
+        except OSError:
+            return None
+        return filepath
+
+    # fetch()
+    # Copy the cached file for key to dest_filepath. Returns False if there isn't one.
+    def fetch(self, key, extension, dest_filepath):
+        filepath = self.get(key, extension)
+        if filepath is None:
+            return False
+
+        try:
+            shutil.copyfile(filepath, dest_filepath)
+        except IOError as e:
+            # Evicted by another process since we looked
+            print "Error fetching from derivative cache: ", e
+            return False
+
+        return True
+
+    # Keep a copy of the file at filepath, as the result for key
+    def put_file(self, key, extension, filepath):
+        with open(filepath, 'rb') as in_file:
+            cache_writer = self.open_writer(key, extension)
+            try:
+                shutil.copyfileobj(in_file, cache_writer)
+            except Exception:
+                cache_writer.abort()
+                raise
+            cache_writer.commit()
+
+    # open_writer()
+    # Return a CacheWriter, to write the result for key into as it is made. If tee_file is given,
+    #    everything is written to that too (e.g. a file being uploaded)
+    def open_writer(self, key, extension, tee_file=None):
+        temp_fd, temp_filepath = tempfile.mkstemp(prefix='.tmp-', dir=self.cache_dir)
+        return CacheWriter(self, os.fdopen(temp_fd, 'wb'), temp_filepath,
+                           self.get_filepath(key, extension), tee_file)
+
+    def get_filepath(self, key, extension):
+        return os.path.join(self.cache_dir, key + extension)
+
+    # Remove the least recently used files until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        total_bytes = 0
+
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith('.tmp-'):
+                continue
+
+            filepath = os.path.join(self.cache_dir, filename)
+            try:
+                file_stat = os.stat(filepath)
+            except OSError:
+                continue
+
+            entries.append((file_stat.st_mtime, file_stat.st_size, filepath))
+            total_bytes += file_stat.st_size
+
+        for mtime, size, filepath in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+            total_bytes -= size
+
+
+class CacheWriter(object):
+    'A new cache file, which appears in the cache (all at once) when it is committed'
+
+    def __init__(self, cache, out_file, temp_filepath, filepath, tee_file=None):
+        self.cache = cache
+        self.out_file = out_file
+        self.temp_filepath = temp_filepath
+        self.filepath = filepath
+        self.tee_file = tee_file
+
+    def write(self, data):
+        if self.tee_file is not None:
+            self.tee_file.write(data)
+        self.out_file.write(data)
+
+    def commit(self):
+        self.out_file.flush()
+        os.fsync(self.out_file.fileno())
+        self.out_file.close()
+
+        os.rename(self.temp_filepath, self.filepath)
+        self.cache.evict()
+
+    def abort(self):
+        self.out_file.close()
+        try:
+            os.remove(self.temp_filepath)
+        except OSError:
+            pass
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# A local stand-in for the parts of the Twitter API that the booth uses, for testing the tweet outbox
+#    without posting anything. Run it with, e.g.
+#        python FakeTwitter.py --port 8765 --fail-rate 0.3
+#    and start the booth with TWEETBOOTH_TWITTER_URL=http://127.0.0.1:8765
+# Every tweet is printed and logged, and any photo that is tweeted twice is reported as a DUPLICATE.
+
+import cgi
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+    'Handles media/upload and statuses/update requests'
+
+    def do_POST(self):
+        server = self.server
+
+        if server.delay_secs > 0:
+            time.sleep(server.delay_secs)
+
+        # Fail some requests, as the venue Wi-Fi would
+        if random.random() < server.fail_rate:
+            self.send_json(503, {'errors': [{'code': 130, 'message': 'Over capacity'}]})
+            return
+
+        form = cgi.FieldStorage(fp=self.rfile, headers=self.headers,
+                                environ={'REQUEST_METHOD': 'POST',
+                                         'CONTENT_TYPE': self.headers.get('Content-Type')})
+
+        if self.path.endswith('/media/upload.json'):
+            self.upload_media(form)
+        elif self.path.endswith('/statuses/update.json'):
+            self.update_status(form)
+        else:
+            self.send_json(404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist'}]})
+
+    def upload_media(self, form):
+        media = form['media'].value if 'media' in form else None
+        if not media:
+            self.send_json(400, {'errors': [{'code': 38, 'message': 'media parameter is missing'}]})
+            return
+
+        media_id = self.server.add_media(media)
+        self.send_json(200, {'media_id': media_id, 'media_id_string': str(media_id), 'size': len(media)})
+
+    def update_status(self, form):
+        status = form.getfirst('status', '')
+        media_ids = [int(media_id) for media_id in form.getfirst('media_ids', '').split(',') if media_id]
+
+        tweet_id = self.server.add_tweet(status, media_ids)
+        if tweet_id is None:
+            self.send_json(400, {'errors': [{'code': 324, 'message': 'Invalid media id'}]})
+            return
+
+        self.send_json(200, {'id': tweet_id, 'id_str': str(tweet_id), 'text': status})
+
+    def send_json(self, status_code, data):
+        body = json.dumps(data).encode('utf-8')
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTwitterServer(ThreadingMixIn, HTTPServer):
+    'Keeps the uploaded media and posted tweets in memory, and appends each tweet to log_file'
+
+    daemon_threads = True
+
+    def __init__(self, address, fail_rate=0.0, delay_secs=0.0, log_file=None):
+        HTTPServer.__init__(self, address, FakeTwitterHandler)
+
+        self.fail_rate = fail_rate
+        self.delay_secs = delay_secs
+        self.log_file = log_file
+
+        self.lock = threading.Lock()
+        self.media_hashes = {}  # Uploaded media's hash, by media ID
+        self.tweeted_hashes = set()
+        self.tweets = []
+        self.next_id = 1000
+
+    def add_media(self, media):
+        with self.lock:
+            media_id = self.next_id
+            self.next_id += 1
+            self.media_hashes[media_id] = hashlib.sha1(media).hexdigest()
+            return media_id
+
+    def add_tweet(self, status, media_ids):
+        with self.lock:
+            if any(media_id not in self.media_hashes for media_id in media_ids):
+                return None
+
+            tweet_id = self.next_id
+            self.next_id += 1
+
+            hashes = [self.media_hashes[media_id] for media_id in media_ids]
+            duplicate = any(curr_hash in self.tweeted_hashes for curr_hash in hashes)
+            self.tweeted_hashes.update(hashes)
+
+            tweet = {'id': tweet_id, 'status': status, 'media_hashes': hashes,
+                     'time': time.time(), 'duplicate': duplicate}
+            self.tweets.append(tweet)
+
+            if self.log_file is not None:
+                with open(self.log_file, 'a') as out_file:
+                    out_file.write(json.dumps(tweet) + '\n')
+
+        print("%sTweet %d: %s %s" % ('DUPLICATE ' if duplicate else '', tweet_id, status, hashes))
+        return tweet_id
+
+    def get_tweets(self):
+        with self.lock:
+            return list(self.tweets)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Twitter API')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests to fail')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to take over each request')
+    parser.add_argument('--log', default=None, help='file to append each tweet to, as JSON')
+    args = parser.parse_args()
+
+    server = FakeTwitterServer(('127.0.0.1', args.port), args.fail_rate, args.delay, args.log)
+    print("Fake Twitter listening on http://127.0.0.1:%d" % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -4,39 +4,80 @@
 import os
 import subprocess
 import glob
-import zipfile
+import json
+import shutil
+import hashlib
 
-from twython import Twython
-from twython import TwythonError
-from twython import TwythonAuthError
 from datetime import datetime
 
-# Thanks http://stackoverflow.com/questions/26790916/python-3-backward-compatability-shlex-quote-vs-pipes-quote
-try:
-    from shlex import quote as cmd_quote
-except ImportError:
-    from pipes import quote as cmd_quote
-
-from auth import (
-    consumer_key,
-    consumer_secret,
-    access_token,
-    access_token_secret
-)
+from Transport import SshTransport, LocalTransport
+from StreamingZip import StreamingZipWriter
+import config
 
 # Set up the directories etc. to support photo storage and upload
-local_file_dir = os.path.join(os.sep, 'home', 'pi', 'tweetBooth', 'pics')  # path to save PiCamera images to on Pi
-local_upload_file_dir = os.path.join(os.sep, 'home', 'pi', 'tweetBooth', 'pics',
-                                     'upload')  # path to save images to be uploaded
+#    (all under config.local_base_dir, /home/pi/tweetBooth on the Pi)
+local_file_dir = os.path.join(config.local_base_dir, 'pics')  # path to save PiCamera images to on Pi
+local_upload_file_dir = os.path.join(config.local_base_dir, 'pics', 'upload')  # path to save images to be uploaded
+
+local_archive_dir = os.path.join(config.local_base_dir, 'archive')  # path to store photos
+
+local_outbox_dir = os.path.join(config.local_base_dir, 'outbox')  # path to queue tweets in
+
+local_cache_dir = os.path.join(config.local_base_dir, 'cache')  # path to keep processed files in
+
+local_remote_manifest_file = os.path.join(config.local_base_dir,
+                                          'remote_manifest.json')  # record of what's on the server
+
+# The server that photos are uploaded to, and the directory on it that they are uploaded into
+remote_account = os.environ.get('TWEETBOOTH_REMOTE_ACCOUNT', 'pi@photobooth.example.com')
+remote_file_dir = os.environ.get('TWEETBOOTH_REMOTE_DIR', 'public_html/photobooth')
+
+
+# Write data as JSON to filepath, so that filepath either has the old contents or all of the new
+def write_json_atomically(filepath, data):
+    temp_filepath = os.path.join(os.path.dirname(filepath), '.tmp-' + os.path.basename(filepath))
+
+    with open(temp_filepath, 'w') as out_file:
+        json.dump(data, out_file, indent=2, sort_keys=True)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+
+    os.rename(temp_filepath, filepath)
+
+
+def copy_file_atomically(src_filepath, dest_filepath):
+    temp_filepath = os.path.join(os.path.dirname(dest_filepath), '.tmp-' + os.path.basename(dest_filepath))
 
-local_archive_dir = os.path.join(os.sep, 'home', 'pi', 'tweetBooth', 'archive')  # path to store photos
+    with open(src_filepath, 'rb') as in_file:
+        with open(temp_filepath, 'wb') as out_file:
+            shutil.copyfileobj(in_file, out_file)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+
+    os.rename(temp_filepath, dest_filepath)
+
+
+def get_file_hash(filepath):
+    file_hash = hashlib.sha1()
+    with open(filepath, 'rb') as in_file:
+        for chunk in iter(lambda: in_file.read(64 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
 
 
 class FileHandler(object):
     'Basic handling class for file operations'
+
+    remote_manifest = None
+    derivative_cache = None
     global local_file_dir
     global local_upload_file_dir
     global local_archive_dir
+    global local_outbox_dir
+    global local_cache_dir
+    global local_remote_manifest_file
+    global remote_account
+    global remote_file_dir
 
     def __init__(self):
         # Ensure photo storage and upload directories exist
@@ -51,6 +92,10 @@ class FileHandler(object):
 
             subprocess.check_call(["mkdir", "-p", local_archive_dir])
 
+            subprocess.check_call(["mkdir", "-p", local_outbox_dir])
+
+            subprocess.check_call(["mkdir", "-p", local_cache_dir])
+
 
         except subprocess.CalledProcessError as e:
             print "Error making local directories: ", e.returncode
@@ -87,6 +132,33 @@ class FileHandler(object):
     def get_archive_file_dir(self):
         return local_archive_dir
 
+    def get_outbox_dir(self):
+        return local_outbox_dir
+
+    def get_remote_file_dir(self):
+        return remote_file_dir
+
+    # The cache of processed photos and archives (created on first use)
+    def get_derivative_cache(self):
+        if self.derivative_cache is None:
+            from DerivativeCache import DerivativeCache
+            self.derivative_cache = DerivativeCache(local_cache_dir, config.derivative_cache_max_bytes)
+        return self.derivative_cache
+
+    # Our record of what is on the photo server (that config.upload_transport points at)
+    def get_remote_manifest(self):
+        target = self.get_transport().get_target()
+        if self.remote_manifest is None or self.remote_manifest.target != target:
+            from RemoteManifest import RemoteManifest
+            self.remote_manifest = RemoteManifest(local_remote_manifest_file, target)
+        return self.remote_manifest
+
+    # A transport to the photo server, as chosen in config.upload_transport
+    def get_transport(self):
+        if config.upload_transport == 'local':
+            return LocalTransport(config.local_transport_dir)
+        return SshTransport(remote_account)
+
     def get_full_path(self, prefix, postfix):
         return os.path.join(prefix, postfix)
 
@@ -96,20 +168,44 @@ class FileHandler(object):
     # *** Zip the images up, ready for upload
     def zip_images(self, image_extension, zip_filename):
         print "Zipping files ..."
-        file_pattern = os.path.join(local_upload_file_dir, "*photobooth*" + image_extension)
-        files = sorted(glob.glob(file_pattern))
+        zip_filepath = os.path.join(local_upload_file_dir, zip_filename)
+
+        # Reuse the archive if these photos have been zipped before
+        derivative_cache = self.get_derivative_cache()
+        zip_key = self.get_zip_key(image_extension)
+        if derivative_cache.fetch(zip_key, '.zip', zip_filepath):
+            return
 
-        with zipfile.ZipFile(os.path.join(local_upload_file_dir, zip_filename), 'w') as myzip:
-            for curr_file in files:
-                myzip.write(curr_file, arcname=os.path.basename(curr_file), compress_type=zipfile.ZIP_DEFLATED)
+        with open(zip_filepath, 'wb') as out_file:
+            self.write_zip(out_file, image_extension)
+        derivative_cache.put_file(zip_key, '.zip', zip_filepath)
+
+    # The prepared photos (*photobooth*) that go into the ZIP archive
+    def get_zip_files(self, image_extension):
+        file_pattern = os.path.join(local_upload_file_dir, "*photobooth*" + image_extension)
+        return sorted(glob.glob(file_pattern))
+
+    # Write a ZIP archive of the prepared photos to out_file (which can be a pipe) and return its writer.
+    #    The photos are already compressed, so they are stored rather than deflated again
+    def write_zip(self, out_file, image_extension):
+        with StreamingZipWriter(out_file) as zip_writer:
+            for curr_file in self.get_zip_files(image_extension):
+                zip_writer.write_file(curr_file)
+        return zip_writer
+
+    # The derivative cache key for a ZIP archive of the prepared photos, as they are now
+    def get_zip_key(self, image_extension):
+        zip_files = [[os.path.basename(curr_file), get_file_hash(curr_file)]
+                     for curr_file in self.get_zip_files(image_extension)]
+        return self.get_derivative_cache().get_key(zip_files, 'zip', [])
 
     # Copy file at src_filepath to dest_filepath
     def copy_file(self, src_filepath, dest_filepath):
         print "Copy file: " + src_filepath + " TO " + dest_filepath
         try:
-            subprocess.check_call("cp " + src_filepath + " " + dest_filepath, shell=True)
-        except subprocess.CalledProcessError as e:
-            print "Error copying file: ", e.returncode
+            shutil.copyfile(src_filepath, dest_filepath)
+        except EnvironmentError as e:
+            print "Error copying file: ", e
             raise
 
     # *** Upload files ***
@@ -121,98 +217,136 @@ class FileHandler(object):
     #     - num_files: if full_local_filepath includes a pattern that matches a number of files,
     #           this is the number of those files to upload. 0 means all files.
     #     - overwrite: if file exists in destination, overwrite if True, otherwise modify filename to make unique
-    def upload_files(self, file_defs):
+    # zip_defs is a list of lists containing:
+    #     - image_extension: the prepared photos to zip up (see write_zip)
+    #     - zip_filename: the name to give the archive
+    #     - full_remote_dir_path: the full path to the dir to upload the archive into
+    #     Each archive is written straight to the server as it is zipped, with no local copy
+    # All of the files are uploaded over one connection, skipping any that the server already has.
+    #     progress_callback(num_done, num_total, filepath), if given, is called after each file.
+    def upload_files(self, file_defs, progress_callback=None, zip_defs=None):
         print "Uploading files ... "
 
-        for curr_file_def in file_defs:
-            full_local_filepath, dest_filename, full_remote_dir_path, num_files, overwrite = curr_file_def
+        if zip_defs is None:
+            zip_defs = []
 
-            # Find all the files that match our full_local_filepath (which may contain pattern)
-            local_files = sorted(glob.glob(full_local_filepath))
-
-            try:
-                if len(local_files) > 0:
-                    # Ensure the remote dir exits
-                    # TODO: How expensive are calls to mkdir if dir already exists,
-                    #       better to check dir exists first?
-                    subprocess.check_call("ssh " + remote_account + " 'mkdir -p " +
-                                          full_remote_dir_path + "'", shell=True)
-                    curr_file_num = 1
-                    for curr_file in local_files:
-                        if (num_files is not 0) and (curr_file_num > num_files):
-                            break
-
-                        # Deal with the case where we want to alter the destination filename
-                        curr_src_full_filename = os.path.basename(curr_file)
-                        if dest_filename is "":
-                            full_remote_filepath = cmd_quote(os.path.join(full_remote_dir_path,
-                                                                          curr_src_full_filename))
-                        else:
-                            filename, extension = os.path.splitext(curr_src_full_filename)
-                            full_remote_filepath = cmd_quote(os.path.join(full_remote_dir_path,
-                                                                          dest_filename + extension))
+        uploads = self.get_uploads(file_defs)
+        remote_manifest = self.get_remote_manifest()
+        num_total = len(uploads) + len(zip_defs)
 
+        try:
+            with self.get_transport() as transport:
+                # Find out what is already on the server (if we don't know), and create any missing remote dirs
+                remote_dirs = sorted(set([full_remote_dir_path for curr_file, full_remote_dir_path,
+                                          remote_filename, overwrite in uploads] +
+                                         [full_remote_dir_path for image_extension, zip_filename,
+                                          full_remote_dir_path in zip_defs]))
+                new_dirs = remote_manifest.refresh(transport, remote_dirs)
+                transport.make_dirs(new_dirs)
+                remote_manifest.add_dirs(new_dirs)
+
+                for upload_num, (curr_file, full_remote_dir_path, remote_filename, overwrite) in enumerate(uploads):
+                    full_remote_filepath = os.path.join(full_remote_dir_path, remote_filename)
+                    file_size = os.path.getsize(curr_file)
+                    file_hash = get_file_hash(curr_file)
+
+                    if overwrite is True:
+                        # No need to upload a file that is already there (e.g. the static HTML and CSS)
+                        if remote_manifest.is_unchanged(full_remote_filepath, file_size, file_hash):
+                            print "Unchanged: " + full_remote_filepath
+                            full_remote_filepath = None
+                    else:
                         # Deal with the case where we do not want to overwrite the dest file
                         file_num = 2
-                        if overwrite is False:
-                            full_remote_filename = os.path.basename(full_remote_filepath)
-                            while subprocess.call(['ssh', remote_account, 'test -e ' +
-                                    full_remote_filepath]) == 0:
-                                filename_no_ext, filename_ext = os.path.splitext(full_remote_filename)
+                        while remote_manifest.has_file(full_remote_filepath):
+                            filename_no_ext, filename_ext = os.path.splitext(remote_filename)
 
-                                full_remote_filepath = cmd_quote(os.path.join(full_remote_dir_path,
-                                                                              filename_no_ext + "_" + str(
-                                                                                  file_num) + filename_ext))
-                                file_num += 1
+                            full_remote_filepath = os.path.join(full_remote_dir_path,
+                                                                filename_no_ext + "_" + str(file_num) + filename_ext)
+                            file_num += 1
 
-                        subprocess.check_call("scp " + curr_file + " " +
-                                              remote_account + ":" + full_remote_filepath, shell=True)
+                    if full_remote_filepath is not None:
+                        transport.put_file(curr_file, full_remote_filepath)
+                        remote_manifest.add_file(full_remote_filepath, file_size, file_hash)
 
-                        curr_file_num += 1
+                    if progress_callback is not None:
+                        progress_callback(upload_num + 1, num_total, curr_file)
 
-            except subprocess.CalledProcessError as e:
-                print "Error uploading files: ", e.returncode
-                raise
+                for zip_num, (image_extension, zip_filename, full_remote_dir_path) in enumerate(zip_defs):
+                    full_remote_filepath = os.path.join(full_remote_dir_path, zip_filename)
+                    self.upload_zip(transport, image_extension, full_remote_filepath)
 
-        print "... upload finished."
+                    if progress_callback is not None:
+                        progress_callback(len(uploads) + zip_num + 1, num_total, zip_filename)
 
-    def tweet_file(self):
+        except subprocess.CalledProcessError as e:
+            print "Error uploading files: ", e.returncode
+            raise
 
-        try:
-            success = True
+        finally:
+            remote_manifest.save()
 
-            twitter = Twython(consumer_key, consumer_secret,
-                              access_token, access_token_secret)
+        print "... upload finished."
 
-            message = '#CVconference with Team @RiosRoadRunners! #YouBelong #RiosRocks @ErinGassaway @LizLoether @CajonValleyUSD'
+    # Upload a ZIP archive of the prepared photos, as it is zipped (keeping a copy in the derivative cache),
+    #    or from the derivative cache if these photos have been zipped before
+    def upload_zip(self, transport, image_extension, full_remote_filepath):
+        remote_manifest = self.get_remote_manifest()
+        derivative_cache = self.get_derivative_cache()
+        zip_key = self.get_zip_key(image_extension)
+
+        cached_filepath = derivative_cache.get(zip_key, '.zip')
+        if cached_filepath is not None:
+            transport.put_file(cached_filepath, full_remote_filepath)
+            remote_manifest.add_file(full_remote_filepath, os.path.getsize(cached_filepath),
+                                     get_file_hash(cached_filepath))
+            return
+
+        def write_stream(out_file):
+            cache_writer = derivative_cache.open_writer(zip_key, '.zip', out_file)
+            try:
+                zip_writer = self.write_zip(cache_writer, image_extension)
+            except Exception:
+                cache_writer.abort()
+                raise
+            cache_writer.commit()
+            return zip_writer
 
-            # Get directories
-            image_dir = self.get_local_file_dir()
+        zip_writer = transport.put_stream(full_remote_filepath, write_stream)
+        remote_manifest.add_file(full_remote_filepath, zip_writer.get_size(), zip_writer.get_hash())
 
-            # PiCamera captures images at 72 pixels/inch.
+    # Expand file_defs (see upload_files) into a list of [local file, remote dir, remote filename, overwrite]
+    def get_uploads(self, file_defs):
+        uploads = []
 
-            # Collect a list of the original PiCamera-saved files
-            file_pattern = os.path.join(image_dir, "twitterBooth*.jpg")
-            files = self.get_sorted_file_list(file_pattern)
+        for curr_file_def in file_defs:
+            full_local_filepath, dest_filename, full_remote_dir_path, num_files, overwrite = curr_file_def
 
-            for curr_img in files:
-                with open(curr_img, 'rb') as photo:
-                    response = twitter.upload_media(media=photo)
-                    twitter.update_status(status=message, media_ids=[response['media_id']])
-                    # twitter.update_status_with_media(status=message, media=photo)
+            # Find all the files that match our full_local_filepath (which may contain pattern)
+            local_files = sorted(glob.glob(full_local_filepath))
 
-                self.copy_file(curr_img, local_archive_dir + "/%s.jpg" % datetime.now().isoformat())
+            if num_files != 0:
+                local_files = local_files[:num_files]
 
-        except TwythonAuthError as e:
-            print "Auth Error: ", e
-            success = False
+            for curr_file in local_files:
+                # Deal with the case where we want to alter the destination filename
+                remote_filename = os.path.basename(curr_file)
+                if dest_filename != "":
+                    filename, extension = os.path.splitext(remote_filename)
+                    remote_filename = dest_filename + extension
 
-            raise
+                uploads.append([curr_file, full_remote_dir_path, remote_filename, overwrite])
 
-        except TwythonError as e:
-            print "Error uploading files: ", e
-            success = False
+        return uploads
 
-            raise
+    # The photos taken (twitterBooth*) that are to be tweeted, which are in the format given by
+    #    image_extension (e.g. ".jpg", or ".gif" for an animation)
+    def get_tweet_files(self, image_extension=".jpg"):
+        # Collect a list of the photo files
+        file_pattern = os.path.join(local_file_dir, "twitterBooth*" + image_extension)
+        return self.get_sorted_file_list(file_pattern)
 
-        return success
+    # Keep a copy of a tweeted photo, named by the time it was tweeted
+    def archive_file(self, filepath):
+        extension = os.path.splitext(filepath)[1]
+        self.copy_file(filepath, local_archive_dir + "/%s" % datetime.now().isoformat() + extension)
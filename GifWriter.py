@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# Class to write an animated GIF one frame at a time, as the frames are captured
+# Every frame is quantised against one shared palette (chosen from the first frame) and appended
+#    to the file straight away, so memory use doesn't grow with the number of frames.
+# GIF format reference: https://www.w3.org/Graphics/GIF/spec-gif89a.txt
+
+import io
+import struct
+
+from PIL import Image
+
+
+class GifWriter(object):
+    'Streams frames into an animated GIF (or boomerang), keeping the file under a size limit'
+
+    # Frame scales and palette sizes to try, best first, until the whole animation is expected to fit
+    settings_options = [(1.0, 256), (1.0, 128), (0.75, 256), (0.75, 128), (0.5, 128), (0.5, 64)]
+
+    # Allow for later frames compressing less well than the first
+    size_headroom = 1.15
+
+    # num_frames is how many frames will be added, boomerang plays them forwards then backwards
+    def __init__(self, filepath, num_frames, max_bytes, frame_delay_ms, boomerang=False):
+        self.filepath = filepath
+        self.num_frames = num_frames
+        self.max_bytes = max_bytes
+        self.frame_delay = max(2, int(round(frame_delay_ms / 10.0)))  # GIF delays are in 1/100ths of a second
+        self.boomerang = boomerang
+
+        self.out_file = open(filepath, 'w+b')
+        self.frame_size = None
+        self.palette_img = None
+        self.palette_bits = None
+        self.global_palette = None
+        self.num_written = 0
+
+        # Where each forward frame is in the file, so a boomerang can replay them without keeping them
+        self.frame_blocks = []
+
+    def get_num_written(self):
+        return self.num_written
+
+    # add_frame()
+    # Quantise img and append it to the file. Returns False if it was dropped to stay under max_bytes.
+    def add_frame(self, img):
+        if self.palette_img is None:
+            self.choose_settings(img)
+            self.write_header()
+
+        frame_block = self.encode_frame(img)
+
+        # A boomerang needs room to replay this frame on the way back, too
+        frame_cost = len(frame_block) * (2 if self.boomerang else 1)
+        if self.out_file.tell() + frame_cost + 1 > self.max_bytes and self.num_written > 0:
+            print "GIF size limit reached: dropping frame"
+            return False
+
+        self.frame_blocks.append((self.out_file.tell(), len(frame_block)))
+        self.out_file.write(frame_block)
+        self.num_written += 1
+        return True
+
+    # Finish the file (playing the frames back in reverse first, for a boomerang) and close it
+    def close(self):
+        if self.boomerang:
+            # Replay all but the last and first frames, so neither end is shown twice in a row
+            for offset, length in reversed(self.frame_blocks[1:-1]):
+                self.out_file.seek(offset)
+                frame_block = self.out_file.read(length)
+
+                self.out_file.seek(0, io.SEEK_END)
+                if self.out_file.tell() + length + 1 > self.max_bytes:
+                    break
+                self.out_file.write(frame_block)
+                self.num_written += 1
+
+        self.out_file.seek(0, io.SEEK_END)
+        self.out_file.write(b'\x3b')  # Trailer
+        self.out_file.close()
+
+        return self.filepath
+
+    # Pick the largest frame size and palette for which the whole animation should fit in max_bytes,
+    #    judging by how well the first frame compresses
+    def choose_settings(self, first_img):
+        num_frames = self.num_frames
+        if self.boomerang:
+            num_frames = max(num_frames * 2 - 2, 1)
+
+        for scale, num_colours in self.settings_options:
+            self.set_settings(first_img, scale, num_colours)
+
+            estimated_bytes = len(self.encode_frame(first_img)) * num_frames * self.size_headroom
+            if estimated_bytes + len(self.global_palette) < self.max_bytes:
+                break
+
+        print "GIF frames: %dx%d, %d colours" % (self.frame_size[0], self.frame_size[1], num_colours)
+
+    def set_settings(self, first_img, scale, num_colours):
+        self.frame_size = (int(first_img.size[0] * scale), int(first_img.size[1] * scale))
+
+        self.palette_img = self.fit_frame(first_img).convert('P', palette=Image.ADAPTIVE, colors=num_colours)
+
+        # The colour table must have a power of 2 entries
+        self.palette_bits = 1
+        while (1 << self.palette_bits) < num_colours:
+            self.palette_bits += 1
+        palette = self.palette_img.getpalette()[:3 * num_colours]
+        palette += [0] * (3 * (1 << self.palette_bits) - len(palette))
+        self.global_palette = bytes(bytearray(palette))
+
+    def fit_frame(self, img):
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != self.frame_size:
+            img = img.resize(self.frame_size, Image.BILINEAR)
+        return img
+
+    def write_header(self):
+        width, height = self.frame_size
+
+        self.out_file.write(b'GIF89a')
+        # Logical screen descriptor, with a global colour table
+        self.out_file.write(struct.pack('<HHBBB', width, height,
+                                        0x80 | 0x70 | (self.palette_bits - 1), 0, 0))
+        self.out_file.write(self.global_palette)
+        # Loop forever
+        self.out_file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', 0) + b'\x00')
+
+    # Quantise img against the shared palette, and return it as a GIF frame
+    #    (a graphic control extension followed by the image)
+    def encode_frame(self, img):
+        frame_img = self.fit_frame(img).quantize(palette=self.palette_img)
+
+        # Let PIL do the LZW compression, then take just the image out of the file it writes
+        frame_file = io.BytesIO()
+        frame_img.save(frame_file, 'GIF', optimize=False)
+        image_block = self.get_image_block(bytearray(frame_file.getvalue()))
+
+        # Graphic control extension: leave each frame in place for the next to cover, after frame_delay
+        control_block = b'\x21\xf9\x04' + struct.pack('<BHBB', 0x04, self.frame_delay, 0, 0)
+
+        return control_block + image_block
+
+    # Return the image descriptor and data from a single frame GIF file.
+    # If the file's colour table isn't the shared palette (PIL may reorder or trim it),
+    #    the image is given the file's table as its own local colour table.
+    def get_image_block(self, gif_data):
+        pos = 6
+        flags = gif_data[pos + 4]
+        pos += 7
+
+        file_palette = None
+        file_palette_bits = 0
+        if flags & 0x80:
+            file_palette_bits = (flags & 0x07) + 1
+            file_palette = bytes(gif_data[pos:pos + 3 * (1 << file_palette_bits)])
+            pos += len(file_palette)
+
+        while gif_data[pos] == 0x21:
+            # Skip any extensions
+            pos = self.skip_sub_blocks(gif_data, pos + 2)
+
+        if gif_data[pos] != 0x2c:
+            raise ValueError("No image found in GIF frame")
+
+        descriptor = bytearray(gif_data[pos:pos + 10])
+        pos += 10
+
+        local_palette = b''
+        if descriptor[9] & 0x80:
+            local_palette_len = 3 * (1 << ((descriptor[9] & 0x07) + 1))
+            local_palette = bytes(gif_data[pos:pos + local_palette_len])
+            pos += local_palette_len
+        elif file_palette is not None and file_palette != self.global_palette:
+            descriptor[9] = (descriptor[9] & 0x78) | 0x80 | (file_palette_bits - 1)
+            local_palette = file_palette
+
+        data_start = pos
+        pos = self.skip_sub_blocks(gif_data, pos + 1)  # Skip the LZW minimum code size, then the data
+
+        return bytes(descriptor) + local_palette + bytes(gif_data[data_start:pos])
+
+    # Return the position just after the sub-blocks (and their terminator) that start at pos
+    def skip_sub_blocks(self, gif_data, pos):
+        while gif_data[pos] != 0:
+            pos += gif_data[pos] + 1
+        return pos + 1
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# Classes that give the photo booth access to its hardware: GPIO buttons/LEDs, the camera and the display
+# PiBackend drives the real Raspberry Pi hardware.
+# SimulatedBackend lets the booth run (and be profiled) on any Linux box:
+#    scripted button presses, a camera that produces synthetic JPEGs, and pygame's dummy video driver.
+
+import os
+import time
+import datetime
+import threading
+
+import config
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+# get_raw_capture_size()
+# The camera writes unencoded ('rgb') captures with the width padded up to a multiple of 32
+#    and the height padded up to a multiple of 16
+def get_raw_capture_size(resolution):
+    width, height = resolution
+    return ((width + 31) // 32 * 32, (height + 15) // 16 * 16)
+
+
+class PiBackend(object):
+    'Hardware backend for a real Raspberry Pi with PiCamera and attached screen'
+
+    name = 'pi'
+    gpio = None
+
+    def __init__(self):
+        import RPi.GPIO
+        import picamera  # http://picamera.readthedocs.org/en/release-1.4/install2.html
+
+        self.gpio = RPi.GPIO
+        self.picamera = picamera
+
+    def new_camera(self):
+        return self.picamera.PiCamera()
+
+    def init_display(self):
+        pass
+
+    def get_display_size(self, display_info):
+        return (display_info.current_w, display_info.current_h)
+
+    def set_screen_blanking(self, blank):
+        if blank:
+            # Restore monitor blanking (TODO can we store previous values?)
+            os.system("setterm -blank 30 -powerdown 30")
+        else:
+            # Stop the monitor blanking after inactivity
+            os.system("setterm -blank 0 -powerdown 0")
+
+    def play_button_script(self):
+        pass
+
+
+class SimulatedBackend(object):
+    'Hardware backend that simulates the GPIO, camera and display of the photo booth'
+
+    name = 'sim'
+    gpio = None
+
+    def __init__(self, button_script=None):
+        self.gpio = SimulatedGPIO()
+
+        if button_script is None:
+            button_script = os.environ.get('TWEETBOOTH_SIM_BUTTONS', '')
+        self.button_script = parse_button_script(button_script)
+
+    def new_camera(self):
+        return SimulatedCamera()
+
+    def init_display(self):
+        # Render into memory rather than onto a real screen
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    def get_display_size(self, display_info):
+        return config.sim_display_size
+
+    def set_screen_blanking(self, blank):
+        pass
+
+    # Start pressing buttons, as described by the button script, in a background thread
+    def play_button_script(self):
+        if len(self.button_script) > 0:
+            self.gpio.play_script(self.button_script)
+
+
+# parse_button_script()
+# A button script is a whitespace separated list of steps, each of the form
+#    delay_secs:button[:hold_secs]
+# where button is one of 's', 'l', 'r' or 'exit'. e.g. "2:s 1:s 3:r 1:s 2:l 1:exit:4"
+def parse_button_script(script):
+    steps = []
+    for curr_step in script.split():
+        parts = curr_step.split(':')
+        if len(parts) < 2 or len(parts) > 3:
+            raise ValueError("Badly formed button script step: " + curr_step)
+
+        delay_secs = float(parts[0])
+        button = parts[1]
+        hold_secs = float(parts[2]) if len(parts) == 3 else 0.1
+
+        steps.append((delay_secs, button, hold_secs))
+
+    return steps
+
+
+class SimulatedGPIO(object):
+    'Stand-in for the RPi.GPIO module, with buttons that can be pressed from code'
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    # Map the button characters used in button scripts onto their GPIO pins
+    button_pins = {
+        's': config.button_pin_select,
+        'l': config.button_pin_left,
+        'r': config.button_pin_right,
+        'exit': config.button_pin_exit,
+    }
+
+    def __init__(self):
+        self.mode = None
+        self.pin_levels = {}
+        self.edge_callbacks = {}
+        self.lock = threading.Lock()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, warnings):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        with self.lock:
+            if direction == self.IN:
+                # Buttons are pulled up, so read high until they are pressed
+                self.pin_levels[pin] = self.LOW if pull_up_down == self.PUD_DOWN else self.HIGH
+            else:
+                self.pin_levels[pin] = self.HIGH if initial else self.LOW
+
+    def input(self, pin):
+        with self.lock:
+            return self.pin_levels.get(pin, self.HIGH)
+
+    def output(self, pin, value):
+        with self.lock:
+            self.pin_levels[pin] = self.HIGH if value else self.LOW
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self.lock:
+            self.edge_callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.edge_callbacks.pop(pin, None)
+
+    def cleanup(self):
+        with self.lock:
+            self.pin_levels = {}
+            self.edge_callbacks = {}
+
+    def set_input_level(self, pin, level):
+        with self.lock:
+            prev_level = self.pin_levels.get(pin, self.HIGH)
+            self.pin_levels[pin] = level
+            edge, callback = self.edge_callbacks.get(pin, (None, None))
+
+        if callback is None or prev_level == level:
+            return
+
+        falling = level == self.LOW
+        if edge == self.BOTH or (edge == self.FALLING and falling) or (edge == self.RISING and not falling):
+            callback(pin)
+
+    # Press (pull low) then release the pin for the button character 'button'
+    def press(self, button, hold_secs=0.1):
+        pin = self.button_pins[button]
+        self.set_input_level(pin, self.LOW)
+        time.sleep(hold_secs)
+        self.set_input_level(pin, self.HIGH)
+
+    def play_script(self, steps):
+        def play():
+            for delay_secs, button, hold_secs in steps:
+                time.sleep(delay_secs)
+                self.press(button, hold_secs)
+
+        player = threading.Thread(target=play)
+        player.daemon = True
+        player.start()
+
+        return player
+
+
+class SimulatedOverlay(object):
+    'Stand-in for a PiCamera preview overlay'
+
+    def __init__(self, source, size=None, layer=0, alpha=255, **options):
+        self.size = size
+        self.layer = layer
+        self.alpha = alpha
+        self.update(source)
+
+    def update(self, source):
+        self.source = source
+
+
+class SimulatedPreview(object):
+    'Stand-in for a PiCamera preview renderer'
+
+    def __init__(self, alpha=255, **options):
+        self.alpha = alpha
+
+
+class SimulatedCamera(object):
+    'Stand-in for picamera.PiCamera, which captures synthetic JPEG images'
+
+    def __init__(self):
+        self.resolution = (1280, 720)
+        self.led = True
+        self.vflip = False
+        self.hflip = False
+        self.saturation = 0
+        self.shutter_speed = 0
+        self.exposure_speed = 20000
+        self.awb_mode = 'auto'
+        self.awb_gains = (1.5, 1.2)
+        self.preview = None
+        self.closed = False
+        self.overlays = []
+        self.frame_counter = 0
+
+    def start_preview(self, **options):
+        self.preview = SimulatedPreview(**options)
+        return self.preview
+
+    def stop_preview(self):
+        self.preview = None
+
+    def close(self):
+        self.stop_preview()
+        self.overlays = []
+        self.closed = True
+
+    def add_overlay(self, source, size=None, format=None, **options):
+        overlay = SimulatedOverlay(source, size, **options)
+        self.overlays.append(overlay)
+        return overlay
+
+    def remove_overlay(self, overlay):
+        self.overlays.remove(overlay)
+
+    # Draw a frame that changes from capture to capture, so that the pipeline has real work to do
+    def synthetic_frame(self):
+        from PIL import Image, ImageDraw
+
+        self.frame_counter += 1
+        width, height = self.resolution
+        shade = (self.frame_counter * 40) % 256
+
+        img = Image.new('RGB', (width, height), (shade, 128, 255 - shade))
+        draw = ImageDraw.Draw(img)
+        for i in range(0, width, 40):
+            draw.line([(i, 0), ((i + self.frame_counter * 15) % width, height)], fill=(255, 255 - shade, 0))
+        draw.ellipse([width // 4, height // 4, width * 3 // 4, height * 3 // 4], outline=(255, 255, 255))
+
+        return img
+
+    # format 'rgb' writes raw, padded pixels (as the real camera does), anything else writes a JPEG
+    def capture(self, output, format=None, **options):
+        from PIL import Image
+
+        img = self.synthetic_frame()
+
+        if format == 'rgb':
+            padded_img = Image.new('RGB', get_raw_capture_size(img.size))
+            padded_img.paste(img, (0, 0))
+            output.write(padded_img.tobytes())
+        else:
+            img.save(output, 'JPEG', quality=85)
+
+    # Mimic PiCamera.capture_continuous(): 'output' is either a filename pattern,
+    #    which may include {counter} and {timestamp}, or a stream which is written to for each capture
+    def capture_continuous(self, output, format=None, use_video_port=False, **options):
+        counter = 1
+        while True:
+            if isinstance(output, string_types):
+                filename = output.format(counter=counter, timestamp=datetime.datetime.now())
+                self.capture(filename, format)
+                yield filename
+            else:
+                self.capture(output, format)
+                yield output
+
+            counter += 1
+
+
+_backend = None
+
+
+# get_backend()
+# Returns the hardware backend chosen in config.hardware_backend (creating it on first use)
+def get_backend():
+    global _backend
+
+    if _backend is None:
+        if config.hardware_backend == 'sim':
+            _backend = SimulatedBackend()
+        else:
+            _backend = PiBackend()
+
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Classes to run image processing in a bounded pool of worker processes
+# PIL's paste/resize/encode work holds the GIL, so threads don't run it any faster - processes do.
+# Pixels are handed to and from the workers through files in shared memory (/dev/shm),
+#    so only a short description of each image is pickled.
+
+import os
+import mmap
+import time
+import signal
+import tempfile
+import multiprocessing
+
+import config
+
+
+class SharedImage(object):
+    'The pixels of a PIL Image, held in a shared memory file that any process can map'
+
+    def __init__(self, mode, size, filepath):
+        self.mode = mode
+        self.size = tuple(size)
+        self.filepath = filepath
+
+    # Return a (writable) copy of the image
+    def get_image(self):
+        from PIL import Image
+
+        with open(self.filepath, 'rb') as in_file:
+            pixel_map = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return Image.frombytes(self.mode, self.size, pixel_map[:])
+            finally:
+                pixel_map.close()
+
+    # Replace the shared pixels with those of img (which may be a different size or mode)
+    def put_image(self, img):
+        write_pixels(self.filepath, img.tobytes())
+        self.mode = img.mode
+        self.size = img.size
+
+    def unlink(self):
+        try:
+            os.remove(self.filepath)
+        except OSError:
+            pass
+
+
+# share_image()
+# Copy a PIL Image into shared memory, returning a (picklable) SharedImage.
+# The caller must unlink() it when done.
+def share_image(img):
+    shm_fd, filepath = tempfile.mkstemp(prefix='tweetBooth-', suffix='.pixels', dir=get_shared_memory_dir())
+    os.close(shm_fd)
+
+    write_pixels(filepath, img.tobytes())
+    return SharedImage(img.mode, img.size, filepath)
+
+
+def write_pixels(filepath, pixels):
+    with open(filepath, 'r+b') as out_file:
+        out_file.truncate(len(pixels))
+        if len(pixels) > 0:
+            pixel_map = mmap.mmap(out_file.fileno(), len(pixels))
+            try:
+                pixel_map[:] = pixels
+            finally:
+                pixel_map.close()
+
+
+def get_shared_memory_dir():
+    if os.path.isdir(config.shared_memory_dir):
+        return config.shared_memory_dir
+    return tempfile.gettempdir()
+
+
+class ImageFuture(object):
+    'The eventual result of a job submitted to ImageWorkers'
+
+    def __init__(self, async_result):
+        self.async_result = async_result
+
+    def done(self):
+        return self.async_result.ready()
+
+    # Wait for the job, returning its result or raising the exception it raised
+    def result(self, timeout=None):
+        if timeout is None:
+            # Waiting without a timeout can't be interrupted by Ctrl-C in Python 2
+            while not self.async_result.ready():
+                self.async_result.wait(1)
+            return self.async_result.get()
+
+        return self.async_result.get(timeout)
+
+
+# Workers leave Ctrl-C to the main process, which tidies up the pool
+def ignore_interrupts():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class ImageWorkers(object):
+    'A fixed size pool of image processing processes, shared by all photobooth functions'
+
+    # How often wait() checks on its jobs (and reports progress)
+    poll_secs = 0.1
+
+    # Create before pygame is initialised (and before any threads are started),
+    #    so the worker processes are forked from a clean process
+    def __init__(self, num_workers=None):
+        if num_workers is None:
+            num_workers = config.image_worker_processes
+        if num_workers is None:
+            try:
+                num_workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                num_workers = 1
+
+        self.num_workers = num_workers
+        self.pool = multiprocessing.Pool(num_workers, ignore_interrupts)
+
+    # submit()
+    # Run function(*args) in a worker process. function must be defined at module level,
+    #    and its arguments and result must be picklable (use share_image() for images).
+    def submit(self, function, *args):
+        return ImageFuture(self.pool.apply_async(function, args))
+
+    # wait()
+    # Block until all of the futures are done, calling progress_callback(num_done, num_total)
+    #    each time another one finishes. Returns their results, in order.
+    def wait(self, futures, progress_callback=None):
+        num_done = 0
+        while True:
+            curr_num_done = len([future for future in futures if future.done()])
+
+            if curr_num_done != num_done:
+                num_done = curr_num_done
+                if progress_callback is not None:
+                    progress_callback(num_done, len(futures))
+
+            if num_done == len(futures):
+                break
+
+            time.sleep(self.poll_secs)
+
+        return [future.result() for future in futures]
+
+    def get_num_workers(self):
+        return self.num_workers
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Class to measure how long the booth takes to react to a button press
+# The latency of a press is the time from its GPIO edge to the first display flip (or camera overlay
+#    update) after the press was acted on. Latencies are kept per screen, in a rolling window.
+
+import json
+import math
+import time
+import threading
+from collections import deque
+
+
+class LatencyMonitor(object):
+    'Keeps rolling button-to-photon latency statistics for each booth screen'
+
+    # How many of the most recent presses to keep statistics for, per screen
+    window_size = 500
+
+    # A press that is not reflected on screen within this time (e.g. the Exit button) is dropped
+    max_latency_secs = 10
+
+    # Upper edges (in milliseconds) of the histogram buckets, the last bucket catches everything else
+    histogram_buckets_ms = [20, 50, 100, 200, 500, 1000]
+
+    def __init__(self):
+        # Reentrant, as dump() is called from the SIGUSR1 handler, which runs on the main thread,
+        #    possibly while it is part way through one of the methods below
+        self.lock = threading.RLock()
+        self.curr_screen = None
+        self.pending_press = None
+        self.samples = {}
+
+    # Name the screen that the guest is now looking at, e.g. 'main_menu', 'instructions'
+    #    (None if presses on the current screen should not be measured)
+    def set_screen(self, screen_name):
+        with self.lock:
+            self.curr_screen = screen_name
+
+    # Called when a button press, which was detected at edge_time, is acted on
+    def button_consumed(self, button, edge_time):
+        with self.lock:
+            if self.curr_screen is None:
+                self.pending_press = None
+            else:
+                self.pending_press = (self.curr_screen, button, edge_time)
+
+    # Called whenever something new is shown to the guest
+    def frame_presented(self):
+        present_time = time.time()
+
+        with self.lock:
+            if self.pending_press is None:
+                return
+
+            screen_name, button, edge_time = self.pending_press
+            self.pending_press = None
+
+            latency_secs = present_time - edge_time
+            if latency_secs > self.max_latency_secs:
+                return
+
+            if screen_name not in self.samples:
+                self.samples[screen_name] = deque(maxlen=self.window_size)
+            self.samples[screen_name].append(latency_secs * 1000)
+
+    # Return a dict of statistics for each screen: sample count, p50/p95/p99 and a histogram (all in ms)
+    def get_statistics(self):
+        with self.lock:
+            screen_samples = dict((screen_name, sorted(samples))
+                                  for screen_name, samples in self.samples.items())
+
+        statistics = {}
+        for screen_name, samples in screen_samples.items():
+            histogram = [0] * (len(self.histogram_buckets_ms) + 1)
+            for curr_sample in samples:
+                bucket_num = 0
+                while (bucket_num < len(self.histogram_buckets_ms) and
+                       curr_sample > self.histogram_buckets_ms[bucket_num]):
+                    bucket_num += 1
+                histogram[bucket_num] += 1
+
+            statistics[screen_name] = {
+                'count': len(samples),
+                'p50': self.get_percentile(samples, 50),
+                'p95': self.get_percentile(samples, 95),
+                'p99': self.get_percentile(samples, 99),
+                'histogram_buckets_ms': self.histogram_buckets_ms,
+                'histogram': histogram,
+            }
+
+        return statistics
+
+    # Nearest-rank percentile of an already sorted list
+    def get_percentile(self, sorted_samples, percent):
+        if len(sorted_samples) < 1:
+            return None
+
+        rank = int(math.ceil(percent / 100.0 * len(sorted_samples))) - 1
+        rank = min(max(rank, 0), len(sorted_samples) - 1)
+        return round(sorted_samples[rank], 1)
+
+    # Print the statistics to the console, and if 'filepath' is given write them there as JSON
+    def dump(self, filepath=None):
+        statistics = self.get_statistics()
+
+        print "Button-to-photon latency (ms):"
+        for screen_name in sorted(statistics.keys()):
+            curr_stats = statistics[screen_name]
+            print "    %-14s n=%-5d p50=%-8s p95=%-8s p99=%s" % (screen_name, curr_stats['count'],
+                                                               curr_stats['p50'], curr_stats['p95'],
+                                                               curr_stats['p99'])
+
+        if filepath is not None:
+            try:
+                with open(filepath, 'w') as out_file:
+                    json.dump(statistics, out_file, indent=2, sort_keys=True)
+            except IOError as e:
+                print "Error writing latency statistics: ", e
+
+        return statistics
+
+
+_latency_monitor = LatencyMonitor()
+
+
+def get_latency_monitor():
+    return _latency_monitor
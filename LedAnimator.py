@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# Class to animate the button LEDs without blocking the caller
+
+import time
+import threading
+
+
+class LedPattern(object):
+    'A named sequence of on/off steps, played on one or more button LEDs'
+
+    def __init__(self, name, leds, steps, repeat):
+        self.name = name
+        self.leds = leds
+        self.steps = steps  # List of [seconds, LEDs on?]
+        self.repeat = repeat
+        self.step_num = 0
+        self.cancelled = False
+        self.finished = threading.Event()
+
+
+class LedAnimator(object):
+    'Drives all LED patterns from a single scheduler thread, using a timing wheel'
+
+    # The wheel turns one slot every tick_secs, so wheel_size * tick_secs seconds per revolution
+    tick_secs = 0.05
+    wheel_size = 64
+
+    def __init__(self, buttonhandler):
+        self.buttonhandler = buttonhandler
+
+        # Each slot holds [rounds_to_wait, pattern] entries, due when the wheel reaches that slot
+        self.wheel = [[] for i in range(self.wheel_size)]
+        self.curr_slot = 0
+        self.num_scheduled = 0
+        self.next_tick_time = None
+
+        self.patterns = {}
+        self.running = True
+        self.condition = threading.Condition()
+
+        self.scheduler = threading.Thread(target=self.run_scheduler)
+        self.scheduler.daemon = True
+        self.scheduler.start()
+
+    # Build the steps of the named pattern:
+    #    'blink'     - off and on every interval_secs, until cancelled
+    #    'pulse'     - a double flash heartbeat every period_secs, until cancelled
+    #    'countdown' - slow_flashes one second flashes, then fast_flashes quarter second flashes, then off
+    def get_pattern_steps(self, pattern, options):
+        if pattern == 'blink':
+            interval_secs = options.get('interval_secs', 0.5)
+            return [[interval_secs, False], [interval_secs, True]], True
+
+        if pattern == 'pulse':
+            period_secs = options.get('period_secs', 1.5)
+            return [[0.1, True], [0.1, False], [0.1, True], [max(period_secs - 0.3, 0.1), False]], True
+
+        if pattern == 'countdown':
+            steps = []
+            for i in range(options.get('slow_flashes', 3)):
+                steps += [[1, True], [1, False]]
+            for i in range(options.get('fast_flashes', 3)):
+                steps += [[0.25, True], [0.25, False]]
+            return steps, False
+
+        raise ValueError("Unknown LED pattern: " + pattern)
+
+    # start()
+    # Start playing 'pattern' on 'leds' (one or more of 's', 'l', 'r') under the given name,
+    #    replacing any pattern already playing under that name. Returns immediately.
+    def start(self, name, leds, pattern, **options):
+        steps, repeat = self.get_pattern_steps(pattern, options)
+
+        with self.condition:
+            self.cancel_pattern(name)
+
+            new_pattern = LedPattern(name, leds, steps, repeat)
+            self.patterns[name] = new_pattern
+            self.play_step(new_pattern)
+
+            self.condition.notify()
+
+    # cancel()
+    # Stop the named pattern. If leds_on is True or False, leave its LEDs in that state.
+    def cancel(self, name, leds_on=None):
+        with self.condition:
+            pattern = self.cancel_pattern(name)
+
+            if pattern is not None and leds_on is not None:
+                self.buttonhandler.light_button_leds(pattern.leds, leds_on)
+
+    # wait()
+    # Block until the named pattern has finished (or been cancelled).
+    # Returns False if it is still playing after 'timeout' seconds.
+    def wait(self, name, timeout=None):
+        with self.condition:
+            pattern = self.patterns.get(name)
+
+        if pattern is None:
+            return True
+
+        return pattern.finished.wait(timeout)
+
+    def is_playing(self, name):
+        with self.condition:
+            return name in self.patterns
+
+    def stop(self):
+        with self.condition:
+            for name in list(self.patterns.keys()):
+                self.cancel_pattern(name)
+
+            self.running = False
+            self.condition.notify()
+
+        self.scheduler.join()
+
+    # Must be called with self.condition held
+    def cancel_pattern(self, name):
+        pattern = self.patterns.pop(name, None)
+
+        if pattern is not None:
+            # Its entry in the wheel is discarded when the wheel reaches it
+            pattern.cancelled = True
+            pattern.finished.set()
+
+        return pattern
+
+    # Light the LEDs for the pattern's current step, and schedule the step after it.
+    # Must be called with self.condition held
+    def play_step(self, pattern):
+        step_secs, leds_on = pattern.steps[pattern.step_num]
+        self.buttonhandler.light_button_leds(pattern.leds, leds_on)
+
+        pattern.step_num += 1
+        if pattern.step_num == len(pattern.steps):
+            if not pattern.repeat:
+                # Hold the last step for its duration, then the pattern is finished
+                pattern.step_num = None
+            else:
+                pattern.step_num = 0
+
+        self.schedule(pattern, step_secs)
+
+    # Must be called with self.condition held
+    def schedule(self, pattern, delay_secs):
+        num_ticks = max(1, int(round(float(delay_secs) / self.tick_secs)))
+        slot = (self.curr_slot + num_ticks) % self.wheel_size
+        rounds = (num_ticks - 1) // self.wheel_size
+
+        self.wheel[slot].append([rounds, pattern])
+
+        if self.num_scheduled == 0:
+            # The wheel was idle, so start it turning from now
+            self.next_tick_time = time.time() + self.tick_secs
+        self.num_scheduled += 1
+
+    def run_scheduler(self):
+        with self.condition:
+            while self.running:
+                if self.num_scheduled == 0:
+                    # Nothing to animate, so sleep until start() gives us something to do
+                    self.condition.wait()
+                    continue
+
+                wait_secs = self.next_tick_time - time.time()
+                if wait_secs > 0:
+                    self.condition.wait(wait_secs)
+                    continue
+
+                self.next_tick_time += self.tick_secs
+                self.curr_slot = (self.curr_slot + 1) % self.wheel_size
+                self.advance_slot(self.wheel[self.curr_slot])
+
+    # Must be called with self.condition held
+    def advance_slot(self, slot_entries):
+        due_entries = []
+        for entry in list(slot_entries):
+            if entry[0] > 0:
+                entry[0] -= 1
+            else:
+                slot_entries.remove(entry)
+                due_entries.append(entry[1])
+
+        for pattern in due_entries:
+            self.num_scheduled -= 1
+
+            if pattern.cancelled:
+                continue
+
+            if pattern.step_num is None:
+                # Finished a non-repeating pattern
+                self.patterns.pop(pattern.name, None)
+                pattern.finished.set()
+            else:
+                self.play_step(pattern)
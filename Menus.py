@@ -7,6 +7,8 @@ import time
 import config
 
 from PrintOnScreen import TextPrinter, ImagePrinter, CursorPrinter, screen_colour_fill
+from SceneCache import Scene
+from LatencyMonitor import get_latency_monitor
 
 
 class Menus(object):
@@ -14,6 +16,7 @@ class Menus(object):
 
     photobooth = None
     buttonhandler = None
+    scenecache = None
 
     # Set the text attributes for the main menu heading
     heading_font_colour = config.blue_colour
@@ -38,6 +41,7 @@ class Menus(object):
         self.photobooth = photobooth
         self.screen = photobooth.get_pygame_screen()
         self.buttonhandler = photobooth.get_button_handler()
+        self.scenecache = photobooth.get_scene_cache()
         self.textprinter = TextPrinter(self.screen)
         self.imageprinter = ImagePrinter(self.screen)
 
@@ -51,17 +55,27 @@ class Menus(object):
         self.menu_objects.append(item_class)
 
     def display_main_menu(self):
+        # The main menu only changes if its items do
+        menu_texts = [item_class.get_menu_text() for item_class in self.menu_objects]
+        self.scenecache.show(Scene('main_menu', self.draw_main_menu,
+                                   inputs=menu_texts, files=[config.start_menu_image]))
+
+    # Compose the main menu onto 'surface'
+    def draw_main_menu(self, surface):
+        textprinter = TextPrinter(surface)
+        imageprinter = ImagePrinter(surface)
+
         self.text_defs = []
         self.image_defs = []
 
         # Print the heading on the screen
-        self.textprinter.print_text([["Welcome to the Tweet Booth",
-                                      60,
-                                      self.heading_font_colour,
-                                      "ct",
-                                      5]],
-                                    0,
-                                    True)
+        textprinter.print_text([["Welcome to the Tweet Booth",
+                                 60,
+                                 self.heading_font_colour,
+                                 "ct",
+                                 5]],
+                               0,
+                               True)
 
         # Print the main menu items
         for item_class in self.menu_objects:
@@ -71,9 +85,9 @@ class Menus(object):
                                    self.menu_item_alignment,
                                    self.menu_item_position])
 
-        # self.menu_option_rects = self.textprinter.print_text(self.text_defs,
-        #                                                      self.menu_item_line_spacing,
-        #                                                      False)
+        # self.menu_option_rects = textprinter.print_text(self.text_defs,
+        #                                                 self.menu_item_line_spacing,
+        #                                                 False)
 
         # Print the image overlays onto the screen
         self.image_defs = [
@@ -81,19 +95,26 @@ class Menus(object):
             [config.start_menu_image, 'cb', 0, 0]
         ]
 
-        self.imageprinter.print_images(self.image_defs, False)
+        imageprinter.print_images(self.image_defs, False)
 
     def get_main_menu_selection(self):
         # self.cursorprinter = CursorPrinter(self.screen, self.menu_cursor_font_size,
         #                                    self.menu_cursor_font_colour)
 
         self.menu_choice = 0
+        get_latency_monitor().set_screen('main_menu')
+
+        # While the guest decides, get the instructions screens ready (and, the first time, the UI images)
+        for item_class in self.menu_objects:
+            self.scenecache.prerender(item_class.get_instructions_scene())
+        self.scenecache.preload_images()
 
         # Print the initial cursor at the first menu option
         # self.cursorprinter.print_cursor(self.menu_option_rects, self.menu_choice)
 
         while True:
             self.button = self.buttonhandler.wait_for_buttons('s', False)
+            self.scenecache.finish_prerendering()
 
             if self.button == 's':
                 self.buttonhandler.light_button_leds('lsr', False)
@@ -122,6 +143,7 @@ class Menus(object):
                 self.photobooth.screen_saver()  # HACK
                 pass
 
+        get_latency_monitor().set_screen(None)
         return self.menu_choice
 
     def get_menu_object_at_index(self, object_index):
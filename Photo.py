@@ -2,16 +2,27 @@
 # Each Photo function has its own class
 
 import os
+import io
 import time
-import picamera  # http://picamera.readthedocs.org/en/release-1.4/install2.html
 import subprocess
 from PIL import Image
-import threading
 import random
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
-from twython import TwythonError
-from PrintOnScreen import OverlayOnCamera, TextPrinter, ImagePrinter, screen_colour_fill
+from PrintOnScreen import OverlayOnCamera, OverlayBufferBank, TextPrinter, ImagePrinter, screen_colour_fill, begin_frame, end_frame
 from PhotoHandler import PhotoHandler
+from HardwareBackend import get_raw_capture_size
+from ImageWorkers import share_image
+from GifWriter import GifWriter
+from BestShot import score_shot, choose_best_shots
+from SpeculativeProcessing import SpeculativeProcessing
+from SceneCache import Scene
+from LatencyMonitor import get_latency_monitor
 
 import config
 
@@ -37,10 +48,14 @@ class PhotoBoothFunction(object):
     imageprinter = None
     photohandler = None
     buttonhandler = None
+    ledanimator = None
+    scenecache = None
+    cameraservice = None
 
     local_file_dir = None
     local_upload_file_dir = None
     local_archive_dir = None
+    remote_file_dir = None
 
     booth_id = ""
 
@@ -49,15 +64,35 @@ class PhotoBoothFunction(object):
     photo_file_prefix = "twitterBooth"
     zip_filename = "photobooth_photos.zip"
 
+    rejected_message = "Photo Deleted"
+    success_message = "Photo Tweeted #CVconference"
+    error_message = "Oops, please try again"
+
     image_defs = []
 
     camera = None
+    imageworkers = None
+    tweetoutbox = None
+    speculation = None
+    captured_photos = []
+    best_shot_files = None
+    finish_futures = []
+    shared_photos = []
+    shared_overlay = None
+
+    # Bursts of photos are taken faster from the camera's video port, at some cost in quality
+    use_video_port = False
 
     def __init__(self, photobooth):
         self.booth_id = photobooth.get_booth_id()
         self.screen = photobooth.get_pygame_screen()
         self.filehandler = photobooth.get_file_handler()
         self.buttonhandler = photobooth.get_button_handler()
+        self.ledanimator = photobooth.get_led_animator()
+        self.scenecache = photobooth.get_scene_cache()
+        self.cameraservice = photobooth.get_camera_service()
+        self.imageworkers = photobooth.get_image_workers()
+        self.tweetoutbox = photobooth.get_tweet_outbox()
 
         self.local_file_dir = self.filehandler.get_local_file_dir()
         self.local_upload_file_dir = self.filehandler.get_upload_file_dir()
@@ -72,12 +107,15 @@ class PhotoBoothFunction(object):
         now = time.strftime("%Y-%m-%d-%H:%M:%S")
         print "Take photos - " + self.menu_text + ": " + now
 
+        # Let the last guest's processing finish with the files, before they are cleared away
+        self.end_speculative_processing()
+
         # Clear the local file directory, and the upload directory
         self.filehandler.delete_local_files()
         self.filehandler.delete_upload_files()
 
-        # Get hold of the camera
-        self.camera = picamera.PiCamera()
+        # Get hold of the camera (it is usually already running, from the last guest)
+        self.camera = self.cameraservice.lease()
         self.camera.led = False
         self.camera.vflip = False
         self.camera.hflip = False
@@ -89,32 +127,31 @@ class PhotoBoothFunction(object):
 
         try:  # Take the photos
 
-            local_file_dir = self.filehandler.get_local_file_dir()
-            manipulate_thread_list = []
-
-            for i in range(3):
-                self.buttonhandler.light_button_leds('s', True)
-                time.sleep(1)
-                self.buttonhandler.light_button_leds('s', False)
-                time.sleep(1)
-
-            for i in range(3):
-                self.buttonhandler.light_button_leds('s', True)
-                time.sleep(.25)
-                self.buttonhandler.light_button_leds('s', False)
-                time.sleep(.25)
-
-            # Take photos
-            for i, filepath in enumerate(self.camera.capture_continuous(os.path.join(local_file_dir,
-                                                                                     self.photo_file_prefix + '-' + '{counter:02d}' + self.image_extension))):
-                print('Saving to ' + filepath)
-
-                # Each photobooth function can override manipulate_photo() to process
-                #     the photos before they are saved to disk
-                # Kick off the processing in a separate thread, so as not to delay the photo taking
-                manipulate_thread_list.append(threading.Thread(target=self.manipulate_photo,
-                                                               args=(filepath,)))
-                manipulate_thread_list[len(manipulate_thread_list) - 1].start()
+            # The finished photos, in memory, ready for the review screen
+            self.captured_photos = []
+            # The files of the best of a burst of photos, if they have been picked out (see finish_capture)
+            self.best_shot_files = None
+
+            # Flash the countdown on the Select LED, and get ready to capture while it plays
+            self.ledanimator.start('countdown', 's', 'countdown')
+
+            self.prepare_for_capture()
+            self.start_capture()
+
+            self.ledanimator.wait('countdown')
+
+            # Take photos, as raw pixels into memory rather than as JPEGs on the SD card
+            capture_size = tuple(self.camera.resolution)
+            raw_capture_size = get_raw_capture_size(capture_size)
+            stream = io.BytesIO()
+            for i, frame_stream in enumerate(self.camera.capture_continuous(stream, format='rgb',
+                                                                            use_video_port=self.use_video_port)):
+                img = Image.frombuffer('RGB', raw_capture_size, frame_stream.getvalue(), 'raw', 'RGB', 0, 1)
+                img = img.crop((0, 0, capture_size[0], capture_size[1]))
+                frame_stream.seek(0)
+                frame_stream.truncate()
+
+                self.capture_photo(img, i)
 
                 # If we have finished taking our photos, bail out
                 if i == self.total_pics - 1:
@@ -125,40 +162,132 @@ class PhotoBoothFunction(object):
                 if self.buttonhandler.button_is_down(config.button_pin_left):
                     break
 
-                time.sleep(capture_delay)  # pause in-between shots
-                self.camera.led = True
-                time.sleep(0.25)  # Light the LED for just a bit
+                self.wait_between_photos(capture_delay)
         finally:
-            self.camera.stop_preview()
-            self.camera.close()
+            self.ledanimator.cancel('countdown', False)
+            # Hand the camera back, still running, ready for the next guest
+            self.cameraservice.release()
             self.camera = None
 
-            # Wait for MainputlatePhoto() calls to end
-            self.textprinter.print_text([["Please wait ...", 124, config.black_colour, "cm", 0]], 0, False)
-            for curr_thread in manipulate_thread_list:
-                curr_thread.join()
+            self.finish_capture()
+
+    # Called during the countdown, after prepare_for_capture()
+    def start_capture(self):
+        self.finish_futures = []
+        self.shared_photos = []
+        self.shared_overlay = None
+
+        # Put the overlay where the workers can see it, once for all of the photos
+        overlay_img = self.get_photo_overlay()
+        if overlay_img is not None:
+            self.shared_overlay = share_image(overlay_img)
+
+    # Called with each photo (a PIL Image) as it is captured
+    def capture_photo(self, img, photo_num):
+        filepath = os.path.join(self.filehandler.get_local_file_dir(),
+                                self.photo_file_prefix + '-' + '%02d' % (photo_num + 1) + self.image_extension)
+        print('Saving to ' + filepath)
+
+        # Each photobooth function can override get_photo_overlay() to superimpose an image
+        #     onto the photos before they are saved to disk
+        # Hand the processing to a worker process, so as not to delay the photo taking
+        # (the shared photo is kept here too, so it is tidied up even if the worker fails)
+        shared_photo = share_image(img)
+        self.shared_photos.append(shared_photo)
+        self.finish_futures.append(self.imageworkers.submit(finish_photo, shared_photo, self.shared_overlay,
+                                                            filepath, config.photo_jpeg_quality,
+                                                            self.total_pics > config.best_shot_count))
+
+    def wait_between_photos(self, capture_delay):
+        time.sleep(capture_delay)  # pause in-between shots
+        self.camera.led = True
+        time.sleep(0.25)  # Light the LED for just a bit
+
+    # Called once the camera has been released
+    def finish_capture(self):
+        # Wait for the workers to finish the photos, then collect them for the review screen
+        photos = []
+        shot_scores = []
+        try:
+            self.show_processing_progress(0, len(self.finish_futures))
+            for shared_photo, shot_score in self.imageworkers.wait(self.finish_futures,
+                                                                   self.show_processing_progress):
+                photos.append(shared_photo.get_image())
+                shot_scores.append(shot_score)
+        finally:
+            # Whether or not the workers succeeded, free the shared memory (it is RAM, until reboot)
+            for shared_photo in self.shared_photos:
+                shared_photo.unlink()
+            if self.shared_overlay is not None:
+                self.shared_overlay.unlink()
+            self.finish_futures = []
+            self.shared_photos = []
+            self.shared_overlay = None
+
+        # Only show (and tweet) the best of a burst
+        if len(photos) > config.best_shot_count and None not in shot_scores:
+            best_shots = choose_best_shots(shot_scores, config.best_shot_count)
+            photos = [photos[i] for i in best_shots]
+            self.best_shot_files = [shot_scores[i].filepath for i in best_shots]
+            print "Best shots: " + ", ".join(os.path.basename(filepath) for filepath in self.best_shot_files)
+
+        self.captured_photos += photos
+
+    def show_processing_progress(self, num_done, num_total):
+        progress_msg = [["Please wait ...", 124, config.black_colour, "cm", 0]]
+        if num_total > 1:
+            progress_msg.append([str(num_done) + " of " + str(num_total) + " photos ready",
+                                 48, config.black_colour, "cb", 25])
+
+        self.textprinter.print_text(progress_msg, 0, True)
+
+    def get_captured_photos(self):
+        return self.captured_photos
+
+    # The photos to tweet: all of those taken, or just the best of a burst
+    def get_tweet_files(self):
+        if self.best_shot_files is not None:
+            return self.best_shot_files
+        return self.filehandler.get_tweet_files(self.image_extension)
+
+    # *** The instruction screen for the current photobooth function ***
+    def get_instructions_scene(self):
+        return Scene('instructions', self.draw_instructions,
+                     inputs=[self.menu_text] + list(self.instructions),
+                     files=[config.start_overlay_image, config.menu_side_overlay_image])
+
+    # Compose the instruction screen onto 'surface'
+    def draw_instructions(self, surface):
+        textprinter = TextPrinter(surface)
+        imageprinter = ImagePrinter(surface)
 
-    # *** Display the instruction screen for the current photobooth function ***
-    def display_instructions(self):
         instructions_msg = []
         for curr_line in self.instructions:
             instructions_msg.append([curr_line, 84, config.off_black_colour, "c", 0])
 
         # Print the heading on the screen
-        self.textprinter.print_text([[self.menu_text,
-                                      48,
-                                      config.blue_colour,
-                                      "ct",
-                                      5]],
-                                    0,
-                                    True)
+        textprinter.print_text([[self.menu_text,
+                                 48,
+                                 config.blue_colour,
+                                 "ct",
+                                 5]],
+                               0,
+                               True)
+
+        textprinter.print_text(instructions_msg, 40, False)
 
-        self.textprinter.print_text(instructions_msg, 40, False)
+        imageprinter.print_images([[config.start_overlay_image, 'cb', 0, 0]], False)
+        imageprinter.print_images([[config.menu_side_overlay_image, 'lb', 0, 0]], False)
 
-        self.imageprinter.print_images([[config.start_overlay_image, 'cb', 0, 0]], False)
-        self.imageprinter.print_images([[config.menu_side_overlay_image, 'lb', 0, 0]], False)
+    # *** Display the instruction screen for the current photobooth function ***
+    def display_instructions(self):
+        # Start the camera while the guest reads, if it was powered down
+        self.cameraservice.warm_up()
+
+        self.scenecache.show(self.get_instructions_scene())
 
         # Wait for the user to press the Select button to exit to menu
+        get_latency_monitor().set_screen('instructions')
         choice = ""
         while True:
             choice = self.buttonhandler.wait_for_buttons('ls', True)
@@ -166,6 +295,7 @@ class PhotoBoothFunction(object):
             if (choice != 'screensaver'):
                 break
 
+        get_latency_monitor().set_screen(None)
         return choice
 
     def user_accept_photos(self):
@@ -176,27 +306,41 @@ class PhotoBoothFunction(object):
 
         self.imageprinter.print_images(images_to_print, False)
 
+        # While the guest decides, get both of the possible next screens ready
+        self.scenecache.prerender(self.get_message_scene(self.rejected_message, 124))
+        self.scenecache.prerender(self.get_message_scene(self.success_message, 64))
+
+        get_latency_monitor().set_screen('accept')
         while True:
             choice = self.buttonhandler.wait_for_buttons('lr', True)
+            self.scenecache.finish_prerendering()
 
             if (choice != 'screensaver'):
                 break
 
+        get_latency_monitor().set_screen(None)
         return choice
 
+    # *** A screen with a single centred message ***
+    def get_message_scene(self, message, font_size):
+        def draw_message(surface):
+            TextPrinter(surface).print_text([[message, font_size, config.black_colour, "cm", 0]], 0, True)
+
+        return Scene('message', draw_message, inputs=[message, font_size])
+
     def display_rejected_message(self):
         print "Photo Deleted"
-        self.textprinter.print_text([["Photo Deleted", 124, config.black_colour, "cm", 0]], 0, True)
+        self.scenecache.show(self.get_message_scene(self.rejected_message, 124))
         time.sleep(2)
 
     def display_success_message(self):
         print "Photo Tweeted"
-        self.textprinter.print_text([["Photo Tweeted #CVconference", 64, config.black_colour, "cm", 0]], 0, True)
+        self.scenecache.show(self.get_message_scene(self.success_message, 64))
         time.sleep(2)
 
     def display_error_message(self):
         print "Error with Tweet"
-        self.textprinter.print_text([["Oops, please try again", 64, config.black_colour, "cm", 0]], 0, True)
+        self.scenecache.show(self.get_message_scene(self.error_message, 64))
         time.sleep(2)
 
     # *** Show user where their photos have been uploaded to ***
@@ -208,9 +352,13 @@ class PhotoBoothFunction(object):
             [remote_upload_dir, 92, config.blue_colour, "c", 0]
         ]
 
-        self.textprinter.print_text(download_url_msg, 40, True)
+        begin_frame()
+        try:
+            self.textprinter.print_text(download_url_msg, 40, True)
 
-        self.imageprinter.print_images([[config.menu_overlay_image, 'cb', 0, 0]], False)
+            self.imageprinter.print_images([[config.menu_overlay_image, 'cb', 0, 0]], False)
+        finally:
+            end_frame()
 
         # Wait for the user to press the Select button to exit to menu
         while True:
@@ -225,9 +373,13 @@ class PhotoBoothFunction(object):
             ["Upload Failed ... Sorry", 124, config.black_colour, "cm", 0]
         ]
 
-        self.textprinter.print_text(download_url_msg, 40, True)
+        begin_frame()
+        try:
+            self.textprinter.print_text(download_url_msg, 40, True)
 
-        self.imageprinter.print_images([[config.menu_overlay_image, 'cb', 0, 0]], False)
+            self.imageprinter.print_images([[config.menu_overlay_image, 'cb', 0, 0]], False)
+        finally:
+            end_frame()
 
         # Wait for the user to press the Select button to exit to menu
         while True:
@@ -236,28 +388,61 @@ class PhotoBoothFunction(object):
             if (choice != 'screensaver'):
                 break
 
-    # A function to manipulate a just-taken photo, to override if necessary
-    def manipulate_photo(self, filepath):
+    # A function to do any setup needed by get_photo_overlay(), to override if necessary
+    # Called while the countdown is playing, just before the photos are taken
+    def prepare_for_capture(self):
         pass
 
+    # A function to choose an image (an RGBA PIL Image) to superimpose onto every photo,
+    #    to override if necessary. Called after prepare_for_capture()
+    def get_photo_overlay(self):
+        return None
+
+    # Start processing the photos in the background, while the guest decides whether to accept them
+    def start_speculative_processing(self):
+        self.end_speculative_processing()
+
+        self.speculation = SpeculativeProcessing(self.photohandler, self.tweetoutbox, self.image_extension,
+                                                 self.image_defs, self.get_tweet_files())
+        self.speculation.start()
+
+    def cancel_speculative_processing(self):
+        if self.speculation is not None:
+            self.speculation.cancel()
+
+    def end_speculative_processing(self):
+        if self.speculation is not None:
+            self.speculation.wait()
+            self.speculation = None
+
     def process_photos(self):
         self.textprinter.print_text([["Tweeting photo...", 48, config.black_colour, "cb", 25]],
                                     0, True)
-        self.photohandler.prepare_images(self.image_extension, self.image_defs, True)
-        self.filehandler.zip_images(self.image_extension, self.zip_filename)
 
-    def upload_photos_using_defs(self, file_defs):
+        # Usually the images were prepared while the guest was deciding
+        if self.speculation is None or not self.speculation.wait():
+            self.photohandler.prepare_images(self.image_extension, self.image_defs, True)
+        # (the ZIP archive is written while it is uploaded, see upload_photos)
+
+    def upload_photos_using_defs(self, file_defs, zip_defs=None):
         success = True
 
         try:
-            self.filehandler.upload_files(file_defs)
-        except subprocess.CalledProcessError as e:
+            self.filehandler.upload_files(file_defs, self.show_upload_progress, zip_defs)
+        except (subprocess.CalledProcessError, EnvironmentError) as e:
             # If our upload threw an exception, then return 'None' in remote_upload_dir to let caller know
             # TODO: Check the actual error that came back, in case the upload was actually successful?
             success = False
 
         return success
 
+    def show_upload_progress(self, num_done, num_total, filepath):
+        print "Uploaded " + os.path.basename(filepath) + " (" + str(num_done) + " of " + str(num_total) + ")"
+
+        self.textprinter.print_text([["Uploading photos ...", 124, config.black_colour, "cm", 0],
+                                     [str(num_done) + " of " + str(num_total) + " files uploaded",
+                                      48, config.black_colour, "cb", 25]], 0, True)
+
     def set_total_pics(self, num_pics):
         self.total_pics = num_pics
 
@@ -274,20 +459,36 @@ class TwitterPhoto(PhotoBoothFunction):
         self.screen = photobooth.get_pygame_screen()
         self.filehandler = photobooth.get_file_handler()
         self.buttonhandler = photobooth.get_button_handler()
+        self.ledanimator = photobooth.get_led_animator()
+        self.scenecache = photobooth.get_scene_cache()
+        self.cameraservice = photobooth.get_camera_service()
+        self.imageworkers = photobooth.get_image_workers()
+        self.tweetoutbox = photobooth.get_tweet_outbox()
 
         self.local_file_dir = self.filehandler.get_local_file_dir()
         self.local_upload_file_dir = self.filehandler.get_upload_file_dir()
         self.local_archive_dir = self.filehandler.get_archive_file_dir()
+        self.remote_file_dir = self.filehandler.get_remote_file_dir()
 
         self.textprinter = TextPrinter(self.screen)
         self.imageprinter = ImagePrinter(self.screen)
-        self.photohandler = PhotoHandler(self.screen, self.filehandler)
+        self.photohandler = PhotoHandler(self.screen, self.filehandler, self.imageworkers)
 
         self.chosen_accompaniment = 0
+        self.accompaniment_img = None
         self.accompaniment_dir = self.filehandler.get_full_path(config.images_dir, 'accompany')
         self.accompany_button_overlay_image = self.filehandler.get_full_path(config.images_dir,
                                                                              'accompany_button_overlay.png')
 
+        # Decode and pad the badge picker overlays now, so cycling through them later is instant
+        self.overlaybank = OverlayBufferBank(photobooth.get_asset_bundle())
+        self.overlaybank.preload([config.badge_picker_menu_image] + self.get_accompaniment_overlay_files())
+
+    # Use the JPG versions of accompaniment files, which have black background
+    def get_accompaniment_overlay_files(self):
+        file_pattern = self.filehandler.get_full_path(self.accompaniment_dir, "*.jpg")
+        return self.filehandler.get_sorted_file_list(file_pattern)
+
     def start(self, total_pics=PhotoBoothFunction.total_pics):
         # Take and display photos
         self.total_pics = total_pics
@@ -304,7 +505,8 @@ class TwitterPhoto(PhotoBoothFunction):
 
         self.take_photos()
 
-        self.photohandler.show_single_photo(self.image_extension)
+        self.photohandler.show_single_photo(self.image_extension, self.get_captured_photos())
+        self.start_speculative_processing()
         choice = self.user_accept_photos()
 
         # See if user wants to accept photos
@@ -317,6 +519,7 @@ class TwitterPhoto(PhotoBoothFunction):
             else:
                 self.display_error_message()
         else:
+            self.cancel_speculative_processing()
             self.display_rejected_message()
 
     def take_photos(self):
@@ -347,18 +550,16 @@ class TwitterPhoto(PhotoBoothFunction):
         ################################# Step 5 - Take Photos ################################
         self.take_photos_and_close_camera(self.capture_delay)
 
-    def manipulate_photo(self, filepath):
-        # Superimpose the accompanying image onto the captured image
-        # http://effbot.org/imagingbook/image.htm
-        #     super_image is RGBA, so use it both for image and mask
+    def prepare_for_capture(self):
+        # Decode the chosen accompaniment image once, rather than once per photo
+        self.accompaniment_img = None
         if self.chosen_accompaniment > 1 and self.chosen_accompaniment < (len(self.accompaniment_files) + 2):
             curr_accompaniment_file = self.accompaniment_files[self.chosen_accompaniment - 2]
-            curr_img = Image.open(filepath)
-            super_img = Image.open(curr_accompaniment_file)
+            # (as RGBA, so that it carries its own mask through to the workers)
+            self.accompaniment_img = Image.open(curr_accompaniment_file).convert('RGBA')
 
-            curr_img.paste(super_img, None, super_img)
-
-            curr_img.save(filepath)
+    def get_photo_overlay(self):
+        return self.accompaniment_img
 
     def upload_photos(self):
         self.textprinter.print_text([["Uploading photos ...", 124, config.black_colour, "cm", 0]],
@@ -367,9 +568,6 @@ class TwitterPhoto(PhotoBoothFunction):
         remote_upload_dir = StringOperations().get_random_string(10)
 
         file_defs = [
-            # Upload the ZIP archive of photos
-            [os.path.join(self.local_upload_file_dir, '*.zip'), '',
-             os.path.join(self.remote_file_dir, remote_upload_dir), 1, True],
             # Upload just the first of the photo files
             [os.path.join(self.local_file_dir, '*' + self.image_extension), 'photobooth_photo',
              os.path.join(self.remote_file_dir, remote_upload_dir), 1, True],
@@ -388,7 +586,12 @@ class TwitterPhoto(PhotoBoothFunction):
              os.path.join(self.remote_file_dir, 'common'), 0, True],
         ]
 
-        success = self.upload_photos_using_defs(file_defs)
+        zip_defs = [
+            # Zip up the photos, straight into the upload
+            [self.image_extension, self.zip_filename, os.path.join(self.remote_file_dir, remote_upload_dir)],
+        ]
+
+        success = self.upload_photos_using_defs(file_defs, zip_defs)
 
         if success:
             return remote_upload_dir
@@ -400,20 +603,19 @@ class TwitterPhoto(PhotoBoothFunction):
         # Start with the first image (if there are any)
         self.chosen_accompaniment = 2
 
-        # Use the JPG versions of accompaniment files, which have black background
-        file_pattern = self.filehandler.get_full_path(self.accompaniment_dir, "*.jpg")
-        files = self.filehandler.get_sorted_file_list(file_pattern)
+        files = self.get_accompaniment_overlay_files()
 
         # If there are no images, then chosen_accompaniment will be the blank screen
         if len(files) < 1:
             return 1
 
-        button_overlay = OverlayOnCamera(self.camera)
+        button_overlay = OverlayOnCamera(self.camera, self.overlaybank)
         button_overlay.camera_overlay(config.badge_picker_menu_image)
 
-        self.overlay_on_camera = OverlayOnCamera(self.camera)
+        self.overlay_on_camera = OverlayOnCamera(self.camera, self.overlaybank)
         self.change_accompaniment(files)
 
+        get_latency_monitor().set_screen('badge_picker')
         while True:
             choice = self.buttonhandler.wait_for_buttons('lsr', False)
 
@@ -433,6 +635,7 @@ class TwitterPhoto(PhotoBoothFunction):
                 self.buttonhandler.light_button_leds('lsr', False)
                 break
 
+        get_latency_monitor().set_screen(None)
         button_overlay.remove_camera_overlay()
 
     def change_accompaniment(self, files):
@@ -449,6 +652,9 @@ class TwitterPhoto(PhotoBoothFunction):
         curr_accompaniment_file = files[accompanying_file_num]
         self.overlay_on_camera.camera_overlay(curr_accompaniment_file)
 
+        # Make sure whichever badge the guest picks next is ready
+        self.overlaybank.preload_neighbours(files, accompanying_file_num)
+
         # See if an opacity value in the filename [within square brackets]
         # filename = os.path.basename(curr_accompaniment_file)
         # opacity = filename[filename.find("[") + 1:filename.find("]")]
@@ -462,33 +668,154 @@ class TwitterPhoto(PhotoBoothFunction):
         #         opacity = 100
         #     self.camera.saturation = opacity
 
+    # Queue the photos to be tweeted in the background, so the guest doesn't wait for the Wi-Fi
     def tweet_photo(self):
+        # The photos that were already copied into the outbox, while the guest was deciding
+        staged_tweets = {}
+        if self.speculation is not None:
+            staged_tweets = self.speculation.get_staged_tweets()
 
         try:
-            self.filehandler.tweet_file()
+            for curr_img in self.get_tweet_files():
+                self.tweetoutbox.enqueue(curr_img, config.tweet_message, staged_tweets.get(curr_img))
+                self.filehandler.archive_file(curr_img)
 
-        except TwythonError as e:
+        except (EnvironmentError, subprocess.CalledProcessError) as e:
+            print "Error queueing tweet: ", e
             return False
 
         return True
 
-    # *** Display the instruction screen for the current photobooth function ***
-    def display_instructions(self):
-        instructions_msg = []
-        for curr_line in self.instructions:
-            instructions_msg.append([curr_line, 84, config.off_black_colour, "c", 0])
+    # *** The instruction screen for the current photobooth function ***
+    def get_instructions_scene(self):
+        return Scene('instructions', self.draw_instructions, files=[config.instructions_menu_image])
 
-        self.imageprinter.print_images([[config.instructions_menu_image, 'cb', 0, 0]], False)
+    # Compose the instruction screen onto 'surface'
+    def draw_instructions(self, surface):
+        ImagePrinter(surface).print_images([[config.instructions_menu_image, 'cb', 0, 0]], False)
 
-        # Wait for the user to press the Select button to exit to menu
-        choice = ""
-        while True:
-            choice = self.buttonhandler.wait_for_buttons('ls', True)
 
-            if (choice != 'screensaver'):
+#############################################
+### Photo Booth function AnimatedPhoto ###
+class AnimatedPhoto(TwitterPhoto):
+    'Class to take a short burst of photos (with a companion), and tweet them as an animated GIF'
+
+    image_extension = PhotoBoothFunction.animated_image_extension
+    use_video_port = True
+
+    # A boomerang plays the burst forwards, then backwards
+    def __init__(self, photobooth, boomerang=False):
+        super(AnimatedPhoto, self).__init__(photobooth)
+
+        self.boomerang = boomerang
+        if boomerang:
+            self.menu_text = "Post Boomerang to Twitter"
+        else:
+            self.menu_text = "Post Animation to Twitter"
+        self.capture_delay = config.animated_frame_delay_secs
+
+        self.gif_writer = None
+        self.frame_queue = None
+        self.encode_thread = None
+        self.encode_error = None
+        self.first_frame = None
+
+    def start(self, total_pics=config.animated_frames):
+        super(AnimatedPhoto, self).start(total_pics)
+
+    def start_capture(self):
+        filepath = os.path.join(self.filehandler.get_local_file_dir(), self.photo_file_prefix + self.image_extension)
+        print('Saving to ' + filepath)
+
+        self.gif_writer = GifWriter(filepath, self.total_pics, config.animated_gif_max_bytes,
+                                    config.animated_gif_frame_ms, self.boomerang)
+        self.encode_error = None
+        self.first_frame = None
+
+        # Only a couple of frames are ever waiting to be encoded, so memory use stays flat
+        self.frame_queue = queue.Queue(maxsize=2)
+        self.encode_thread = threading.Thread(target=self.encode_frames)
+        self.encode_thread.daemon = True
+        self.encode_thread.start()
+
+    def capture_photo(self, img, photo_num):
+        self.frame_queue.put((img, photo_num))
+
+    def wait_between_photos(self, capture_delay):
+        # No LED flash between frames - it would show up in the animation
+        time.sleep(capture_delay)
+
+    def finish_capture(self):
+        if self.encode_thread is None:
+            return
+
+        self.show_processing_progress(0, 1)
+
+        self.frame_queue.put(None)
+        self.encode_thread.join()
+        self.encode_thread = None
+
+        self.gif_writer.close()
+        print "GIF frames written: " + str(self.gif_writer.get_num_written())
+
+        if self.encode_error is not None:
+            raise self.encode_error
+
+        # Show the guest the first frame, to accept or reject the animation by
+        if self.first_frame is not None:
+            self.captured_photos = [self.first_frame]
+
+    # Runs in its own thread: add each captured frame to the GIF as it arrives
+    def encode_frames(self):
+        while True:
+            frame = self.frame_queue.get()
+            if frame is None:
                 break
 
-        return choice
+            # After an error, keep taking frames so that capturing isn't held up
+            if self.encode_error is not None:
+                continue
+
+            img, photo_num = frame
+            try:
+                if self.accompaniment_img is not None:
+                    img = composite_overlay(img, self.accompaniment_img)
+                if photo_num == 0:
+                    self.first_frame = img
+
+                self.gif_writer.add_frame(img)
+            except Exception as e:
+                print "Error encoding GIF frame: ", e
+                self.encode_error = e
+
+
+# finish_photo()
+# Runs in an ImageWorkers process: superimpose shared_overlay (if any) onto the just-captured photo,
+#    and encode it to disk - the only JPEG encode it gets. If score is True, also score the photo
+#    against the rest of its burst. Returns the shared, finished photo and its ShotScore (or None)
+# (Not cached: a freshly captured photo is never finished twice)
+def finish_photo(shared_photo, shared_overlay, filepath, quality, score=False):
+    img = shared_photo.get_image()
+
+    if shared_overlay is not None:
+        img = composite_overlay(img, shared_overlay.get_image())
+
+    img.save(filepath, quality=quality)
+
+    shot_score = None
+    if score:
+        shot_score = score_shot(img, filepath)
+
+    shared_photo.put_image(img)
+    return shared_photo, shot_score
+
+
+def composite_overlay(img, overlay_img):
+    # Superimpose the accompanying image onto the captured image
+    # http://effbot.org/imagingbook/image.htm
+    #     overlay_img is RGBA, so use it both for image and mask
+    img.paste(overlay_img, None, overlay_img)
+    return img
 
 
 class StringOperations(object):
@@ -1,15 +1,24 @@
 # This module contains the over arching Photo Booth class, and the Main Menu class
 
 import os
+import signal
 import subprocess
-import RPi.GPIO as GPIO
 import pygame
 import time
 import threading
 
 from FileHandler import FileHandler
+from HardwareBackend import get_backend
 from ButtonHandler import ButtonHandler
-from PrintOnScreen import TextPrinter, ImagePrinter, CursorPrinter, screen_colour_fill
+from LedAnimator import LedAnimator
+from LatencyMonitor import get_latency_monitor
+from SceneCache import SceneCache
+from CameraService import CameraService
+from ImageWorkers import ImageWorkers
+from TweetOutbox import TweetOutbox
+from PrintOnScreen import TextPrinter, ImagePrinter, CursorPrinter, screen_colour_fill, update_display
+from PrintOnScreen import set_asset_bundle
+from AssetBundle import open_asset_bundle, get_ui_image_files
 
 import config
 
@@ -19,8 +28,17 @@ class PhotoBooth(object):
 
     # Set up a variable to hold our pygame 'screen'
     screen = None
+    hardware = None
+    gpio = None
     filehandler = None
     buttonhandler = None
+    ledanimator = None
+    latencymonitor = None
+    scenecache = None
+    assetbundle = None
+    cameraservice = None
+    imageworkers = None
+    tweetoutbox = None
     size = None
     local_dirs_ready = True
 
@@ -31,17 +49,44 @@ class PhotoBooth(object):
     booth_id = ""
 
     def __init__(self):
+        self.hardware = get_backend()
+        self.gpio = self.hardware.gpio
+
+        # Fork the image processing workers first, while this process is still small and single threaded
+        self.imageworkers = ImageWorkers()
+
         self.set_up_gpio()
         self.init_pygame()
+        self.scenecache = SceneCache(self.screen)
+        self.load_assets()
+
+        # Start the camera now, so it has settled by the time the first guest arrives
+        self.cameraservice = CameraService(self.hardware)
+        self.cameraservice.warm_up()
+
         self.buttonhandler = ButtonHandler()
+        self.buttonhandler.start_event_detection()
+        self.ledanimator = LedAnimator(self.buttonhandler)
+
+        # Dump the button-to-photon latency statistics whenever we are sent SIGUSR1
+        self.latencymonitor = get_latency_monitor()
+        signal.signal(signal.SIGUSR1, self.dump_latency_statistics)
+
+        # When simulating the hardware, start pressing the scripted buttons
+        self.hardware.play_button_script()
 
         try:
             self.filehandler = FileHandler()
         except subprocess.CalledProcessError as e:
             self.local_dirs_ready = False
 
+        # Start tweeting any photos that were still queued when the booth was last switched off
+        if self.local_dirs_ready:
+            self.tweetoutbox = TweetOutbox(self.filehandler.get_outbox_dir())
+            self.tweetoutbox.start()
+
         # Stop the monitor blanking after inactivity
-        os.system("setterm -blank 0 -powerdown 0")
+        self.hardware.set_screen_blanking(False)
 
     def __del__(self):
         print "Destructing PhotoBooth instance"
@@ -49,49 +94,99 @@ class PhotoBooth(object):
     def tidy_up(self):
         # NOTE: This was the __del__ method, but seems more reliable to call explicitly
         print "Tidying up PhotoBooth instance"
-        ButtonHandler().light_button_leds('slr', False)  # Turn off all LEDs
+        self.dump_latency_statistics()
+        self.cameraservice.shutdown()
+        self.imageworkers.close()
+        if self.tweetoutbox is not None:
+            self.tweetoutbox.stop()
+        self.buttonhandler.stop_event_detection()
+        self.ledanimator.stop()
+        self.buttonhandler.light_button_leds('slr', False)  # Turn off all LEDs
         pygame.quit()  # End our pygame session
-        GPIO.cleanup()  # Make sure we properly reset the GPIO ports we've used before exiting
 
-        # Restore monitor blanking (TODO can we store previous values?)
-        os.system("setterm -blank 30 -powerdown 30")
+        if self.assetbundle is not None:
+            set_asset_bundle(None)
+            self.assetbundle.close()
+        self.gpio.cleanup()  # Make sure we properly reset the GPIO ports we've used before exiting
+
+        # Restore monitor blanking
+        self.hardware.set_screen_blanking(True)
+
+    def dump_latency_statistics(self, signum=None, frame=None):
+        self.latencymonitor.dump(config.latency_report_file)
 
     def set_up_gpio(self):
-        GPIO.setmode(GPIO.BCM)
+        self.gpio.setmode(self.gpio.BCM)
         # GPIO.setup(camera_led_pin, GPIO.OUT, initial=False) # Set GPIO to output
-        GPIO.setup(config.led_pin_select, GPIO.OUT)  # The 'Select' button LED
-        GPIO.setup(config.led_pin_left, GPIO.OUT)  # The 'Left' button LED
-        GPIO.setup(config.led_pin_right, GPIO.OUT)  # The 'Right' button LED
+        self.gpio.setup(config.led_pin_select, self.gpio.OUT)  # The 'Select' button LED
+        self.gpio.setup(config.led_pin_left, self.gpio.OUT)  # The 'Left' button LED
+        self.gpio.setup(config.led_pin_right, self.gpio.OUT)  # The 'Right' button LED
 
         # Detect falling edge on all buttons
-        GPIO.setup(config.button_pin_select, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(config.button_pin_left, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(config.button_pin_right, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(config.button_pin_exit, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self.gpio.setup(config.button_pin_select, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.setup(config.button_pin_left, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.setup(config.button_pin_right, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.setup(config.button_pin_exit, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
 
         # Drumminhands found it necessary to switch off LEDs initially
-        GPIO.output(config.led_pin_select, False)
-        GPIO.output(config.led_pin_left, False)
-        GPIO.output(config.led_pin_right, False)
+        self.gpio.output(config.led_pin_select, False)
+        self.gpio.output(config.led_pin_left, False)
+        self.gpio.output(config.led_pin_right, False)
 
     def init_pygame(self):
+        self.hardware.init_display()
         pygame.init()
-        self.size = (pygame.display.Info().current_w, pygame.display.Info().current_h)
+        self.size = self.hardware.get_display_size(pygame.display.Info())
         print "Initialised PyGame: Screen Width " + str(self.size[0]) + " x Height " + str(self.size[1])
 
         pygame.display.set_caption('Photo Booth')
         pygame.mouse.set_visible(False)  # Hide the mouse cursor
         self.screen = pygame.display.set_mode(self.size, pygame.FULLSCREEN)
 
+    # Map the pre-decoded image bundle (if it has been built), and have all the UI images loaded
+    #    into the image cache while the booth first waits for a guest, so they don't wait for the SD card
+    def load_assets(self):
+        self.assetbundle = open_asset_bundle()
+        set_asset_bundle(self.assetbundle)
+
+        if self.assetbundle is not None:
+            image_files = self.assetbundle.get_image_files()
+        else:
+            print "No asset bundle found: run 'python AssetBundle.py' to build one"
+            image_files = get_ui_image_files()
+
+        self.scenecache.set_images_to_preload(image_files)
+
+    def get_camera_service(self):
+        return self.cameraservice
+
+    def get_tweet_outbox(self):
+        return self.tweetoutbox
+
+    def get_image_workers(self):
+        return self.imageworkers
+
+    def get_asset_bundle(self):
+        return self.assetbundle
+
     def get_booth_id(self):
         return self.booth_id
 
+    def get_hardware(self):
+        return self.hardware
+
     def get_pygame_screen(self):
         return self.screen
 
+    def get_scene_cache(self):
+        return self.scenecache
+
     def get_button_handler(self):
         return self.buttonhandler
 
+    def get_led_animator(self):
+        return self.ledanimator
+
     def get_file_handler(self):
         return self.filehandler
 
@@ -109,29 +204,20 @@ class PhotoBooth(object):
         screen_colour_fill(self.screen, config.black_colour)
         # os.system("sudo ./support/rpi-hdmi.sh off")
 
-        # Start a separate thread to flash the Select LED
-        flash_led_stop = threading.Event()
-        flash_led = threading.Thread(target=self.buttonhandler.flash_button_leds,
-                                     args=('s', 1, flash_led_stop))
-        flash_led.start()
+        # Flash the Select LED
+        self.ledanimator.start('screen_saver', 's', 'blink', interval_secs=1)
 
         # Wait until the Select button is pressed
-        while not self.buttonhandler.button_is_down(config.button_pin_select):
-            time.sleep(0.2)
+        self.buttonhandler.clear_events()
+        while self.buttonhandler.next_event('s') != 's':
+            pass
 
         # Come out of screen saver
-        # Turn on the button LEDs
+        # Stop flashing the Select LED, and turn on all the button LEDs
+        self.ledanimator.cancel('screen_saver')
         self.buttonhandler.light_button_leds('lsr', True)
 
         # Show the copy of the display that we made before going into screensaver
         self.screen.blit(screen_copy, (0, 0))
-        pygame.display.flip()
+        update_display()
         # os.system("sudo ./support/rpi-hdmi.sh on")
-
-        # Stop the thread which has been flashing the Select LED
-        flash_led_stop.set()
-        flash_led.join()
-
-        # In case the thread was still running and turned off the Select LED,
-        #    make sure all the buttons are lit
-        self.buttonhandler.light_button_leds('lsr', True)
@@ -3,14 +3,19 @@
 
 import os
 import pygame
-from PIL import Image, ImageDraw, ImageChops
+from PIL import Image, ImageDraw
 import math
-import threading
 
-from PrintOnScreen import ImagePrinter
+from PrintOnScreen import ImagePrinter, SurfaceCache, convert_surface, update_display
+from BestShot import rms_difference
+from ContactSheet import ContactSheet
+from FileHandler import get_file_hash
 
 import config
 
+# Photos decoded for the review screen, by (file, modification time, display size)
+_review_surfaces = SurfaceCache(config.review_cache_max_bytes)
+
 
 class PhotoHandler(object):
     'Base class for image transformation code'
@@ -18,11 +23,16 @@ class PhotoHandler(object):
     screen = None
     filehandler = None
     imageprinter = None
+    imageworkers = None
+    contactsheet = None
 
-    def __init__(self, screen, filehandler):
+    # If imageworkers is None, images are processed in this process
+    def __init__(self, screen, filehandler, imageworkers=None):
         self.screen = screen
         self.filehandler = filehandler
         self.imageprinter = ImagePrinter(self.screen)
+        self.imageworkers = imageworkers
+        self.contactsheet = ContactSheet(imageworkers)
 
     # Given a width, find the corresponding height that would fit the screen's aspect ratio
     def get_aspect_ratio_height(self, pixel_width):
@@ -30,35 +40,11 @@ class PhotoHandler(object):
 
     # Resize an image keeping the same aspect ratio
     def resize_image(self, img_filename, new_width, new_height):
-        img = Image.open(img_filename)
-        img_width, img_height = img.size
-
-        # First, resize the image
-        if new_width > new_height:
-            # Required image is Landscape
-            scale_factor = float(new_width) / float(img_width)
-            temp_width = new_width
-            temp_height = int(float(img_height) * float(scale_factor))
-        else:
-            # Required image is Portrait (or Square)
-            scale_factor = float(new_height) / float(img_height)
-            temp_width = int(float(img_width) * float(scale_factor))
-            temp_height = new_height
-
-        img = img.resize((temp_width, temp_height), Image.ANTIALIAS)
-
-        return img
-
-    # Thanks Charlie Clark: http://code.activestate.com/recipes/577630-comparing-two-images/
+        return resize_image(img_filename, new_width, new_height)
+
+    # The root-mean-square difference between two images
     def rms_difference(self, im1, im2):
-        "Calculate the root-mean-square difference between two images"
-        diff = ImageChops.difference(im1, im2)
-        h = diff.histogram()
-        # sq = (value*(idx**2) for idx, value in enumerate(h))
-        sq = (value * ((idx % 256) ** 2) for idx, value in enumerate(h))
-        sum_of_squares = sum(sq)
-        rms = math.sqrt(sum_of_squares / float(im1.size[0] * im1.size[1]))
-        return rms
+        return rms_difference(im1, im2)
 
     # Convert all captured images into the formats defined in image_defs
     def prepare_images(self, image_extension, image_defs, copy_origs):
@@ -71,61 +57,26 @@ class PhotoHandler(object):
         file_pattern = os.path.join(image_dir, "photobooth*" + image_extension)
         files = self.filehandler.get_sorted_file_list(file_pattern)
 
-        # Process the images in separate threads - in an attempt to speed the process up ...
-        # (TODO: Threading doesn't seem to process the images any quicker)
-        processing_thread_list = []
-
-        # self.imageprinter.print_images([[files[0], "ct", 10, 50]], False)
+        # Process the images in the worker processes, so they really are processed in parallel
+        if self.imageworkers is None:
+            for curr_img in files:
+                self.prepare_one_image(curr_img, image_defs, copy_origs)
+            return
 
+        upload_dir = self.filehandler.get_upload_file_dir()
+        derivative_cache = self.filehandler.get_derivative_cache()
+        prepare_futures = []
         for curr_img in files:
-            processing_thread_list.append(threading.Thread(target=self.prepare_one_image,
-                                                           args=(curr_img, image_defs, copy_origs)))
-            processing_thread_list[len(processing_thread_list) - 1].start()
+            prepare_futures.append(self.imageworkers.submit(prepare_one_image_file, curr_img, image_defs,
+                                                            copy_origs, upload_dir, self.filehandler,
+                                                            derivative_cache))
 
-        # Wait for all processing threads to finish
-        for curr_thread in processing_thread_list:
-            curr_thread.join()
+        # Wait for all of the images to be processed
+        self.imageworkers.wait(prepare_futures)
 
     def prepare_one_image(self, image_file, image_defs, copy_origs):
-        upload_dir = self.filehandler.get_upload_file_dir()
-
-        if copy_origs:
-            filename = os.path.basename(image_file)
-            name, extension = os.path.splitext(filename)
-            new_filepath = os.path.join(upload_dir, 'original-' + name + extension)
-
-            self.filehandler.copy_file(image_file, new_filepath)
-            # Do a straight copy of the image_file file
-            # Tip from http://learnpythonthehardway.org/book/ex17.html
-            # in_file  = open(image_file)
-            # img_data = in_file.read()
-
-            # out_file = open(new_filepath, 'w')
-            # out_file.write(img_data)
-
-            # out_file.close()
-            # in_file.close()
-
-        for curr_img_def in image_defs:
-            # Unpack the curr_img_def array into variables
-            def_prefix, def_width, def_height, def_dpi = curr_img_def
-
-            filename = os.path.basename(image_file)
-            name, extension = os.path.splitext(filename)
-            new_filepath = os.path.join(upload_dir, def_prefix + '-' + name + extension)
-
-            img = self.resize_image(image_file, def_width, def_height)
-            img_width, img_height = img.size
-
-            # Second, if the current image def is a different aspect ratio, crop the image
-            image_x = (img_width - def_width) // 2
-            image_y = (img_height - def_height) // 2
-
-            img = img.crop((image_x, image_y, image_x + def_width, image_y + def_height))
-            img_width, img_height = img.size
-
-            # Finally save the current image, at the requested DPI
-            img.save(new_filepath, dpi=(def_dpi, def_dpi))
+        prepare_one_image_file(image_file, image_defs, copy_origs, self.filehandler.get_upload_file_dir(),
+                               self.filehandler, self.filehandler.get_derivative_cache())
 
     # *** Display the captured images on the PyGame screen ***
     def show_photos_tiled(self, image_extension):
@@ -135,49 +86,15 @@ class PhotoHandler(object):
         file_pattern = os.path.join(image_dir, "*" + image_extension)
         files = self.filehandler.get_sorted_file_list(file_pattern)
 
-        num_images = len(files)
-        if num_images < 1:
-            return
-
-        # Find the aspect ratio of the images, for later use
-        img = Image.open(files[0])
-        image_width, image_height = img.size
-
-        num_row_1 = num_images // 2  # Note: given an odd number of images, fewer will appear on top row
-        num_row_2 = num_images - num_row_1
-
-        screen_width = pygame.display.Info().current_w
-        screen_height = pygame.display.Info().current_h
-
-        # display_* is the size that we want to display the image at
-        display_height = screen_height // 2
-        display_width = int(float(display_height) / float(image_height) * float(image_width))
-
-        row_1_x = (screen_width - (num_row_1 * display_width)) // 2
-        row_2_x = (screen_width - (num_row_2 * display_width)) // 2
-
-        image_num = 0
-        for f in files:
-            image_num = image_num + 1
-
-            if image_num <= num_row_1:
-                image_x = row_1_x + display_width * (image_num - 1)
-                image_y = 0
-            else:
-                image_x = row_2_x + display_width * (image_num - num_row_1 - 1)
-                image_y = display_height
-
-            try:
-                img = pygame.image.load(f)
-                img = pygame.transform.scale(img, (display_width, display_height))
-                self.screen.blit(img, (image_x, image_y))
-            except pygame.error, message:
-                print "ERROR: Image " + os.path.basename(f) + " failed to load: " + message
-
-        pygame.display.flip()
+        self.contactsheet.show(self.screen, files)
 
     # *** Display the captured images on the PyGame screen ***
-    def show_single_photo(self, image_extension):
+    # If the photos are still in memory (as PIL Images), pass them in 'photos' to show them without
+    #    reading them back from disk
+    def show_single_photo(self, image_extension, photos=None):
+        if photos:
+            self.show_single_photo_from_memory(photos)
+            return
 
         # Get directories
         image_dir = self.filehandler.get_local_file_dir()
@@ -193,16 +110,6 @@ class PhotoHandler(object):
             self.show_photos_tiled(image_extension)
             return
 
-        # Find the aspect ratio of the images, for later use
-        img = Image.open(files[0])
-        image_width, image_height = img.size
-
-        num_row_1 = num_images // 2  # Note: given an odd number of images, fewer will appear on top row
-        num_row_2 = num_images - num_row_1
-
-        screen_width = pygame.display.Info().current_w
-        screen_height = pygame.display.Info().current_h
-
         # display_* is the size that we want to display the image at
         display_height = 440
         display_width = 880
@@ -210,6 +117,7 @@ class PhotoHandler(object):
         image_x = 72
         image_y = 113
 
+        image_rect_list = []
 
         # image_num = 0
         for f in files:
@@ -223,11 +131,224 @@ class PhotoHandler(object):
             #     image_y = display_height
 
             try:
-                img = pygame.image.load(f)
-                img = pygame.transform.scale(img, (display_width, display_height))
-                self.screen.blit(img, (image_x, image_y))
-            except pygame.error, message:
-                print "ERROR: Image " + os.path.basename(f) + " failed to load: " + message
+                img = load_display_surface(f, (display_width, display_height))
+                image_rect_list.append(self.screen.blit(img, (image_x, image_y)))
+            except (pygame.error, IOError) as e:
+                print "ERROR: Image " + os.path.basename(f) + " failed to load: ", e
+
+        update_display(image_rect_list)
+
+    def show_single_photo_from_memory(self, photos):
+        print "Number of images: %r" % len(photos)
+
+        # display_* is the size that we want to display the image at
+        display_height = 440
+        display_width = 880
+
+        image_x = 72
+        image_y = 113
+
+        image_rect_list = []
+
+        for photo in photos:
+            # Shrink the photo before handing it to pygame, so only display-sized pixels are copied
+            photo = fit_for_display(photo, (display_width, display_height))
+
+            img = convert_surface(pygame.image.fromstring(photo.tobytes(), photo.size, 'RGB'))
+            image_rect_list.append(self.screen.blit(img, (image_x, image_y)))
+
+        update_display(image_rect_list)
+
+
+# load_display_surface()
+# Return a Surface with the photo in image_file, at display_size and in the display's pixel format.
+# A JPEG is decoded straight to (nearly) display_size, by scaling it as it is decoded, so showing a photo
+#    takes about as long whatever resolution it was taken at.
+# Surfaces are cached, so must not be drawn on
+def load_display_surface(image_file, display_size):
+    display_size = tuple(display_size)
+    key = (image_file, os.path.getmtime(image_file), display_size)
+
+    img = _review_surfaces.get(key)
+    if img is None:
+        photo = decode_for_display(image_file, display_size)
+
+        img = convert_surface(pygame.image.fromstring(photo.tobytes(), photo.size, 'RGB'))
+        _review_surfaces.put(key, img)
+
+    return img
+
+
+# Return the photo in image_file as an RGB PIL Image, at display_size
+def decode_for_display(image_file, display_size):
+    photo = Image.open(image_file)
+    # Ask the JPEG decoder for the smallest scale (1/2, 1/4 or 1/8) that is still at least display_size
+    photo.draft('RGB', tuple(display_size))
+
+    return fit_for_display(photo, tuple(display_size))
+
+
+# Return the PIL Image 'photo', as RGB at display_size
+def fit_for_display(photo, display_size):
+    if photo.mode != 'RGB':
+        photo = photo.convert('RGB')
+
+    # Shrink by a whole factor first (quick, and it averages the pixels), then resample the rest of the way
+    reduce_factor = min(photo.size[0] // display_size[0], photo.size[1] // display_size[1])
+    if reduce_factor >= 2 and hasattr(photo, 'reduce'):
+        photo = photo.reduce(reduce_factor)
+
+    if photo.size != display_size:
+        photo = photo.resize(display_size, Image.BILINEAR)
+
+    return photo
+
+
+# Resize an image keeping the same aspect ratio
+def resize_image(img_filename, new_width, new_height):
+    img = Image.open(img_filename)
+    img_width, img_height = img.size
+
+    # First, resize the image
+    if new_width > new_height:
+        # Required image is Landscape
+        scale_factor = float(new_width) / float(img_width)
+        temp_width = new_width
+        temp_height = int(float(img_height) * float(scale_factor))
+    else:
+        # Required image is Portrait (or Square)
+        scale_factor = float(new_height) / float(img_height)
+        temp_width = int(float(img_width) * float(scale_factor))
+        temp_height = new_height
+
+    img = img.resize((temp_width, temp_height), Image.ANTIALIAS)
+
+    return img
+
+
+# prepare_one_image_file()
+# Convert image_file into each of the formats in image_defs, writing them into upload_dir
+# Runs in an ImageWorkers process (so is a plain function, rather than a PhotoHandler method)
+# The photo is decoded once, for all of the formats: each is resized (and cropped, in the same step)
+#    from the smallest level of a ReductionPyramid that is still larger than it.
+# Formats already in derivative_cache (if given) are copied from there, without decoding the photo at all
+def prepare_one_image_file(image_file, image_defs, copy_origs, upload_dir, filehandler, derivative_cache=None):
+    filename = os.path.basename(image_file)
+    name, extension = os.path.splitext(filename)
+
+    if copy_origs:
+        new_filepath = os.path.join(upload_dir, 'original-' + name + extension)
+        filehandler.copy_file(image_file, new_filepath)
+
+    # The formats that have to be made, with their paths and cache keys
+    derivative_defs = []
+    source_hash = None
+    if derivative_cache is not None and len(image_defs) > 0:
+        source_hash = get_file_hash(image_file)
+
+    for curr_img_def in image_defs:
+        # Unpack the curr_img_def array into variables
+        def_prefix, def_width, def_height, def_dpi = curr_img_def
+
+        new_filepath = os.path.join(upload_dir, def_prefix + '-' + name + extension)
+
+        derivative_key = None
+        if source_hash is not None:
+            derivative_key = derivative_cache.get_key(source_hash, 'derivative',
+                                                      [def_width, def_height, def_dpi, extension])
+            if derivative_cache.fetch(derivative_key, extension, new_filepath):
+                continue
+
+        derivative_defs.append((def_width, def_height, def_dpi, new_filepath, derivative_key))
+
+    if len(derivative_defs) < 1:
+        return
+
+    img = Image.open(image_file)
+
+    # A JPEG can be decoded straight to a smaller size, if even the largest format doesn't need all of it
+    max_scale = max(get_derivative_scale(img.size, def_width, def_height)
+                    for def_width, def_height, def_dpi, new_filepath, derivative_key in derivative_defs)
+    if max_scale < 1.0:
+        img.draft(img.mode, (int(math.ceil(img.size[0] * max_scale)), int(math.ceil(img.size[1] * max_scale))))
+    img.load()
+
+    pyramid = ReductionPyramid(img)
+
+    for def_width, def_height, def_dpi, new_filepath, derivative_key in derivative_defs:
+        scale = get_derivative_scale(img.size, def_width, def_height)
+        level_img, level_factor = pyramid.get_level(scale)
+
+        derivative_img = resize_and_crop(level_img, def_width, def_height, scale * level_factor)
+
+        # Save the current image, at the requested DPI
+        derivative_img.save(new_filepath, dpi=(def_dpi, def_dpi))
+
+        if derivative_key is not None:
+            derivative_cache.put_file(derivative_key, extension, new_filepath)
+
+
+# How much to scale an image of size img_size by, to fill new_width x new_height (as resize_image does)
+def get_derivative_scale(img_size, new_width, new_height):
+    img_width, img_height = img_size
+
+    if new_width > new_height:
+        # Required image is Landscape
+        return float(new_width) / float(img_width)
+    else:
+        # Required image is Portrait (or Square)
+        return float(new_height) / float(img_height)
+
+
+# resize_and_crop()
+# Scale img by 'scale' and crop the centre new_width x new_height out of it, in a single resample
+#    of just the part of img that is kept
+def resize_and_crop(img, new_width, new_height, scale):
+    img_width, img_height = img.size
+
+    # The part of img that ends up in the new image
+    crop_width = new_width / scale
+    crop_height = new_height / scale
+    box_x = (img_width - crop_width) / 2.0
+    box_y = (img_height - crop_height) / 2.0
+
+    if box_x > -0.5 and box_y > -0.5:
+        box = (max(box_x, 0), max(box_y, 0),
+               min(box_x + crop_width, img_width), min(box_y + crop_height, img_height))
+        return img.resize((new_width, new_height), Image.ANTIALIAS, box)
+
+    # The new image is a wider (or taller) shape than img, so it has borders: resize, then crop
+    temp_width = max(1, int(img_width * scale))
+    temp_height = max(1, int(img_height * scale))
+    img = img.resize((temp_width, temp_height), Image.ANTIALIAS)
+
+    image_x = (temp_width - new_width) // 2
+    image_y = (temp_height - new_height) // 2
+    return img.crop((image_x, image_y, image_x + new_width, image_y + new_height))
+
+
+class ReductionPyramid(object):
+    'An image, and copies of it at 1/2, 1/4, 1/8 ... of its size, each made from the one before when first needed'
+
+    def __init__(self, img):
+        self.levels = [img]
+
+    # get_level()
+    # Return the smallest level that is still at least 'scale' times the size of the original image,
+    #    and how many times smaller than the original it is
+    def get_level(self, scale):
+        level_num = 0
+        while scale * (2 ** (level_num + 1)) <= 1.0 and min(self.levels[level_num].size) >= 4:
+            level_num += 1
+
+            if level_num == len(self.levels):
+                self.levels.append(halve_image(self.levels[level_num - 1]))
+
+        return self.levels[level_num], 2 ** level_num
 
-        pygame.display.flip()
 
+# Halve the size of img, averaging each 2x2 block of pixels
+def halve_image(img):
+    if hasattr(img, 'reduce'):
+        return img.reduce(2)
+    return img.resize((img.size[0] // 2, img.size[1] // 2), Image.BOX)
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 # Classes used to display text and images on pygame screen
 
+import os
+import threading
+from collections import OrderedDict
+
 import pygame
 from PIL import Image, ImageDraw
 
 import config
+from LatencyMonitor import get_latency_monitor
 
 
 class PrintOnScreen(object):
@@ -16,8 +21,9 @@ class PrintOnScreen(object):
 
     def __init__(self, screen):
         self.screen = screen
-        self.screen_width = pygame.display.Info().current_w
-        self.screen_height = pygame.display.Info().current_h
+        # Use the size of the Surface we print on, which may be an off-screen copy of the display
+        self.screen_width = screen.get_width()
+        self.screen_height = screen.get_height()
         self.centerx = screen.get_rect().centerx
         self.centery = screen.get_rect().centery
 
@@ -32,6 +38,14 @@ class TextPrinter(PrintOnScreen):
     #    [["text", size, (colour), "alignment", position], ["text", size, (colour), "alignment", position]]
     # alignment can be combination of 'lcrtmb' (left, centre, right; top, middle, bottom)
     def print_text(self, text_defs, line_spacing, clear_screen):
+        # Put the screen clear and the text onto the display together
+        begin_frame()
+        try:
+            return self.draw_text(text_defs, line_spacing, clear_screen)
+        finally:
+            end_frame()
+
+    def draw_text(self, text_defs, line_spacing, clear_screen):
         # If called for, clear previous text from screen
         if clear_screen:
             screen_colour_fill(self.screen, config.white_colour)
@@ -43,8 +57,7 @@ class TextPrinter(PrintOnScreen):
         for curr_text_def in text_defs:
             print_text, font_size, font_colour, alignment, position = curr_text_def
 
-            font = pygame.font.Font(None, font_size)
-            screen_text.append([font.render(print_text, True, font_colour), alignment, position])
+            screen_text.append([render_text(print_text, font_size, font_colour), alignment, position])
 
         # Get the combined height of all the lines of text
         combined_height = 0
@@ -98,7 +111,7 @@ class TextPrinter(PrintOnScreen):
             self.screen.blit(text_surface, text_rect)
 
         # Blit everything to the screen
-        pygame.display.flip()
+        update_display(text_rect_list, self.screen)
 
         return text_rect_list
 
@@ -113,26 +126,28 @@ class ImagePrinter(PrintOnScreen):
     #     e.g. pin image to bottom left = 'lb'
     # height_scale a percentage of the display height that image should be scaled to (0 is ignored)
     def print_images(self, image_defs, clear_screen):
+        # Put the screen clear and the images onto the display together
+        begin_frame()
+        try:
+            self.draw_images(image_defs, clear_screen)
+        finally:
+            end_frame()
+
+    def draw_images(self, image_defs, clear_screen):
         # If called for, clear previous text from screen
         if clear_screen:
             screen_colour_fill(self.screen, config.white_colour)
 
+        image_rect_list = []
         for curr_image_def in image_defs:
             image_file, alignment, position, height_scale = curr_image_def
 
-            # Load the image
-            img = pygame.image.load(image_file)
-            img.convert_alpha()
-
-            orig_width, orig_height = img.get_size()
+            # Load the image (scaled, if asked for)
+            new_height = None
             if height_scale > 0:
-                # Work out the new size for the image
                 new_height = int(float(self.screen_height) / float(100) * float(height_scale))
-                scale_factor = float(new_height) / float(orig_height)
-                new_width = int(float(orig_width) * float(scale_factor))
 
-                # Resize the image
-                img = pygame.transform.scale(img, (new_width, new_height))
+            img = load_image(image_file, new_height)
 
             image_rect = img.get_rect()
             image_x, image_y, image_width, image_height = image_rect
@@ -160,8 +175,9 @@ class ImagePrinter(PrintOnScreen):
                 image_rect.move_ip(0, pos_shift - image_height)
 
             self.screen.blit(img, image_rect)
+            image_rect_list.append(image_rect)
 
-        pygame.display.flip()
+        update_display(image_rect_list, self.screen)
 
 
 class CursorPrinter(PrintOnScreen):
@@ -187,8 +203,7 @@ class CursorPrinter(PrintOnScreen):
 
         self.option_rect = option_rect_list[chosen_index]
 
-        self.font = pygame.font.Font(None, self.font_size)
-        self.cursor = self.font.render(self.cursor_char, True, self.font_colour)
+        self.cursor = render_text(self.cursor_char, self.font_size, self.font_colour)
 
         self.cursor_rect = self.cursor.get_rect()
 
@@ -213,7 +228,7 @@ class CursorPrinter(PrintOnScreen):
         self.screen.blit(self.cursor, self.cursor_rect)
 
         # Blit everything to the screen
-        pygame.display.flip()
+        update_display([self.cursor_mask, self.cursor_rect], self.screen)
 
 
 class OverlayOnCamera(object):
@@ -221,43 +236,330 @@ class OverlayOnCamera(object):
     camera = None
     overlay = None
     prev_overlay_size = None
+    bufferbank = None
 
-    def __init__(self, camera):
+    # If 'bufferbank' (an OverlayBufferBank) is given, overlay images are taken from it
+    #    rather than being loaded and padded each time they are shown
+    def __init__(self, camera, bufferbank=None):
         self.camera = camera
+        self.bufferbank = bufferbank
 
     def camera_overlay(self, image_file):
-        img = Image.open(image_file)
-
-        # Create an image padded to the required size with
-        # mode 'RGB'
-        pad = Image.new('RGB', (
-            ((img.size[0] + 31) // 32) * 32,
-            ((img.size[1] + 15) // 16) * 16,
-        ))
+        if self.bufferbank is not None:
+            overlay_buffer, overlay_size = self.bufferbank.get(image_file)
+        else:
+            overlay_buffer, overlay_size = make_overlay_buffer(Image.open(image_file))
 
-        # Paste the original image into the padded one
-        pad.paste(img, (0, 0))
+        self.show_overlay_buffer(overlay_buffer, overlay_size)
 
+    # Show a padded overlay buffer (see make_overlay_buffer()) of an image that is 'size' pixels
+    def show_overlay_buffer(self, overlay_buffer, size):
         # Add the overlay with the padded image as the source,
         # but the original image's dimensions
         if self.overlay:
             # If we previously added an overlay, was it the same padded size?
-            if (self.prev_overlay_size[0] == img.size[0] and self.prev_overlay_size[1] == img.size[1]):
+            if (self.prev_overlay_size[0] == size[0] and self.prev_overlay_size[1] == size[1]):
                 # If it was the same size, simply update the overlay
-                self.overlay.update(pad.tostring())
+                self.overlay.update(overlay_buffer)
             else:
                 # If it was a different size, we will have to remove the previous overlay first
-                camera.remove_overlay(self.overlay)
-                self.overlay = self.camera.add_overlay(pad.tostring(), layer=3, size=img.size, alpha=128)
+                self.camera.remove_overlay(self.overlay)
+                self.overlay = self.camera.add_overlay(overlay_buffer, layer=3, size=size, alpha=128)
         else:
-            self.overlay = self.camera.add_overlay(pad.tostring(), layer=3, size=img.size, alpha=128)
+            self.overlay = self.camera.add_overlay(overlay_buffer, layer=3, size=size, alpha=128)
+
+        self.prev_overlay_size = size
 
-        self.prev_overlay_size = img.size
+        get_latency_monitor().frame_presented()
 
     def remove_camera_overlay(self):
+        if self.overlay is None:
+            return
+
         self.camera.remove_overlay(self.overlay)
         self.overlay = None
 
+        get_latency_monitor().frame_presented()
+
+
+# Return the pixels of PIL image 'img' in the form PiCamera overlays need, and the image's size
+def make_overlay_buffer(img):
+    # Create an image padded to the required size with
+    # mode 'RGB'
+    pad = Image.new('RGB', (
+        ((img.size[0] + 31) // 32) * 32,
+        ((img.size[1] + 15) // 16) * 16,
+    ))
+
+    # Paste the original image into the padded one
+    pad.paste(img, (0, 0))
+
+    return pad.tobytes(), img.size
+
+
+class OverlayBufferBank(object):
+    'Camera overlay buffers, decoded and padded once, so that switching overlays allocates nothing'
+
+    def __init__(self, asset_bundle=None):
+        self.asset_bundle = asset_bundle
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    # Return [overlay buffer, image size] for image_file, building it if it isn't in the bank yet
+    def get(self, image_file):
+        with self.lock:
+            entry = self.buffers.get(image_file)
+
+        if entry is None:
+            entry = self.build(image_file)
+
+        return entry
+
+    def build(self, image_file):
+        img = None
+        if self.asset_bundle is not None:
+            img = self.asset_bundle.get_image(image_file)
+        if img is None:
+            img = Image.open(image_file)
+
+        entry = make_overlay_buffer(img)
+
+        with self.lock:
+            self.buffers[image_file] = entry
+
+        return entry
+
+    # Build any of image_files that aren't in the bank yet, in a background thread
+    def preload(self, image_files):
+        with self.lock:
+            missing_files = [image_file for image_file in image_files if image_file not in self.buffers]
+
+        if len(missing_files) < 1:
+            return
+
+        def build_missing():
+            for image_file in missing_files:
+                try:
+                    self.build(image_file)
+                except IOError as e:
+                    print "Error pre-loading overlay " + image_file + ": ", e
+
+        preload_thread = threading.Thread(target=build_missing)
+        preload_thread.daemon = True
+        preload_thread.start()
+
+    # Make sure the neighbours of image_files[curr_index] are ready before they are asked for
+    def preload_neighbours(self, image_files, curr_index):
+        num_files = len(image_files)
+        if num_files < 1:
+            return
+
+        self.preload([image_files[(curr_index - 1) % num_files], image_files[(curr_index + 1) % num_files]])
+
+    def clear(self):
+        with self.lock:
+            self.buffers = {}
+
+
+class SurfaceCache(object):
+    'Least-recently-used cache of pygame Surfaces, limited by the memory their pixels use'
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.curr_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            surface = self.entries.pop(key, None)
+            if surface is not None:
+                # Re-insert, to mark it as the most recently used
+                self.entries[key] = surface
+            return surface
+
+    def put(self, key, surface):
+        surface_bytes = surface.get_pitch() * surface.get_height()
+        if surface_bytes > self.max_bytes:
+            return
+
+        with self.lock:
+            prev_surface = self.entries.pop(key, None)
+            if prev_surface is not None:
+                self.curr_bytes -= prev_surface.get_pitch() * prev_surface.get_height()
+
+            # Evict the least recently used surfaces until the new one fits
+            while self.curr_bytes + surface_bytes > self.max_bytes:
+                old_key, old_surface = self.entries.popitem(last=False)
+                self.curr_bytes -= old_surface.get_pitch() * old_surface.get_height()
+
+            self.entries[key] = surface
+            self.curr_bytes += surface_bytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.curr_bytes = 0
+
+
+# Fonts, by size, rendered lines of text, by (text, size, colour, antialias),
+#    and loaded images are shared between all printers
+_fonts = {}
+_text_surfaces = SurfaceCache(config.text_cache_max_bytes)
+_image_surfaces = SurfaceCache(config.image_cache_max_bytes)
+_asset_bundle = None
+
+
+def get_font(font_size):
+    font = _fonts.get(font_size)
+    if font is None:
+        font = pygame.font.Font(None, font_size)
+        _fonts[font_size] = font
+    return font
+
+
+# Return a Surface with the image in 'image_file', converted to the display's pixel format
+#    and (if 'new_height' is given) scaled to that height, keeping its aspect ratio
+# Surfaces are cached by file, modification time and size, so each is only loaded from disk once
+#    (an image in the asset bundle is cached by its bundle entry instead, so it isn't looked for on disk at all)
+# Note: the Surface is shared with later callers, so must not be drawn on
+def load_image(image_file, new_height=None):
+    # Prefer the pre-decoded copy in the asset bundle, if there is one
+    bundle_entry = None
+    if _asset_bundle is not None:
+        bundle_entry = _asset_bundle.get_entry(image_file)
+
+    if bundle_entry is not None:
+        key = (image_file, 'bundle', bundle_entry['offset'], new_height)
+    else:
+        key = (image_file, os.path.getmtime(image_file), new_height)
+
+    img = _image_surfaces.get(key)
+    if img is None:
+        if bundle_entry is not None:
+            img = _asset_bundle.get_surface(image_file)
+        else:
+            img = pygame.image.load(image_file)
+
+        if new_height is not None:
+            # Work out the new size for the image
+            orig_width, orig_height = img.get_size()
+            scale_factor = float(new_height) / float(orig_height)
+            new_width = int(float(orig_width) * float(scale_factor))
+
+            # Resize the image
+            img = pygame.transform.scale(img, (new_width, new_height))
+
+        img = convert_surface(img)
+        _image_surfaces.put(key, img)
+
+    return img
+
+
+# Use the images in 'asset_bundle' (an AssetBundle, or None) in preference to the original files
+def set_asset_bundle(asset_bundle):
+    global _asset_bundle
+    _asset_bundle = asset_bundle
+
+
+# Load each of image_files into the image cache, so that the first time they are printed is quick
+# Run in the background by SceneCache.preload_images()
+def warm_image_cache(image_files):
+    for image_file in image_files:
+        try:
+            load_image(image_file)
+        except (pygame.error, OSError) as e:
+            print "Error pre-loading image " + image_file + ": ", e
+
+
+# Convert a Surface to the display's pixel format, so that blitting it is quick
+def convert_surface(surface):
+    if pygame.display.get_surface() is None:
+        # The display mode hasn't been set yet, so there's no format to convert to
+        return surface
+
+    if surface.get_flags() & pygame.SRCALPHA:
+        return surface.convert_alpha()
+    else:
+        return surface.convert()
+
+
+# Return a Surface with 'text' rendered on it
+# Note: the Surface is shared with later callers, so must not be drawn on
+def render_text(text, font_size, font_colour, antialias=True):
+    key = (text, font_size, tuple(font_colour), antialias)
+
+    text_surface = _text_surfaces.get(key)
+    if text_surface is None:
+        text_surface = get_font(font_size).render(text, antialias, font_colour)
+        _text_surfaces.put(key, text_surface)
+
+    return text_surface
+
+
+class DisplayUpdater(object):
+    'Collects the areas of the screen that have been drawn on, and pushes them to the display in one go'
+
+    def __init__(self):
+        self.frame_depth = 0
+        self.dirty_rects = []
+        self.whole_screen_dirty = False
+
+    def begin_frame(self):
+        self.frame_depth += 1
+
+    def end_frame(self):
+        self.frame_depth -= 1
+        if self.frame_depth == 0:
+            self.present()
+
+    # Record that 'rects' (a list of Rects, or None for the whole screen) have been drawn on,
+    #    and push them to the display unless we are part way through a frame
+    def update(self, rects=None):
+        if rects is None:
+            self.whole_screen_dirty = True
+        else:
+            self.dirty_rects.extend(rects)
+
+        if self.frame_depth == 0:
+            self.present()
+
+    def present(self):
+        if not self.whole_screen_dirty and len(self.dirty_rects) < 1:
+            return
+
+        if self.whole_screen_dirty or not config.dirty_rect_rendering:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.dirty_rects)
+
+        self.dirty_rects = []
+        self.whole_screen_dirty = False
+
+        get_latency_monitor().frame_presented()
+
+
+_display_updater = DisplayUpdater()
+
+
+# Group the drawing done between begin_frame() and end_frame() into a single display update
+# Frames may be nested: the display is updated when the outermost frame ends
+def begin_frame():
+    _display_updater.begin_frame()
+
+
+def end_frame():
+    _display_updater.end_frame()
+
+
+# Push the parts of the pygame screen in 'rects' (everything, if None) out to the display
+# If 'surface' is given, and is an off-screen Surface rather than the display, there is nothing to do
+def update_display(rects=None, surface=None):
+    if surface is not None and surface is not pygame.display.get_surface():
+        return
+
+    _display_updater.update(rects)
+
 
 # HACK: Don't really need a whole class that only uses __init__() do we?
 class screen_colour_fill(object):
@@ -271,6 +573,5 @@ class screen_colour_fill(object):
 
         screen.fill(colour, rectangle)
 
-        screen.blit(screen, (0, 0))
-        pygame.display.flip()
+        update_display([pygame.Rect(rectangle)], screen)
 
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Class to remember what is on the photo server, so uploads can skip files that are already there
+# The manifest is a local JSON file of the remote files' paths, sizes and content hashes. The
+#    directories we upload into are re-listed (in a single round trip) once their listing is older
+#    than config.remote_manifest_max_age_secs, which also catches files changed by anyone else.
+# The manifest is for one server (its transport's target): if the booth is pointed at another one,
+#    the manifest is started afresh.
+
+import os
+import json
+import time
+
+from FileHandler import write_json_atomically
+
+import config
+
+
+class RemoteManifest(object):
+    'A local record of the files in the remote directories that the booth uploads into'
+
+    def __init__(self, manifest_file, target):
+        self.manifest_file = manifest_file
+        self.target = target
+
+        # Remote file path: {'size': ..., 'hash': ...} (hash is None for files we didn't upload)
+        self.files = {}
+        # Remote dir path: time it was last listed
+        self.listed_dirs = {}
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_file) as in_file:
+                manifest = json.load(in_file)
+            if manifest['target'] != self.target:
+                print "Remote manifest is for " + manifest['target'] + ", not " + self.target + ": starting afresh"
+                raise ValueError('manifest is for another server')
+            self.files = manifest['files']
+            self.listed_dirs = manifest['listed_dirs']
+        except (IOError, ValueError, KeyError):
+            # Start afresh: the first upload will list everything
+            self.files = {}
+            self.listed_dirs = {}
+
+    def save(self):
+        try:
+            write_json_atomically(self.manifest_file, {'target': self.target, 'files': self.files,
+                                                       'listed_dirs': self.listed_dirs})
+        except EnvironmentError as e:
+            print "Error saving remote manifest: ", e
+
+    # refresh()
+    # Re-list any of remote_dirs whose listing is missing or out of date, using one round trip.
+    # Returns the remote_dirs that don't exist (as far as we know), and need creating.
+    def refresh(self, transport, remote_dirs):
+        now = time.time()
+        remote_dirs = [os.path.normpath(remote_dir) for remote_dir in remote_dirs]
+
+        stale_dirs = [remote_dir for remote_dir in remote_dirs
+                      if now - self.listed_dirs.get(remote_dir, 0) > config.remote_manifest_max_age_secs]
+
+        if len(stale_dirs) > 0:
+            listings = transport.list_files(stale_dirs)
+
+            for remote_dir in stale_dirs:
+                self.update_dir(remote_dir, listings.get(remote_dir))
+
+        return [remote_dir for remote_dir in remote_dirs if self.listed_dirs.get(remote_dir) is None]
+
+    # Bring our record of remote_dir in line with its listing: {filename: size}, or None if it doesn't exist
+    def update_dir(self, remote_dir, listing):
+        if listing is None:
+            # Doesn't exist (yet): keep it unlisted, so it is created and listed again next time
+            self.listed_dirs.pop(remote_dir, None)
+            listing = {}
+        else:
+            self.listed_dirs[remote_dir] = time.time()
+
+        for remote_filepath in [curr_path for curr_path in self.files
+                                if os.path.dirname(curr_path) == remote_dir]:
+            remote_size = listing.get(os.path.basename(remote_filepath))
+            if remote_size != self.files[remote_filepath]['size']:
+                # Gone, or changed by someone else
+                del self.files[remote_filepath]
+
+        for filename, remote_size in listing.items():
+            remote_filepath = os.path.join(remote_dir, filename)
+            if remote_filepath not in self.files:
+                self.files[remote_filepath] = {'size': remote_size, 'hash': None}
+
+    # Note that remote_dirs have been created (they are empty, as far as we know)
+    def add_dirs(self, remote_dirs):
+        for remote_dir in remote_dirs:
+            self.listed_dirs[os.path.normpath(remote_dir)] = time.time()
+
+    def has_file(self, remote_filepath):
+        return os.path.normpath(remote_filepath) in self.files
+
+    # True if remote_filepath is already a copy of the local file with the given size and hash
+    def is_unchanged(self, remote_filepath, size, file_hash):
+        remote_file = self.files.get(os.path.normpath(remote_filepath))
+        return remote_file is not None and remote_file['size'] == size and remote_file['hash'] == file_hash
+
+    def add_file(self, remote_filepath, size, file_hash):
+        self.files[os.path.normpath(remote_filepath)] = {'size': size, 'hash': file_hash}
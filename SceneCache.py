@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Classes to compose whole booth screens off-screen, and keep them for instant re-display
+
+import os
+import threading
+
+import pygame
+
+import config
+from PrintOnScreen import SurfaceCache, update_display, warm_image_cache
+
+
+class Scene(object):
+    'A whole booth screen, drawn onto a full-screen Surface by draw_function(surface)'
+
+    # 'inputs' are any values that change what the scene looks like (e.g. the text it shows),
+    # 'files' are the image files it draws: the scene is redrawn if any of them change
+    def __init__(self, name, draw_function, inputs=(), files=()):
+        self.name = name
+        self.draw_function = draw_function
+        self.inputs = tuple(inputs)
+        self.files = tuple(files)
+
+    def get_key(self):
+        file_mtimes = tuple((curr_file, os.path.getmtime(curr_file)) for curr_file in self.files)
+        return (self.name, self.inputs, file_mtimes)
+
+
+class SceneCache(object):
+    'Composes Scenes into off-screen Surfaces once, so that showing one is a single blit and update'
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.surfaces = SurfaceCache(config.scene_cache_max_bytes)
+
+        # Scenes being rendered in the background, by key
+        self.rendering = {}
+        self.lock = threading.Lock()
+
+        # UI images to load into the image cache, the first time the main thread waits
+        self.images_to_preload = []
+
+    # Put the scene on the display, composing it first if it isn't cached
+    def show(self, scene):
+        surface = self.get_surface(scene)
+
+        self.screen.blit(surface, (0, 0))
+        update_display()
+
+    def get_surface(self, scene):
+        key = scene.get_key()
+
+        # If the scene is being pre-rendered, let that finish rather than starting again
+        with self.lock:
+            render_thread = self.rendering.get(key)
+        if render_thread is not None:
+            render_thread.join()
+
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.render(scene, key)
+
+        return surface
+
+    # prerender()
+    # Compose the scene in a background thread, ready for a later show().
+    # pygame drawing isn't thread safe, so only call this when the main thread is about to wait
+    #    (e.g. for a button press) rather than draw.
+    def prerender(self, scene):
+        key = scene.get_key()
+
+        with self.lock:
+            if key in self.rendering or self.surfaces.get(key) is not None:
+                return
+
+            render_thread = threading.Thread(target=self.render, args=(scene, key))
+            render_thread.daemon = True
+            self.rendering[key] = render_thread
+            render_thread.start()
+
+    def set_images_to_preload(self, image_files):
+        with self.lock:
+            self.images_to_preload = list(image_files)
+
+    # preload_images()
+    # Load the images given to set_images_to_preload() (if not done already) into the image cache,
+    #    in a background thread. As with prerender(), only call this when the main thread is about to wait.
+    def preload_images(self):
+        with self.lock:
+            image_files = self.images_to_preload
+            self.images_to_preload = []
+            if len(image_files) < 1 or 'preload_images' in self.rendering:
+                return
+
+            preload_thread = threading.Thread(target=self.run_preload, args=(image_files,))
+            preload_thread.daemon = True
+            self.rendering['preload_images'] = preload_thread
+            preload_thread.start()
+
+    def run_preload(self, image_files):
+        try:
+            warm_image_cache(image_files)
+        finally:
+            with self.lock:
+                self.rendering.pop('preload_images', None)
+
+    # Wait for any background rendering to finish, before the main thread draws again
+    def finish_prerendering(self):
+        with self.lock:
+            render_threads = list(self.rendering.values())
+
+        for render_thread in render_threads:
+            render_thread.join()
+
+    def render(self, scene, key):
+        try:
+            surface = pygame.Surface(self.screen.get_size(), 0, self.screen)
+            scene.draw_function(surface)
+            self.surfaces.put(key, surface)
+        finally:
+            with self.lock:
+                self.rendering.pop(key, None)
+
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Class to process the photos while the guest is still deciding whether to tweet them
+# The review screen can sit there for a while, so we use the time to do everything that accepting
+#    the photos would do: prepare the upload images, and hash and copy the photos into the tweet outbox.
+#    If the guest accepts, that work is simply picked up; if they reject, it is thrown away.
+
+import threading
+
+
+class SpeculativeProcessing(object):
+    'Prepares and stages a set of photos in a background thread, in case the guest accepts them'
+
+    # tweet_files are the photos that would be tweeted
+    def __init__(self, photohandler, tweetoutbox, image_extension, image_defs, tweet_files):
+        self.photohandler = photohandler
+        self.tweetoutbox = tweetoutbox
+        self.image_extension = image_extension
+        self.image_defs = image_defs
+        self.tweet_files = tweet_files
+
+        self.thread = None
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+        # Photo filepath: tweet_hash, for each photo staged in the outbox
+        self.staged_tweets = {}
+        self.images_prepared = False
+        self.error = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            if self.cancelled.is_set():
+                return
+
+            self.photohandler.prepare_images(self.image_extension, self.image_defs, True)
+            self.images_prepared = True
+
+            for curr_img in self.tweet_files:
+                if self.cancelled.is_set():
+                    break
+
+                tweet_hash = self.tweetoutbox.stage(curr_img)
+                with self.lock:
+                    self.staged_tweets[curr_img] = tweet_hash
+
+        except Exception as e:
+            # Whatever didn't get done here is done again when the photos are accepted
+            print "Error processing photos in advance: ", e
+            self.error = e
+
+        # If the guest rejected the photos while we were busy, tidy up after ourselves
+        if self.cancelled.is_set():
+            self.discard_staged_tweets()
+
+    # wait()
+    # Wait for the processing to finish (the guest has accepted the photos).
+    # Returns True if the upload images were prepared, get_staged_tweets() has the photos that were staged
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+        return self.images_prepared
+
+    def get_staged_tweets(self):
+        with self.lock:
+            return dict(self.staged_tweets)
+
+    # The guest has rejected the photos: stop as soon as possible, and discard anything staged.
+    #    Doesn't wait for a photo that is part way through being processed (see wait())
+    def cancel(self):
+        self.cancelled.set()
+
+        if self.thread is None or not self.thread.is_alive():
+            self.discard_staged_tweets()
+
+    def discard_staged_tweets(self):
+        with self.lock:
+            staged_tweets = self.staged_tweets
+            self.staged_tweets = {}
+
+        for curr_img, tweet_hash in staged_tweets.items():
+            self.tweetoutbox.discard_staged(curr_img, tweet_hash)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Class to write a ZIP archive to a stream (e.g. a pipe to the photo server) as it is produced
+# zipfile needs to seek back to fill in each entry's header, so it can't write to a pipe (in Python 2).
+#    This writer never seeks:
+#    - files that are already compressed (JPEG, PNG, GIF) are stored as they are. We read them once
+#      for their CRC before writing the header, which is much cheaper than deflating them for nothing
+#    - anything else is deflated as it is written, with its CRC and sizes in a data descriptor after it
+# ZIP format reference: https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+# (No ZIP64, so entries and the archive are limited to 4GB, which is plenty for a set of photos)
+
+import os
+import time
+import zlib
+import struct
+import hashlib
+
+# Extensions of files that won't get any smaller by deflating them
+stored_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.zip')
+
+chunk_size = 64 * 1024
+
+zip_version = 20
+zip_made_by = (3 << 8) | zip_version  # Unix, so that the file permissions below are used
+flag_data_descriptor = 0x08
+method_stored = 0
+method_deflated = 8
+
+
+class StreamingZipWriter(object):
+    'Writes a ZIP archive to out_file, which only needs a write() method'
+
+    def __init__(self, out_file, compress_level=6):
+        self.out_file = out_file
+        self.compress_level = compress_level
+
+        # Everything written so far, for the central directory (and the file's size and hash, for uploads)
+        self.offset = 0
+        self.entries = []
+        self.hash = hashlib.sha1()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def get_size(self):
+        return self.offset
+
+    # The SHA-1 of the whole archive (once it has been closed)
+    def get_hash(self):
+        return self.hash.hexdigest()
+
+    # Add the file at filepath to the archive as arcname (its filename by default)
+    def write_file(self, filepath, arcname=None):
+        if arcname is None:
+            arcname = os.path.basename(filepath)
+        arcname = arcname.replace(os.sep, '/')
+        if not isinstance(arcname, bytes):
+            arcname = arcname.encode('utf-8')
+
+        dos_time, dos_date = get_dos_time(os.path.getmtime(filepath))
+
+        if os.path.splitext(filepath)[1].lower() in stored_extensions:
+            self.write_stored(filepath, arcname, dos_time, dos_date)
+        else:
+            self.write_deflated(filepath, arcname, dos_time, dos_date)
+
+    def write_stored(self, filepath, arcname, dos_time, dos_date):
+        crc = 0
+        size = 0
+        with open(filepath, 'rb') as in_file:
+            for chunk in iter(lambda: in_file.read(chunk_size), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        crc &= 0xffffffff
+
+        entry = [arcname, 0, method_stored, dos_time, dos_date, crc, size, size, self.offset]
+        self.write_local_header(entry)
+
+        with open(filepath, 'rb') as in_file:
+            for chunk in iter(lambda: in_file.read(chunk_size), b''):
+                self.write(chunk)
+
+        self.entries.append(entry)
+
+    def write_deflated(self, filepath, arcname, dos_time, dos_date):
+        entry = [arcname, flag_data_descriptor, method_deflated, dos_time, dos_date, 0, 0, 0, self.offset]
+        self.write_local_header(entry)
+
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        crc = 0
+        size = 0
+        compressed_size = 0
+
+        with open(filepath, 'rb') as in_file:
+            for chunk in iter(lambda: in_file.read(chunk_size), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+
+                compressed = compressor.compress(chunk)
+                compressed_size += len(compressed)
+                self.write(compressed)
+
+        compressed = compressor.flush()
+        compressed_size += len(compressed)
+        self.write(compressed)
+
+        entry[5:8] = [crc & 0xffffffff, compressed_size, size]
+        self.write(struct.pack('<4sLLL', b'PK\x07\x08', entry[5], entry[6], entry[7]))
+
+        self.entries.append(entry)
+
+    def write_local_header(self, entry):
+        arcname, flags, method, dos_time, dos_date, crc, compressed_size, size, offset = entry
+
+        self.write(struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', zip_version, flags, method, dos_time, dos_date,
+                               crc, compressed_size, size, len(arcname), 0))
+        self.write(arcname)
+
+    # Write the central directory, which finishes the archive (out_file is left open)
+    def close(self):
+        central_dir_offset = self.offset
+
+        for arcname, flags, method, dos_time, dos_date, crc, compressed_size, size, offset in self.entries:
+            self.write(struct.pack('<4sHHHHHHLLLHHHHHLL', b'PK\x01\x02', zip_made_by, zip_version, flags, method,
+                                   dos_time, dos_date, crc, compressed_size, size, len(arcname), 0, 0, 0, 0,
+                                   0o644 << 16, offset))
+            self.write(arcname)
+
+        central_dir_size = self.offset - central_dir_offset
+        self.write(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, len(self.entries), len(self.entries),
+                               central_dir_size, central_dir_offset, 0))
+
+    def write(self, data):
+        self.out_file.write(data)
+        self.hash.update(data)
+        self.offset += len(data)
+
+
+# Convert a timestamp to the (time, date) pair that ZIP files use
+def get_dos_time(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Classes to copy files to the photo server
+# A transport is opened once per batch of uploads, so the batch shares one connection:
+#    SshTransport  - one multiplexed SSH connection (ControlMaster), which every command and copy reuses
+#    LocalTransport - copies into a local directory that stands in for the server, for tests and benchmarks
+
+import os
+import shutil
+import tempfile
+import subprocess
+
+# Thanks http://stackoverflow.com/questions/26790916/python-3-backward-compatability-shlex-quote-vs-pipes-quote
+try:
+    from shlex import quote as cmd_quote
+except ImportError:
+    from pipes import quote as cmd_quote
+
+
+class SshTransport(object):
+    'Copies files to remote_account over a single SSH connection'
+
+    def __init__(self, remote_account):
+        self.remote_account = remote_account
+        self.control_dir = None
+        self.control_path = None
+
+    # Identifies the server, so that what we know about one isn't used for another
+    def get_target(self):
+        return 'ssh:' + self.remote_account
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Make the connection (the only SSH handshake for the batch), in the background
+    def open(self):
+        self.control_dir = tempfile.mkdtemp(prefix='tweetBooth-ssh-')
+        self.control_path = os.path.join(self.control_dir, 'master')
+
+        subprocess.check_call(['ssh', '-M', '-S', self.control_path, '-f', '-N',
+                               '-o', 'ControlPersist=no', self.remote_account])
+
+    def close(self):
+        if self.control_path is None:
+            return
+
+        try:
+            subprocess.call(['ssh', '-S', self.control_path, '-O', 'exit', self.remote_account])
+        finally:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
+            self.control_path = None
+
+    # Run a shell command on the server, over the shared connection
+    def run(self, command):
+        subprocess.check_call(['ssh', '-S', self.control_path, self.remote_account, command])
+
+    # Ensure all of remote_dirs exist, in one round trip
+    def make_dirs(self, remote_dirs):
+        if len(remote_dirs) > 0:
+            self.run('mkdir -p ' + ' '.join(cmd_quote(remote_dir) for remote_dir in remote_dirs))
+
+    # list_files()
+    # List the files in each of remote_dirs, in one round trip.
+    # Returns {remote dir: {filename: size}}, without the dirs that don't exist
+    def list_files(self, remote_dirs):
+        quoted_dirs = ' '.join(cmd_quote(remote_dir) for remote_dir in remote_dirs)
+        listing = subprocess.check_output(['ssh', '-S', self.control_path, self.remote_account,
+                                           'for d in ' + quoted_dirs + '; do if [ -d "$d" ]; then echo "/$d"; '
+                                           'find "$d" -maxdepth 1 -type f -printf "%f\\t%s\\n"; fi; done'])
+
+        listings = {}
+        curr_dir = None
+        for line in listing.splitlines():
+            if line.startswith('/'):
+                curr_dir = line[1:]
+                listings[curr_dir] = {}
+            elif curr_dir is not None and '\t' in line:
+                filename, size = line.rsplit('\t', 1)
+                listings[curr_dir][filename] = int(size)
+
+        return listings
+
+    def put_file(self, local_filepath, remote_filepath):
+        subprocess.check_call(['scp', '-q', '-o', 'ControlPath=' + self.control_path, local_filepath,
+                               self.remote_account + ':' + cmd_quote(remote_filepath)])
+
+    # put_stream()
+    # Create remote_filepath from whatever write_stream(out_file) writes to out_file, which is piped
+    #    straight to the server as it is written (so there is no local copy of the file).
+    #    Returns whatever write_stream returns
+    def put_stream(self, remote_filepath, write_stream):
+        process = subprocess.Popen(['ssh', '-S', self.control_path, self.remote_account,
+                                    'cat > ' + cmd_quote(remote_filepath)], stdin=subprocess.PIPE)
+        try:
+            result = write_stream(process.stdin)
+        finally:
+            process.stdin.close()
+            returncode = process.wait()
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, 'cat > ' + remote_filepath)
+
+        return result
+
+
+class LocalTransport(object):
+    'Copies files into root_dir, which stands in for the server (remote paths are taken relative to it)'
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def get_target(self):
+        return 'local:' + os.path.abspath(self.root_dir)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if not os.path.isdir(self.root_dir):
+            os.makedirs(self.root_dir)
+
+    def close(self):
+        pass
+
+    def get_local_path(self, remote_path):
+        return os.path.join(self.root_dir, remote_path.lstrip(os.sep))
+
+    def make_dirs(self, remote_dirs):
+        for remote_dir in remote_dirs:
+            local_dir = self.get_local_path(remote_dir)
+            if not os.path.isdir(local_dir):
+                os.makedirs(local_dir)
+
+    def list_files(self, remote_dirs):
+        listings = {}
+        for remote_dir in remote_dirs:
+            local_dir = self.get_local_path(remote_dir)
+            if not os.path.isdir(local_dir):
+                continue
+
+            listings[remote_dir] = {}
+            for filename in os.listdir(local_dir):
+                local_filepath = os.path.join(local_dir, filename)
+                if os.path.isfile(local_filepath):
+                    listings[remote_dir][filename] = os.path.getsize(local_filepath)
+
+        return listings
+
+    def put_file(self, local_filepath, remote_filepath):
+        shutil.copyfile(local_filepath, self.get_local_path(remote_filepath))
+
+    def put_stream(self, remote_filepath, write_stream):
+        with open(self.get_local_path(remote_filepath), 'wb') as out_file:
+            return write_stream(out_file)
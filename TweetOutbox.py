@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# Class to tweet photos in the background, from a queue kept on disk
+# Accepted photos are queued in the outbox directory, so the guest never waits for (or loses a photo to)
+#    the venue Wi-Fi. A worker thread posts them with retries, and anything still queued when the
+#    booth is switched off is posted after it restarts.
+#
+# Outbox layout, where <hash> is the SHA-1 of the photo's contents:
+#    <hash>.jpg / <hash>.gif  - the photo to post
+#    <hash>.json              - the queued tweet (written last, so a tweet is only queued once it is complete)
+#                               A photo without one has only been staged (see stage()), or was left by a power cut
+#    sent/<hash>.json         - a posted tweet, so the same photo is never posted twice
+#    failed/<hash>.json       - a tweet that can never be posted as it is (e.g. Twython or auth.py is missing,
+#                               the credentials are refused, or it is a duplicate), with its last_error.
+#                               To try again, move it (and its photo, in failed/) back into the outbox
+
+import os
+import json
+import time
+import random
+import socket
+import threading
+
+from FileHandler import write_json_atomically, copy_file_atomically, get_file_hash
+import config
+
+
+# connect_to_twitter()
+# Twython is only imported when we first tweet, so the booth starts without waiting for it.
+# If config.twitter_api_url is set, every request goes there instead (e.g. to FakeTwitter.py)
+def connect_to_twitter():
+    from twython import Twython
+    from auth import (
+        consumer_key,
+        consumer_secret,
+        access_token,
+        access_token_secret
+    )
+
+    twitter = Twython(consumer_key, consumer_secret, access_token, access_token_secret)
+
+    if config.twitter_api_url is not None:
+        twitter.api_url = config.twitter_api_url + '/%s'
+        twitter_request = twitter.request
+
+        def local_request(endpoint, *args, **kwargs):
+            for twitter_host in ('https://api.twitter.com', 'https://upload.twitter.com'):
+                if endpoint.startswith(twitter_host):
+                    endpoint = config.twitter_api_url + endpoint[len(twitter_host):]
+            return twitter_request(endpoint, *args, **kwargs)
+
+        twitter.request = local_request
+
+    return twitter
+
+
+# is_transient_error()
+# True if posting a tweet failed in a way that may go away by itself (the network, or Twitter being down
+#    or rate limiting us), so it is worth trying again later
+def is_transient_error(e):
+    try:
+        from twython import TwythonError
+    except ImportError:
+        TwythonError = None
+
+    if TwythonError is not None and isinstance(e, TwythonError):
+        # Twython reports a failed connection without an error code
+        return e.error_code is None or e.error_code == 429 or e.error_code >= 500
+
+    try:
+        from requests import RequestException
+    except ImportError:
+        RequestException = None
+
+    if RequestException is not None and isinstance(e, RequestException):
+        return True
+
+    return isinstance(e, socket.error)
+
+
+class TweetOutbox(object):
+    'A durable queue of tweets, posted by a background thread with retries and exponential backoff'
+
+    # Media uploaded to Twitter can be attached to a tweet for a day, reuse it for a while on retries
+    media_id_max_age_secs = 60 * 60
+
+    def __init__(self, outbox_dir):
+        self.outbox_dir = outbox_dir
+        self.sent_dir = os.path.join(outbox_dir, 'sent')
+        self.failed_dir = os.path.join(outbox_dir, 'failed')
+
+        for curr_dir in (self.outbox_dir, self.sent_dir, self.failed_dir):
+            if not os.path.isdir(curr_dir):
+                os.makedirs(curr_dir)
+
+        self.twitter = None
+        self.running = False
+        self.worker = None
+        self.condition = threading.Condition()
+
+        self.remove_partial_files()
+
+    # enqueue()
+    # Queue the photo at filepath to be tweeted with message. Returns False if that photo has
+    #    already been queued or sent. Once this returns, the tweet survives a restart.
+    # If the photo has been staged, pass the tweet_hash that stage() returned, so it isn't read again
+    def enqueue(self, filepath, message, tweet_hash=None):
+        if tweet_hash is None:
+            tweet_hash = get_file_hash(filepath)
+
+        with self.condition:
+            if self.is_known(tweet_hash):
+                print "Tweet already queued (or sent): " + filepath
+                return False
+
+            media_file = self.get_media_filename(tweet_hash, filepath)
+            media_filepath = os.path.join(self.outbox_dir, media_file)
+            if not os.path.isfile(media_filepath):
+                copy_file_atomically(filepath, media_filepath)
+
+            write_json_atomically(self.get_tweet_filepath(tweet_hash), {
+                'message': message,
+                'media_file': media_file,
+                'queued_time': time.time(),
+                'attempts': 0,
+                'next_attempt_time': 0,
+            })
+
+            # Wake the worker
+            self.condition.notify()
+
+        print "Tweet queued: " + filepath
+        return True
+
+    # stage()
+    # Do the slow part of enqueue() ahead of time (e.g. while the guest decides whether to tweet):
+    #    hash the photo at filepath and copy it into the outbox, without queueing it.
+    #    Returns the tweet_hash to pass to enqueue() or discard_staged()
+    def stage(self, filepath):
+        tweet_hash = get_file_hash(filepath)
+
+        media_filepath = os.path.join(self.outbox_dir, self.get_media_filename(tweet_hash, filepath))
+        with self.condition:
+            if not self.is_known(tweet_hash) and not os.path.isfile(media_filepath):
+                copy_file_atomically(filepath, media_filepath)
+
+        return tweet_hash
+
+    # Remove a staged photo that isn't going to be tweeted after all
+    def discard_staged(self, filepath, tweet_hash):
+        with self.condition:
+            if not os.path.isfile(self.get_tweet_filepath(tweet_hash)):
+                self.remove_file(os.path.join(self.outbox_dir, self.get_media_filename(tweet_hash, filepath)))
+
+    def get_num_queued(self):
+        with self.condition:
+            return len(self.get_queued_hashes())
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+
+        self.worker = threading.Thread(target=self.run_worker)
+        self.worker.daemon = True
+        self.worker.start()
+
+    # Stop the worker (anything still queued will be posted after the next start())
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def run_worker(self):
+        while True:
+            with self.condition:
+                tweet_hash, wait_secs = self.get_next_due()
+                while self.running and tweet_hash is None:
+                    self.condition.wait(wait_secs)
+                    tweet_hash, wait_secs = self.get_next_due()
+
+                if not self.running:
+                    return
+
+                tweet = self.load_tweet(tweet_hash)
+
+            if tweet is not None:
+                self.post_tweet(tweet_hash, tweet)
+
+    # Must be called with self.condition held
+    # Return the hash of the queued tweet that is due to be posted soonest, if it is due now, and how long
+    #    to wait for the next one otherwise (None if nothing is queued)
+    def get_next_due(self):
+        now = time.time()
+        next_hash = None
+        next_time = None
+
+        for tweet_hash in self.get_queued_hashes():
+            tweet = self.load_tweet(tweet_hash)
+            if tweet is None:
+                continue
+
+            if next_time is None or tweet['next_attempt_time'] < next_time:
+                next_hash = tweet_hash
+                next_time = tweet['next_attempt_time']
+
+        if next_time is None:
+            return None, None
+        if next_time <= now:
+            return next_hash, 0
+        return None, next_time - now
+
+    def post_tweet(self, tweet_hash, tweet):
+        media_filepath = os.path.join(self.outbox_dir, tweet['media_file'])
+
+        if not os.path.isfile(media_filepath):
+            print "Error tweeting photo: " + tweet['media_file'] + " is missing from the outbox"
+            self.give_up(tweet_hash, tweet, 'Photo missing from outbox: ' + tweet['media_file'])
+            return
+
+        try:
+            if self.twitter is None:
+                self.twitter = connect_to_twitter()
+
+            # If an earlier attempt uploaded the photo, but failed to tweet it, don't upload it again
+            media_id = tweet.get('media_id')
+            if media_id is None or time.time() - tweet.get('media_time', 0) > self.media_id_max_age_secs:
+                with open(media_filepath, 'rb') as photo:
+                    response = self.twitter.upload_media(media=photo)
+                media_id = response['media_id']
+
+                tweet['media_id'] = media_id
+                tweet['media_time'] = time.time()
+                with self.condition:
+                    write_json_atomically(self.get_tweet_filepath(tweet_hash), tweet)
+
+            response = self.twitter.update_status(status=tweet['message'], media_ids=[media_id])
+
+        except Exception as e:
+            print "Error tweeting photo (attempt " + str(tweet['attempts'] + 1) + "): ", e
+            self.twitter = None
+
+            # If the Wi-Fi or Twitter is down, try again later; anything else will fail every time
+            if is_transient_error(e):
+                self.retry_later(tweet_hash, tweet, str(e))
+            else:
+                self.give_up(tweet_hash, tweet, str(e))
+            return
+
+        with self.condition:
+            write_json_atomically(os.path.join(self.sent_dir, tweet_hash + '.json'), {
+                'message': tweet['message'],
+                'tweet_id': response.get('id'),
+                'queued_time': tweet['queued_time'],
+                'sent_time': time.time(),
+            })
+            self.remove_file(self.get_tweet_filepath(tweet_hash))
+            self.remove_file(media_filepath)
+
+        print "Photo tweeted: " + str(response.get('id'))
+
+    def retry_later(self, tweet_hash, tweet, error_message):
+        tweet['attempts'] += 1
+        tweet['last_error'] = error_message
+
+        # Back off exponentially, with some jitter so that several booths don't retry in step
+        backoff_secs = min(config.tweet_retry_base_secs * (2 ** (tweet['attempts'] - 1)),
+                           config.tweet_retry_max_secs)
+        tweet['next_attempt_time'] = time.time() + backoff_secs * random.uniform(1.0, 1.25)
+
+        with self.condition:
+            write_json_atomically(self.get_tweet_filepath(tweet_hash), tweet)
+
+    # Move a tweet that can't be posted out of the queue, into failed_dir
+    def give_up(self, tweet_hash, tweet, error_message):
+        tweet['attempts'] += 1
+        tweet['last_error'] = error_message
+        tweet['failed_time'] = time.time()
+
+        media_filepath = os.path.join(self.outbox_dir, tweet['media_file'])
+
+        with self.condition:
+            if os.path.isfile(media_filepath):
+                os.rename(media_filepath, os.path.join(self.failed_dir, tweet['media_file']))
+            write_json_atomically(os.path.join(self.failed_dir, tweet_hash + '.json'), tweet)
+            self.remove_file(self.get_tweet_filepath(tweet_hash))
+
+        print "Gave up tweeting photo " + tweet['media_file'] + ", moved to " + self.failed_dir
+
+    # Must be called with self.condition held
+    def is_known(self, tweet_hash):
+        return (os.path.isfile(self.get_tweet_filepath(tweet_hash)) or
+                os.path.isfile(os.path.join(self.sent_dir, tweet_hash + '.json')))
+
+    # Must be called with self.condition held
+    def get_queued_hashes(self):
+        return sorted(os.path.splitext(filename)[0] for filename in os.listdir(self.outbox_dir)
+                      if filename.endswith('.json') and not filename.startswith('.'))
+
+    def load_tweet(self, tweet_hash):
+        try:
+            with open(self.get_tweet_filepath(tweet_hash)) as in_file:
+                return json.load(in_file)
+        except (IOError, ValueError) as e:
+            print "Error reading queued tweet " + tweet_hash + ": ", e
+            return None
+
+    def get_tweet_filepath(self, tweet_hash):
+        return os.path.join(self.outbox_dir, tweet_hash + '.json')
+
+    # The name of the outbox's copy of the photo at filepath
+    def get_media_filename(self, tweet_hash, filepath):
+        return tweet_hash + os.path.splitext(filepath)[1].lower()
+
+    # Tidy up after a power cut: temporary files, and photos whose tweet was never queued
+    def remove_partial_files(self):
+        queued_hashes = set(self.get_queued_hashes())
+
+        for filename in os.listdir(self.outbox_dir):
+            filepath = os.path.join(self.outbox_dir, filename)
+            if not os.path.isfile(filepath):
+                continue
+
+            if filename.startswith('.tmp-') or os.path.splitext(filename)[0] not in queued_hashes:
+                self.remove_file(filepath)
+
+    def remove_file(self, filepath):
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
@@ -2,6 +2,7 @@
 # Common global variable configuration file
 
 import os
+import tempfile
 
 # Set up variables to reference the GPIO pins we will use
 led_pin_select = 16
@@ -12,16 +13,98 @@ led_pin_right = 17
 button_pin_right = 27
 button_pin_exit = 5
 
+# Which hardware backend to drive: 'pi' for the real booth, 'sim' to simulate the buttons, camera
+#    and screen (e.g. TWEETBOOTH_BACKEND=sim TWEETBOOTH_SIM_BUTTONS="2:s 2:s 3:s 2:r" python tweetBooth.py)
+hardware_backend = os.environ.get('TWEETBOOTH_BACKEND', 'pi')
+sim_display_size = (1024, 600)
+
+# Button edges closer together than this are treated as contact bounce
+button_bounce_ms = 200
+
 # Set up some colour constants
 black_colour = (0, 0, 0)
 off_black_colour = (5, 5, 5)
 white_colour = (250, 250, 250)
 blue_colour = (40, 70, 200)
 
+# Only push the parts of the screen that have changed to the display, rather than the whole screen
+dirty_rect_rendering = True
+
+# Memory allowed for caching rendered lines of text, and loaded images
+text_cache_max_bytes = 4 * 1024 * 1024
+image_cache_max_bytes = 32 * 1024 * 1024
+
+# Memory allowed for keeping pre-composed whole screens (each is a full screen of pixels)
+scene_cache_max_bytes = 24 * 1024 * 1024
+
+# Memory allowed for keeping photos decoded at review screen size, so showing one again is instant
+review_cache_max_bytes = 8 * 1024 * 1024
+# ... and for keeping finished contact sheets of photos (each is a full screen of pixels)
+contact_sheet_cache_max_bytes = 8 * 1024 * 1024
+
+# Keep the camera running for this long after a guest, so the next one doesn't wait for it to start
+camera_idle_timeout_secs = 600
+# Reuse the exposure and white balance the camera settled on, for up to this long
+camera_settings_max_age_secs = 1800
+
+# Number of processes for processing photos (None for one per CPU core), and where they share pixels
+image_worker_processes = None
+shared_memory_dir = os.path.join(os.sep, 'dev', 'shm')
+
+# Photos are captured into memory, and encoded to JPEG (once) at this quality
+photo_jpeg_quality = 85
+
+# Disk space allowed for keeping processed photos and archives, so that retries don't process them again
+derivative_cache_max_bytes = 200 * 1024 * 1024
+
+# When a function takes a burst of photos, only tweet the best few: the sharpest and best exposed,
+#    leaving out near-duplicates (photos whose small greyscale copies differ by less than the RMS below)
+best_shot_count = 1
+best_shot_luma_width = 320
+best_shot_duplicate_rms = 4.0
+
+# Tweet an animated GIF of a burst of photos, rather than a still photo:
+#    None for still photos, 'gif' for an animation, or 'boomerang' to play the burst forwards then backwards
+animated_photo_mode = None
+animated_frames = 8
+animated_frame_delay_secs = 0.1
+animated_gif_frame_ms = 150
+# Twitter's size limit for GIFs
+animated_gif_max_bytes = 5 * 1024 * 1024
+
+# What each tweet says
+tweet_message = '#CVconference with Team @RiosRoadRunners! #YouBelong #RiosRocks @ErinGassaway @LizLoether @CajonValleyUSD'
+
+# Queued tweets that fail are retried after tweet_retry_base_secs, doubling each time up to tweet_retry_max_secs
+tweet_retry_base_secs = 15
+tweet_retry_max_secs = 15 * 60
+
+# Send tweets to a stand-in server rather than Twitter (e.g. TWEETBOOTH_TWITTER_URL=http://127.0.0.1:8765,
+#    with FakeTwitter.py running)
+twitter_api_url = os.environ.get('TWEETBOOTH_TWITTER_URL')
+
+# How photos are uploaded to the photo server: 'ssh', or 'local' to copy them into local_transport_dir instead
+upload_transport = os.environ.get('TWEETBOOTH_UPLOAD', 'ssh')
+local_transport_dir = os.path.join(os.sep, 'tmp', 'tweetBooth-server')
+# How long to trust our record of the files on the photo server, before listing them again
+remote_manifest_max_age_secs = 6 * 60 * 60
+
 # Set the screen saver constants
 screen_saver_seconds = 300
 
+# Where button-to-photon latency statistics are written at exit (or on SIGUSR1)
+latency_report_file = os.path.join(os.sep, 'tmp', 'tweetBooth-latency.json')
+
 # Paths for photo storage
+# Where the booth keeps its photos, tweet outbox and caches. The simulated backend defaults to a
+#    temporary directory, so that it runs on any machine (e.g. TWEETBOOTH_HOME=~/booth to choose one)
+local_base_dir = os.environ.get('TWEETBOOTH_HOME')
+if local_base_dir is None:
+    if hardware_backend == 'sim':
+        local_base_dir = os.path.join(tempfile.gettempdir(), 'tweetBooth-sim-%d' % os.getuid())
+    else:
+        local_base_dir = os.path.join(os.sep, 'home', 'pi', 'tweetBooth')
+local_base_dir = os.path.expanduser(local_base_dir)
 
 
 
@@ -54,3 +137,7 @@ menu_side_overlay_image = os.path.join(images_dir, 'menu_side.png')
 
 start_overlay_image = os.path.join(images_dir, 'start.png')
 start_overlay_image_bk_black = os.path.join(images_dir, 'start_bk-black.png')
+
+# Pre-decoded bundle of all the images above (and the accompaniment images), built by AssetBundle.py
+asset_bundle_file = os.path.join('assets', 'ui_bundle.bin')
+asset_manifest_file = os.path.join('assets', 'ui_bundle.json')
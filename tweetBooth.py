@@ -8,7 +8,9 @@ import os
 
 from PhotoBooth import PhotoBooth
 from Menus import Menus
-from Photo import TwitterPhoto
+from Photo import TwitterPhoto, AnimatedPhoto
+
+import config
 
 menus = None
 photobooth = None
@@ -22,7 +24,10 @@ try:
     menus = Menus(photobooth)
 
     # Add each Photo Booth function to the Main Menu
-    menus.add_main_menu_item(TwitterPhoto(photobooth))
+    if config.animated_photo_mode is not None:
+        menus.add_main_menu_item(AnimatedPhoto(photobooth, config.animated_photo_mode == 'boomerang'))
+    else:
+        menus.add_main_menu_item(TwitterPhoto(photobooth))
 
     while True:
         menus.display_main_menu()